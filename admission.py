@@ -0,0 +1,92 @@
+"""Per-client rate limits for the routes that cost upstream quota.
+
+Every client has a token bucket per kind of request ("chat" for turns that
+call Gemini, "tts" for speech): it refills at rate tokens a second up to
+burst, and each request takes one. A request finding its bucket empty is
+turned away with 429 and a Retry-After of when the next token arrives.
+
+Every request is charged to its IP address's bucket, and when the session
+cookie has a conversation id, to that conversation's bucket as well. A new
+conversation id never starts a client over with a full burst, so a script
+that drops its cookie is still held to its address's rate. Many users
+behind one NAT share an address: address_share gives the address buckets
+that many times the rate and burst of a conversation's.
+
+Buckets are kept for the max_clients most recent clients; one that is
+forgotten comes back full.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    def __init__(self, rate, burst, max_clients=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()  # client -> (tokens, last refill)
+        self.lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def take(self, client):
+        # 0 if the request may go ahead, otherwise whole seconds until it could
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+                self.allowed += 1
+            else:
+                wait = max(1, math.ceil((1 - tokens) / self.rate))
+                self.limited += 1
+            self.buckets[client] = (tokens, now)
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        with self.lock:
+            return {
+                "clients": len(self.buckets),
+                "allowed": self.allowed,
+                "limited": self.limited
+            }
+
+
+class ClientRateLimit:
+    def __init__(self, rate, burst, address_share=1, max_clients=100000):
+        self.by_address = RateLimiter(rate * address_share, burst * address_share, max_clients)
+        self.by_session = RateLimiter(rate, burst, max_clients)
+
+    @property
+    def enabled(self):
+        return self.by_session.enabled
+
+    def take(self, sid, address):
+        # The address pays first; a request it turns away costs the
+        # conversation nothing
+        wait = self.by_address.take(address or "unknown")
+        if wait or not sid:
+            return wait
+        return self.by_session.take(sid)
+
+    def stats(self):
+        address, session = self.by_address.stats(), self.by_session.stats()
+        return {
+            "clients": address["clients"],
+            "sessions": session["clients"],
+            # Requests past the address bucket, less those a conversation's stopped
+            "allowed": address["allowed"] - session["limited"],
+            "limited": address["limited"] + session["limited"]
+        }
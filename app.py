@@ -1,75 +1,429 @@
-from flask import Flask, render_template_string, request, jsonify
+from flask import Flask, render_template_string, request, jsonify, Response, abort, session, g
 import google.generativeai as genai
 import os
 from dotenv import load_dotenv
 import requests
 import json
+import base64
+import concurrent.futures
+import contextvars
+import functools
+import logging
+import queue
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from speech_pipeline import SpeechPipeline
+from audio_bank import AudioBank
+from tts_cache import TTSCache, cache_key
+import shared_cache
+import speech_formats
+from upstream import ConcurrencyLimit, UpstreamClient, UpstreamBusyError
+from admission import ClientRateLimit
+from static_assets import AssetRegistry, page
+from avatar_assets import AVATAR_NAME, AVATAR_URL, VENDOR_DIR, VENDOR_SCRIPTS
+from response_cache import ResponseCache, normalize_input
+from sessions import SessionStore
+from singleflight import SingleFlight
+import lipsync
+from structured_logging import setup_logging, request_id
+from metrics import (
+    REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, Counter, Gauge, ServerTiming, current_timing,
+    record_timing, stage, stats_metrics, error_kind, HTTP_REQUESTS_IN_FLIGHT, HTTP_REQUEST_SECONDS,
+    HTTP_REQUEST_BYTES, LLM_FIRST_TOKEN_SECONDS, LLM_SECONDS, TTS_FIRST_BYTE_SECONDS,
+    TTS_SECONDS, TTS_BYTES, ENCODE_SECONDS, UPSTREAM_IN_FLIGHT, UPSTREAM_ERRORS
+)
 
-print("Loading environment variables...")
 load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.secret_key = 'your_secret_key'
-
-# Configure API keys
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+app.secret_key = os.getenv("FLASK_SECRET_KEY", 'your_secret_key')
+
+# Configure API keys. GEMINI_API_ENDPOINT and ELEVENLABS_BASE_URL point the
+# app at other servers, e.g. the stand-ins in bench/fake_upstreams.py
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+if GEMINI_API_ENDPOINT:
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"), transport="rest",
+                    client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+else:
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 ELEVEN_LABS_API_KEY = os.getenv("ELEVEN_LABS_API_KEY")
+ELEVENLABS_BASE_URL = os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io")
+
+# How many sentences of one reply may be synthesized at the same time
+TTS_MAX_CONCURRENCY = int(os.getenv("TTS_MAX_CONCURRENCY", 3))
+
+logger.info("ElevenLabs API key configured: %s", "yes" if ELEVEN_LABS_API_KEY else "no")
+
+# Longest upstream error body kept in a log record
+LOG_DETAILS_CHARS = 500
+
+# ElevenLabs API endpoint (using "Josh" voice - you can change this ID)
+VOICE_ID = "CwhRBWXzGAHq8TQ4Fs17"  # Josh voice ID
+VOICE_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.5
+}
+# Shared keep-alive connection pool for ElevenLabs, with timeouts, retries on
+# 429/5xx and a cap on how many TTS calls may be in flight at once. Calls
+# over the cap wait at most ELEVENLABS_QUEUE_TIMEOUT seconds, in a line of
+# at most ELEVENLABS_MAX_QUEUE (default twice the cap).
+elevenlabs = UpstreamClient(
+    ELEVENLABS_BASE_URL,
+    pool_size=int(os.getenv("ELEVENLABS_POOL_SIZE", 16)),
+    max_in_flight=int(os.getenv("ELEVENLABS_MAX_IN_FLIGHT", 16)),
+    connect_timeout=float(os.getenv("ELEVENLABS_CONNECT_TIMEOUT", 3.05)),
+    read_timeout=float(os.getenv("ELEVENLABS_READ_TIMEOUT", 30)),
+    retries=int(os.getenv("ELEVENLABS_RETRIES", 2)),
+    queue_timeout=float(os.getenv("ELEVENLABS_QUEUE_TIMEOUT", 5)),
+    max_queue=int(os.getenv("ELEVENLABS_MAX_QUEUE", 0)) or None,
+    name="elevenlabs"
+)
+# Connections opened to ElevenLabs at startup
+ELEVENLABS_WARM_CONNECTIONS = int(os.getenv("ELEVENLABS_WARM_CONNECTIONS", 2))
+
+# Identical requests in flight at the same time share one upstream call
+tts_flight = SingleFlight("tts")
+llm_flight = SingleFlight("llm")
+
+# Output format, model and latency tier for requests that don't pick their
+# own (see speech_formats). mp3_44100_128 is what "Accept: audio/mpeg" got
+# before formats were negotiable, so existing cache entries stay valid.
+TTS_DEFAULTS = speech_formats.defaults(
+    os.getenv("TTS_OUTPUT_FORMAT", "mp3_44100_128"),
+    os.getenv("TTS_MODEL_ID", "eleven_multilingual_v2"),
+    os.getenv("TTS_STREAMING_LATENCY", 0)
+)
+
+# Storage shared by the worker processes of a multi-worker server (see
+# shared_cache and gunicorn.conf.py), e.g. sqlite:///.cache/shared.db.
+# When it is set, the TTS and lip-sync caches don't keep their own disk
+# directories unless TTS_CACHE_DIR / LIPSYNC_CACHE_DIR ask for them.
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "")
+shared_backend = shared_cache.open_backend(
+    SHARED_CACHE_URL, int(os.getenv("SHARED_CACHE_MAX_MB", 1024)) * 1024 * 1024)
+
+
+def cache_dir(variable, default):
+    return os.getenv(variable, "" if shared_backend else default)
+
+
+# Synthesized audio is cached in memory and on disk, keyed by text and voice
+tts_cache = TTSCache(
+    cache_dir("TTS_CACHE_DIR", os.path.join(".cache", "tts")),
+    memory_max_bytes=int(os.getenv("TTS_CACHE_MEMORY_MB", 32)) * 1024 * 1024,
+    disk_max_bytes=int(os.getenv("TTS_CACHE_DISK_MB", 512)) * 1024 * 1024,
+    shared=shared_backend
+)
+
+# Lip-sync timelines sent with the audio. With LIPSYNC=1 (the default) clips
+# are requested with character timestamps and the timeline built from them
+# is cached under the clip's key.
+LIPSYNC = os.getenv("LIPSYNC", "1") == "1"
+LIPSYNC_FRAME_MS = int(os.getenv("LIPSYNC_FRAME_MS", lipsync.FRAME_MS))
+lipsync_cache = TTSCache(
+    cache_dir("LIPSYNC_CACHE_DIR", os.path.join(".cache", "lipsync")),
+    memory_max_bytes=4 * 1024 * 1024,
+    disk_max_bytes=64 * 1024 * 1024,
+    shared=shared_backend,
+    namespace="lipsync"
+)
+
+
+class TextToSpeechError(Exception):
+    def __init__(self, status_code, details):
+        super().__init__(f"ElevenLabs API error: {status_code}")
+        self.status_code = status_code
+        self.details = details
+
+
+def speech_options(params, accept_header=None):
+    # The request's output format, model and latency tier; raises ValueError
+    # for ones we can't produce
+    return speech_formats.negotiate(TTS_DEFAULTS, params, accept_header)
+
+
+def speech_text(params):
+    # The text of a TTS request's JSON body; raises ValueError when the body
+    # isn't an object or its text isn't a non-empty string
+    if not isinstance(params, dict):
+        raise ValueError('Expected a JSON object with a "text" string')
+    text = params.get('text')
+    if not text:
+        raise ValueError("No text provided")
+    if not isinstance(text, str):
+        raise ValueError('"text" must be a string')
+    return text
+
+
+def speech_cache_key(text, options=None):
+    options = options or TTS_DEFAULTS
+    return cache_key(text, VOICE_ID, options.model_id, VOICE_SETTINGS, options.format.name,
+                     options.latency)
+
+
+def cached_speech(key):
+    # A banked phrase, or a clip we have synthesized before; None otherwise
+    clip = audio_bank.get(key)
+    return clip.audio if clip is not None else tts_cache.get(key)
+
+
+def synthesize_speech(text, options=None):
+    # Returns the audio bytes for text, from the cache when we have said it before
+    key = speech_cache_key(text, options)
+    audio = cached_speech(key)
+    if audio is None:
+        audio = tts_flight.do(key, lambda: fetch_speech(text, key, options))
+    return audio
+
+
+def fetch_speech(text, key, options=None):
+    audio, alignment = request_speech(text, options, timestamps=LIPSYNC)
+    tts_cache.put(key, audio)
+    store_lipsync(key, audio, alignment, options)
+    return audio
+
+
+def store_lipsync(key, audio, alignment, options=None):
+    duration = (options or TTS_DEFAULTS).format.duration(len(audio))
+    timeline = lipsync.from_alignment(alignment, duration, LIPSYNC_FRAME_MS)
+    if timeline is not None:
+        lipsync_cache.put(key, json.dumps(timeline).encode('utf-8'))
+
+
+def speech_lipsync(text, audio, key=None, options=None):
+    # The timeline built from ElevenLabs' alignment if we have one, otherwise
+    # one estimated from the text
+    if not LIPSYNC:
+        return None
+    key = key or speech_cache_key(text, options)
+    banked = audio_bank.lipsync(key)
+    if banked is not None:
+        return banked
+    cached = lipsync_cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    duration = (options or TTS_DEFAULTS).format.duration(len(audio))
+    return lipsync.estimate(text, duration, LIPSYNC_FRAME_MS)
+
+
+def speech_request(text, options=None, stream=False, timestamps=False):
+    # Path, headers and JSON body of an ElevenLabs text-to-speech call
+    options = options or TTS_DEFAULTS
+    path = f"/v1/text-to-speech/{VOICE_ID}" + ("/stream" if stream else "")
+    if timestamps:
+        path += "/with-timestamps"
+    query = {"output_format": options.format.name}
+    if options.latency:
+        query["optimize_streaming_latency"] = options.latency
+    path += "?" + urlencode(query)
+    
+    headers = {
+        "Accept": "application/json" if timestamps else options.format.accept,
+        "Content-Type": "application/json",
+        "xi-api-key": ELEVEN_LABS_API_KEY
+    }
+    
+    data = {
+        "text": text,
+        "model_id": options.model_id,
+        "voice_settings": VOICE_SETTINGS
+    }
+    return path, headers, data
+
+
+def request_speech(text, options=None, timestamps=False):
+    # Returns (audio bytes, character alignment or None) for text, raises
+    # TextToSpeechError on API errors
+    path, headers, data = speech_request(text, options, timestamps=timestamps)
+
+    logger.debug("Sending request to ElevenLabs API", extra={"path": path, "sampled": True})
+    with UPSTREAM_IN_FLIGHT.track(upstream="elevenlabs"), stage("tts", TTS_SECONDS, mode="full"):
+        try:
+            response = elevenlabs.post(path, json=data, headers=headers)
+        except UpstreamBusyError:
+            # Turned away by our own admission control, which counts it
+            raise
+        except requests.RequestException as e:
+            UPSTREAM_ERRORS.inc(upstream="elevenlabs", kind=error_kind(e))
+            raise
+    
+    if response.status_code != 200:
+        UPSTREAM_ERRORS.inc(upstream="elevenlabs", kind=str(response.status_code))
+        logger.warning("ElevenLabs API error", extra={
+            "status": response.status_code, "details": response.text[:LOG_DETAILS_CHARS]})
+        raise TextToSpeechError(response.status_code, response.text)
+
+    if timestamps:
+        # JSON with the audio in base64 and per-character start/end times
+        body = response.json()
+        audio = base64.b64decode(body["audio_base64"])
+        alignment = body.get("alignment")
+    else:
+        audio, alignment = response.content, None
+    TTS_BYTES.observe(len(audio))
+    return audio, alignment
+
+
+# Streamed audio is passed through in chunks of this size
+AUDIO_CHUNK_SIZE = 16 * 1024
+
+
+def open_speech_stream(text, options=None):
+    # Opens ElevenLabs' streaming endpoint, raises TextToSpeechError on API
+    # errors. The caller reads the audio with iter_content and closes it.
+    path, headers, data = speech_request(text, options, stream=True)
+
+    logger.debug("Sending streaming request to ElevenLabs API", extra={"path": path, "sampled": True})
+    with stage("tts_ttfb", TTS_FIRST_BYTE_SECONDS):
+        try:
+            response = elevenlabs.post(path, json=data, headers=headers, stream=True)
+        except UpstreamBusyError:
+            # Turned away by our own admission control, which counts it
+            raise
+        except requests.RequestException as e:
+            UPSTREAM_ERRORS.inc(upstream="elevenlabs", kind=error_kind(e))
+            raise
+
+    if response.status_code != 200:
+        UPSTREAM_ERRORS.inc(upstream="elevenlabs", kind=str(response.status_code))
+        details = response.text
+        response.close()
+        logger.warning("ElevenLabs API error", extra={
+            "status": response.status_code, "details": details[:LOG_DETAILS_CHARS]})
+        raise TextToSpeechError(response.status_code, details)
+
+    return response
+
+
+def iter_speech_stream(upstream, key=None):
+    # Relays the upstream chunks; once the whole clip has come through it is
+    # stored in the cache under key
+    chunks = []
+    try:
+        for chunk in upstream.iter_content(chunk_size=AUDIO_CHUNK_SIZE):
+            if chunk:
+                if key:
+                    chunks.append(chunk)
+                yield chunk
+        if key:
+            tts_cache.put(key, b"".join(chunks))
+    finally:
+        upstream.close()
+
+
+def stream_speech(text, key=None, options=None):
+    # open_speech_stream and iter_speech_stream, measured as one TTS call
+    start = time.perf_counter()
+    size = 0
+    with UPSTREAM_IN_FLIGHT.track(upstream="elevenlabs"):
+        for chunk in iter_speech_stream(open_speech_stream(text, options), key):
+            size += len(chunk)
+            yield chunk
+    TTS_SECONDS.observe(time.perf_counter() - start, mode="stream")
+    TTS_BYTES.observe(size)
 
-print(f"ELEVEN_LABS_API_KEY configured: {'yes' if ELEVEN_LABS_API_KEY else 'no'}")
 
 # Add this new route for text-to-speech
 @app.route('/text-to-speech', methods=['POST'])
 def text_to_speech():
     try:
-        text = request.json.get('text', '')
-        if not text:
-            return jsonify({"error": "No text provided"}), 400
-            
-        if not ELEVEN_LABS_API_KEY:
-            return jsonify({"error": "ElevenLabs API key not configured"}), 500
-
-        # ElevenLabs API endpoint (using "Josh" voice - you can change this ID)
-        VOICE_ID = "CwhRBWXzGAHq8TQ4Fs17"  # Josh voice ID
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{VOICE_ID}"
-        
-        headers = {
-            "Accept": "audio/mpeg",
-            "Content-Type": "application/json",
-            "xi-api-key": ELEVEN_LABS_API_KEY
-        }
-        
-        data = {
-            "text": text,
-            "model_id": "eleven_multilingual_v2",
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.5
-            }
-        }
-
-        print(f"Sending request to ElevenLabs API: {url}")  # Debug log
-        response = requests.post(url, json=data, headers=headers)
-        
-        if response.status_code != 200:
-            print(f"ElevenLabs API error: {response.status_code} - {response.text}")  # Debug log
-            return jsonify({
-                "error": f"ElevenLabs API error: {response.status_code}",
-                "details": response.text
-            }), 500
+        params = request.get_json(silent=True)
+        try:
+            text = speech_text(params)
+            # Accept describes the JSON response here, so only the body counts
+            options = speech_options(params)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        key = speech_cache_key(text, options)
+        audio = cached_speech(key)
+        if audio is None:
+            if not ELEVEN_LABS_API_KEY:
+                return jsonify({"error": "ElevenLabs API key not configured"}), 500
+
+            try:
+                audio = tts_flight.do(key, lambda: fetch_speech(text, key, options))
+            except TextToSpeechError as e:
+                return jsonify({
+                    "error": str(e),
+                    "details": e.details
+                }), 500
+            except UpstreamBusyError as e:
+                return busy_response(e)
 
         # Convert audio data to base64
-        import base64
-        audio_base64 = base64.b64encode(response.content).decode('utf-8')
-        return jsonify({"audio": audio_base64})
+        with stage("encode", ENCODE_SECONDS):
+            audio_base64 = base64.b64encode(audio).decode('utf-8')
+        return jsonify({
+            "audio": audio_base64,
+            "format": options.format.name,
+            "content_type": options.format.content_type,
+            "lipsync": speech_lipsync(text, audio, key, options)
+        })
             
     except Exception as e:
-        import traceback
-        print(f"Error in text-to-speech: {str(e)}")  # Debug log
-        print(traceback.format_exc())  # Print full stack trace
+        logger.exception("Error in text-to-speech")
+        body = {"error": str(e)}
+        if app.debug:
+            import traceback
+            body["stack_trace"] = traceback.format_exc()
+        return jsonify(body), 500
+
+# Streaming variant of /text-to-speech: proxies the ElevenLabs audio as a
+# chunked response instead of base64 in JSON, so the browser can start
+# playing before the last byte arrives. The Content-Type is the negotiated
+# format's, which X-Audio-Format names.
+@app.route('/text-to-speech/stream', methods=['POST'])
+def text_to_speech_stream():
+    params = request.get_json(silent=True)
+    try:
+        text = speech_text(params)
+        options = speech_options(params, request.headers.get("Accept"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    key = speech_cache_key(text, options)
+    audio = cached_speech(key)
+    if audio is not None:
+        headers = {
+            "Cache-Control": "no-store",
+            "X-Audio-Format": options.format.name,
+            "X-Cache": "HIT"
+        }
+        # The whole clip is known, so its lip-sync timeline can go with it
+        timeline = speech_lipsync(text, audio, key, options)
+        if timeline is not None:
+            headers["X-Lipsync"] = json.dumps(timeline)
+        return Response(audio, content_type=options.format.content_type, headers=headers)
+
+    if not ELEVEN_LABS_API_KEY:
+        return jsonify({"error": "ElevenLabs API key not configured"}), 500
+
+    # Concurrent requests for the same clip all read one upstream stream
+    shared = tts_flight.stream(key, lambda: stream_speech(text, key, options))
+    error = shared.wait_started()
+    if isinstance(error, TextToSpeechError):
         return jsonify({
-            "error": str(e),
-            "stack_trace": traceback.format_exc()
+            "error": str(error),
+            "details": error.details
         }), 500
+    if isinstance(error, UpstreamBusyError):
+        return busy_response(error)
+    if error is not None:
+        logger.error("Error in text-to-speech stream", exc_info=error)
+        return jsonify({"error": str(error)}), 502
+
+    return Response(iter(shared), content_type=options.format.content_type,
+                    direct_passthrough=True, headers={
+                        "Cache-Control": "no-store",
+                        "X-Audio-Format": options.format.name,
+                        "X-Cache": "MISS"
+                    })
 
 # Generation settings for Gemini
 generation_config = {
@@ -79,285 +433,160 @@ generation_config = {
     "max_output_tokens": 2048,
 }
 
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>AI Chat Assistant</title>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/three.js/r128/three.min.js"></script>
-    <script src="https://cdn.jsdelivr.net/npm/three@0.128.0/examples/js/loaders/GLTFLoader.js"></script>
-    <script src="https://cdn.jsdelivr.net/npm/three@0.128.0/examples/js/controls/OrbitControls.js"></script>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
-    <style>
-        * { 
-            margin: 0; 
-            padding: 0; 
-            box-sizing: border-box; 
-            font-family: 'Inter', sans-serif;
-        }
-
-        body {
-            background: linear-gradient(120deg, #f6f7f9 0%, #e9eef5 100%);
-            min-height: 100vh;
-        }
-
-        #chat-container { 
-            display: flex; 
-            height: 100vh;
-            max-width: 1600px;
-            margin: 0 auto;
-            box-shadow: 0 15px 40px rgba(0,0,0,0.08);
-            border-radius: 24px;
-            overflow: hidden;
-            background: #ffffff;
-        }
-
-        #character-container { 
-            flex: 1.4;
-            background: linear-gradient(145deg, #ffffff 0%, #f8fafd 100%);
-            position: relative;
-            margin: 0;
-            padding: 0;
-        }
-
-        #chat-interface {
-            width: 450px;
-            padding: 32px;
-            background: #ffffff;
-            display: flex;
-            flex-direction: column;
-            box-shadow: -5px 0 25px rgba(0,0,0,0.03);
-            margin: 0;
-        }
-
-        #chat-header {
-            padding-bottom: 24px;
-            border-bottom: 2px solid #f0f2f5;
-            margin-bottom: 24px;
-        }
-
-        #chat-header h1 {
-            font-size: 28px;
-            color: #1a1f36;
-            font-weight: 600;
-            margin-bottom: 8px;
-        }
-
-        #chat-header p {
-            font-size: 15px;
-            color: #64748b;
-            line-height: 1.5;
-        }
-
-        #chat-messages {
-            flex: 1;
-            overflow-y: auto;
-            padding: 10px 5px;
-            display: flex;
-            flex-direction: column;
-            gap: 16px;
-        }
-
-        .message {
-            max-width: 85%;
-            padding: 14px 18px;
-            border-radius: 16px;
-            font-size: 15px;
-            line-height: 1.5;
-            position: relative;
-            transition: transform 0.2s ease;
-        }
-
-        .message:hover {
-            transform: translateY(-1px);
-        }
-
-        .user-message {
-            background: linear-gradient(135deg, #2563eb 0%, #3b82f6 100%);
-            color: white;
-            align-self: flex-end;
-            border-bottom-right-radius: 4px;
-            box-shadow: 0 4px 15px rgba(37, 99, 235, 0.1);
-        }
-
-        .ai-message {
-            background: #f8fafc;
-            color: #1e293b;
-            align-self: flex-start;
-            border-bottom-left-radius: 4px;
-            box-shadow: 0 4px 15px rgba(0, 0, 0, 0.03);
-        }
-
-        #input-container {
-            margin-top: 24px;
-            position: relative;
-            display: flex;
-            gap: 8px;
-            align-items: center;
-            width: 100%;
-        }
-
-        #user-input {
-            flex: 1;
-            padding: 16px;
-            border: 2px solid #e2e8f0;
-            border-radius: 16px;
-            font-size: 15px;
-            transition: all 0.3s ease;
-            outline: none;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.02);
-            min-width: 0; /* Prevents input from overflowing */
-        }
+GEMINI_MODEL_NAME = "gemini-1.0-pro"
+
+# The same cap, line and deadline for Gemini calls, which go through its SDK
+gemini_slots = ConcurrencyLimit(
+    "gemini",
+    int(os.getenv("GEMINI_MAX_IN_FLIGHT", 16)),
+    max_queue=int(os.getenv("GEMINI_MAX_QUEUE", 0)) or None,
+    max_wait=float(os.getenv("GEMINI_QUEUE_TIMEOUT", 5))
+)
+
+# GenerativeModel instances are reused for the life of the process, one per
+# (model name, generation config)
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(model_name=GEMINI_MODEL_NAME, config=None):
+    config = generation_config if config is None else config
+    key = (model_name, json.dumps(config, sort_keys=True))
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                model = genai.GenerativeModel(
+                    model_name=model_name,
+                    generation_config=config
+                )
+                _models[key] = model
+    return model
+
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+
+def embed_text(text):
+    return genai.embed_content(model=EMBEDDING_MODEL, content=text)["embedding"]
+
+
+# Replies are cached by normalized input. Setting
+# RESPONSE_CACHE_SEMANTIC_THRESHOLD (cosine similarity, e.g. 0.92) also
+# answers close paraphrases of earlier questions.
+_semantic_threshold = os.getenv("RESPONSE_CACHE_SEMANTIC_THRESHOLD")
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000)),
+    ttl=int(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+    embed=embed_text,
+    semantic_threshold=float(_semantic_threshold) if _semantic_threshold else None,
+    semantic_max_entries=int(os.getenv("RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES", 1000)),
+    shared=shared_backend
+)
+
+# Generation settings for conversation summaries
+summary_config = {
+    "temperature": 0.2,
+    "max_output_tokens": 256,
+}
 
-        #send-button {
-            padding: 16px 24px;
-            background: linear-gradient(135deg, #2563eb 0%, #3b82f6 100%);
-            color: white;
-            border: none;
-            border-radius: 16px;
-            cursor: pointer;
-            font-weight: 500;
-            font-size: 15px;
-            transition: all 0.3s ease;
-            box-shadow: 0 4px 15px rgba(37, 99, 235, 0.1);
-            white-space: nowrap;
-        }
 
-        #mic-button {
-            padding: 16px 24px;
-            background: linear-gradient(135deg, #2563eb 0%, #3b82f6 100%);
-            color: white;
-            border: none;
-            border-radius: 16px;
-            cursor: pointer;
-            font-weight: 500;
-            font-size: 15px;
-            transition: all 0.3s ease;
-            box-shadow: 0 4px 15px rgba(37, 99, 235, 0.1);
-            white-space: nowrap;
-        }
+def summarize_conversation(summary, turns):
+    prompt = f"""Summarize this conversation between a user and an AI assistant in at most 80 words.
+            Keep names, facts, preferences and open questions. Write the summary in Hindi.
+            Earlier summary: {summary or "(none)"}
+            Conversation:
+            {turns}"""
+    return get_model(config=summary_config).generate_content(prompt).text
 
-        /* Updated responsive styles */
-        @media (max-width: 600px) {
-            #input-container {
-                flex-wrap: wrap;
-                gap: 8px;
-            }
-
-            #user-input {
-                width: 100%;
-                flex: 100%;
-            }
-
-            #send-button, #mic-button {
-                flex: 1;
-                padding: 16px 12px;
-                font-size: 14px;
-            }
-        }
 
-        /* Scrollbar Styling */
-        ::-webkit-scrollbar {
-            width: 8px;
-        }
+# Per-session conversation memory: the last SESSION_MAX_TURNS turns plus a
+# rolling summary of older ones, fitted into SESSION_HISTORY_TOKENS
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", 1500))
+conversations = SessionStore(
+    summarize=summarize_conversation,
+    max_turns=int(os.getenv("SESSION_MAX_TURNS", 6)),
+    max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", 10000)),
+    max_total_bytes=int(os.getenv("SESSION_MAX_TOTAL_MB", 64)) * 1024 * 1024,
+    max_session_bytes=int(os.getenv("SESSION_MAX_KB", 32)) * 1024,
+    idle_ttl=int(os.getenv("SESSION_IDLE_TTL", 1800))
+)
 
-        ::-webkit-scrollbar-track {
-            background: #f1f5f9;
-            border-radius: 4px;
-        }
+# Warm-up state reported by /readyz
+warm_up_status = {"ready": False, "gemini": None, "elevenlabs": None, "audio_bank": None}
+_warm_up_started = threading.Event()
 
-        ::-webkit-scrollbar-thumb {
-            background: #cbd5e1;
-            border-radius: 4px;
-            transition: background 0.3s ease;
-        }
-
-        ::-webkit-scrollbar-thumb:hover {
-            background: #94a3b8;
-        }
-
-        /* Loading Animation */
-        .loading {
-            display: inline-flex;
-            gap: 4px;
-            margin-left: 8px;
-        }
 
-        .loading span {
-            width: 6px;
-            height: 6px;
-            background-color: #3b82f6;
-            border-radius: 50%;
-            animation: bounce 0.5s infinite alternate;
-        }
+def warm_up():
+    # Open the Gemini channel and the ElevenLabs connections before the first
+    # user needs them. Failures are reported but don't block readiness.
+    try:
+        get_model().count_tokens("नमस्ते")
+        warm_up_status["gemini"] = "ok"
+    except Exception as e:
+        logger.warning("Gemini warm-up failed: %s", e)
+        warm_up_status["gemini"] = f"error: {str(e)}"
 
-        .loading span:nth-child(2) { animation-delay: 0.15s; }
-        .loading span:nth-child(3) { animation-delay: 0.3s; }
+    if ELEVEN_LABS_API_KEY:
+        def open_connection():
+            response = elevenlabs.get("/v1/models", headers={"xi-api-key": ELEVEN_LABS_API_KEY})
+            response.close()
 
-        @keyframes bounce {
-            to { transform: translateY(-4px); }
-        }
+        try:
+            # Concurrent requests so the pool keeps several live connections
+            with ThreadPoolExecutor(max_workers=ELEVENLABS_WARM_CONNECTIONS) as executor:
+                for future in [executor.submit(open_connection) for _ in range(ELEVENLABS_WARM_CONNECTIONS)]:
+                    future.result()
+            warm_up_status["elevenlabs"] = "ok"
+        except Exception as e:
+            logger.warning("ElevenLabs warm-up failed: %s", e)
+            warm_up_status["elevenlabs"] = f"error: {str(e)}"
+    else:
+        warm_up_status["elevenlabs"] = "skipped"
 
-        /* Responsive Design */
-        @media (max-width: 1200px) {
-            #chat-container {
-                border-radius: 0;
-                height: 100vh;
-            }
+    warm_up_status["audio_bank"] = warm_up_audio_bank()
+    warm_up_status["ready"] = True
+    logger.info("Warm-up finished", extra={"status": dict(warm_up_status)})
 
-            #character-container {
-                flex: 1;
-            }
 
-            #chat-interface {
-                width: 400px;
-            }
-        }
+def warm_up_audio_bank():
+    # Synthesizes the bank phrases that are missing; returns the status
+    if not (ELEVEN_LABS_API_KEY and AUDIO_BANK_BUILD_ON_START):
+        return "skipped"
+    try:
+        built = build_audio_bank()
+    except Exception as e:
+        logger.warning("Audio bank warm-up failed: %s", e)
+        return f"error: {str(e)}"
+    return f"ok: {built} clips synthesized, {len(audio_bank.clips)} in the bank"
 
-        @media (max-width: 900px) {
-            #chat-container {
-                flex-direction: column;
-            }
 
-            #character-container {
-                height: 40vh;
-            }
+def start_warm_up():
+    # Once per process, in the background
+    if _warm_up_started.is_set():
+        return
+    _warm_up_started.set()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
 
-            #chat-interface {
-                width: 100%;
-                height: 60vh;
-            }
-        }
-
-        @media (max-width: 600px) {
-            #chat-interface {
-                padding: 20px;
-            }
-
-            #chat-header h1 {
-                font-size: 24px;
-            }
-
-            .message {
-                max-width: 90%;
-                padding: 12px 16px;
-            }
-
-            #speak-button {
-                bottom: 20px;
-                right: 20px;
-                width: 54px;
-                height: 54px;
-            }
-        }
-    </style>
+HTML_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>AI Chat Assistant</title>
+    <link rel="preload" href="{{ avatar_url }}" as="fetch" crossorigin="anonymous">
+    {% for name, cdn_url in vendor_scripts.items() %}
+    <script src="{{ asset_url('vendor/' + name, cdn_url) }}" defer></script>
+    {% endfor %}
+    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
+    <link rel="stylesheet" href="{{ asset_url('style.css') }}">
     <link rel="shortcut icon" href="#">
 </head>
 <body>
     <div id="chat-container">
-        <div id="character-container"></div>
+        <div id="character-container" data-avatar-url="{{ avatar_url }}"></div>
         <div id="chat-interface">
             <div id="chat-header">
                 <h1>AI Assistant</h1>
@@ -372,955 +601,722 @@ HTML_TEMPLATE = '''
         </div>
     </div>
 
-    <script>
-        // Add this global variable at the start of your script (before any functions)
-        let isSpeaking = false;
-        let facialAnimations;
-
-        // Scene setup
-        const scene = new THREE.Scene();
-        scene.background = new THREE.Color(0xffffff); // Set to white
-
-        // Get the character container dimensions
-        const container = document.getElementById('character-container');
-        const containerWidth = container.clientWidth;
-        const containerHeight = container.clientHeight;
-
-        // Camera setup specifically for half-body framing
-        const camera = new THREE.PerspectiveCamera(35, containerWidth / containerHeight, 0.1, 1000);
-        camera.position.set(0, 1.6, 2.5);
-
-        // Renderer setup - match container size exactly
-        const renderer = new THREE.WebGLRenderer({ antialias: true });
-        renderer.setSize(containerWidth, containerHeight);
-        renderer.shadowMap.enabled = true;
-        renderer.outputEncoding = THREE.sRGBEncoding;
-        document.getElementById('character-container').appendChild(renderer.domElement);
-
-        // Add resize handler to keep canvas matched to container
-        window.addEventListener('resize', () => {
-            const newWidth = container.clientWidth;
-            const newHeight = container.clientHeight;
-            camera.aspect = newWidth / newHeight;
-            camera.updateProjectionMatrix();
-            renderer.setSize(newWidth, newHeight);
-        });
-
-        // Restricted controls for better framing
-        const controls = new THREE.OrbitControls(camera, renderer.domElement);
-        controls.enablePan = false;
-        controls.enableZoom = false;
-        controls.minPolarAngle = Math.PI/2.2; // Restrict vertical rotation
-        controls.maxPolarAngle = Math.PI/1.8;
-        controls.minAzimuthAngle = -Math.PI/4; // Restrict horizontal rotation
-        controls.maxAzimuthAngle = Math.PI/4;
-        controls.target.set(0, 1.5, 0);
-        controls.update();
-
-        // Enhanced lighting for better visuals
-        const ambientLight = new THREE.AmbientLight(0xffffff, 0.5);
-        scene.add(ambientLight);
-
-        const mainLight = new THREE.DirectionalLight(0xffffff, 1);
-        mainLight.position.set(5, 5, 5);
-        scene.add(mainLight);
-
-        const fillLight = new THREE.DirectionalLight(0xffffff, 0.3);
-        fillLight.position.set(-5, 0, 5);
-        scene.add(fillLight);
-
-        // Animation system
-        const clock = new THREE.Clock();
-        let mixer;
-        let character;
-        let morphTargetMeshes = [];
-        let currentExpression = { mouthOpen: 0, mouthSmile: 0 };
-        let targetExpression = { mouthOpen: 0, mouthSmile: 0 };
-
-        // Smooth animation parameters
-        const LERP_FACTOR = 0.2;
-        const EXPRESSION_SMOOTHING = 0.25;
-
-        // Define more varied mouth shapes for speaking
-        const mouthShapes = [
-            { mouthOpen: 0.2, mouthSmile: 0.1, mouthRound: 0.1 },  // slight open
-            { mouthOpen: 0.4, mouthSmile: 0.2, mouthRound: 0.2 },  // medium open
-            { mouthOpen: 0.7, mouthSmile: 0.1, mouthRound: 0.1 },  // wide open
-            { mouthOpen: 0.3, mouthSmile: 0.4, mouthRound: 0.1 },  // smile speak
-            { mouthOpen: 0.5, mouthSmile: 0.1, mouthRound: 0.6 },  // round O shape
-            { mouthOpen: 0.1, mouthSmile: 0.2, mouthRound: 0.1 },  // nearly closed
-        ];
-
-        // Update the facial animation setup function
-        function setupFacialAnimations(character) {
-            let faceMeshes = [];
-            let currentState = {
-                mouthOpen: 0,
-                mouthSmile: 0.1,
-                mouthRound: 0,
-                eyebrowRaise: 0,
-                eyesClosed: 0
-            };
-            let targetState = { ...currentState };
-            let lastMouthUpdate = Date.now();
-            let currentMouthShape = 0;
-            
-            // Find meshes with morph targets
-            character.traverse((node) => {
-                if (node.morphTargetDictionary) {
-                    faceMeshes.push(node);
-                }
-            });
-
-            function updateFacialExpression(delta) {
-                if (!isSpeaking && !isTransitioning()) {
-                    // Return to neutral position when not speaking
-                    targetState = {
-                        mouthOpen: 0.1,
-                        mouthSmile: 0.1,
-                        mouthRound: 0.1,
-                        eyebrowRaise: 0,
-                        eyesClosed: 0
-                    };
-                } else if (isSpeaking) {
-                    // Update mouth shape every 100-200ms for natural variation
-                    const now = Date.now();
-                    if (now - lastMouthUpdate > 100 + Math.random() * 100) {
-                        // Randomly select next mouth shape
-                        currentMouthShape = Math.floor(Math.random() * mouthShapes.length);
-                        targetState = {
-                            ...mouthShapes[currentMouthShape],
-                            eyebrowRaise: Math.random() * 0.3,  // Random eyebrow movement
-                            eyesClosed: 0
-                        };
-                        lastMouthUpdate = now;
-                    }
-                }
-
-                // Smooth interpolation to target state
-                Object.keys(currentState).forEach(key => {
-                    currentState[key] = THREE.MathUtils.lerp(
-                        currentState[key],
-                        targetState[key],
-                        delta * 15
-                    );
-                });
-
-                // Add subtle random movements during speech
-                if (isSpeaking) {
-                    const time = Date.now() * 0.001;
-                    const subtleMovement = Math.sin(time * 10) * 0.05;
-                    currentState.mouthOpen += subtleMovement;
-                    currentState.eyebrowRaise += subtleMovement * 0.2;
-                }
-
-                // Apply to all face meshes
-                faceMeshes.forEach(mesh => {
-                    Object.keys(currentState).forEach(key => {
-                        const idx = mesh.morphTargetDictionary[key];
-                        if (idx !== undefined) {
-                            mesh.morphTargetInfluences[idx] = currentState[key];
-                        }
-                    });
-                });
-            }
-
-            function isTransitioning() {
-                return Object.keys(currentState).some(key => 
-                    Math.abs(currentState[key] - targetState[key]) > 0.01
-                );
-            }
-
-            return {
-                update: updateFacialExpression,
-                startSpeaking: () => {
-                    isSpeaking = true;
-                    lastMouthUpdate = 0; // Force immediate mouth shape update
-                },
-                stopSpeaking: () => {
-                    isSpeaking = false;
-                    targetState = {
-                        mouthOpen: 0.1,
-                        mouthSmile: 0.1,
-                        mouthRound: 0.1,
-                        eyebrowRaise: 0,
-                        eyesClosed: 0
-                    };
-                }
-            };
-        }
+    <script src="{{ asset_url('app.js') }}" defer></script>
+</body>
+</html>
+'''
 
-        // Simple blink animation
-        function setupBlinking() {
-            let leftEye, rightEye;
-            let isBlinking = false;
-            
-            // Find the eye meshes
-            character.traverse((node) => {
-                if (node.name === 'EyeLeft') leftEye = node;
-                if (node.name === 'EyeRight') rightEye = node;
-            });
-
-            if (!leftEye || !rightEye) {
-                console.log('Could not find eye meshes');
-                return;
-            }
-
-            // Store original scales separately for each eye
-            const leftOriginalScale = leftEye.scale.y;
-            const rightOriginalScale = rightEye.scale.y;
-
-            // Start random blinking
-            const blinkInterval = setInterval(() => {
-                if (!isBlinking) {
-                    isBlinking = true;
-                    
-                    // Close eyes one at a time
-                    leftEye.scale.y = 0.1;
-                    
-                    // Force update right eye
-                    rightEye.scale.set(rightEye.scale.x, 0.1, rightEye.scale.z);
-                    rightEye.updateMatrix();
-                    
-                    // Open eyes after 150ms
-                    setTimeout(() => {
-                        leftEye.scale.y = leftOriginalScale;
-                        
-                        // Force update right eye
-                        rightEye.scale.set(rightEye.scale.x, rightOriginalScale, rightEye.scale.z);
-                        rightEye.updateMatrix();
-                        
-                        isBlinking = false;
-                    }, 150);
-                }
-            }, 3000 + Math.random() * 2000); // Random interval between 3-5 seconds
-
-            // Store the interval ID on the character object so it doesn't get garbage collected
-            character.blinkInterval = blinkInterval;
-        }
+# The page is fully static: render it once at startup and serve the CSS/JS
+# (and vendored scripts and avatar) as fingerprinted, precompressed assets
+assets = AssetRegistry(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+assets.load_all()
+# Self-hosted three.js and the optimized avatar, once `python -m avatar_assets`
+# has written them; anything missing still comes from its CDN
+if os.path.isdir(VENDOR_DIR):
+    assets.load_all(VENDOR_DIR, prefix='vendor/')
+
+with app.app_context():
+    index_page = page(render_template_string(
+        HTML_TEMPLATE,
+        asset_url=assets.url,
+        vendor_scripts=VENDOR_SCRIPTS,
+        avatar_url=assets.url('vendor/' + AVATAR_NAME, AVATAR_URL)
+    ))
 
-        // Load character
-        const loader = new THREE.GLTFLoader();
-        loader.load(
-            'https://models.readyplayer.me/6737560f478002db197d3b84.glb',
-            function (gltf) {
-                character = gltf.scene;
-                scene.add(character);
-
-                // Set initial background color to white
-                renderer.setClearColor(0xffffff);
-
-                // Debug: Log initial bone rotations
-                character.traverse((node) => {
-                    if (node.type === 'Bone' && (node.name === 'Head' || node.name === 'Neck')) {
-                        console.log(`${node.name} initial rotation:`, {
-                            x: node.rotation.x,
-                            y: node.rotation.y,
-                            z: node.rotation.z
-                        });
-                    }
-                });
-
-                // Initialize facial animations
-                facialAnimations = setupFacialAnimations(character);
-                
-                // Start blinking
-                setupBlinking();
-                
-                // Add head movements
-                setupHeadMovements();
-                
-                // Add arm movements
-                setupArmMovements();
-                
-                // Center camera on face
-                const box = new THREE.Box3().setFromObject(character);
-                const center = box.getCenter(new THREE.Vector3());
-                controls.target.set(center.x, center.y + 0.5, center.z);
-                camera.position.set(center.x, center.y + 0.5, center.z + 2);
-                controls.update();
-
-                // Start animation loop only after character is loaded
-                animate();
-            },
-            // Add loading progress callback
-            function (xhr) {
-                console.log((xhr.loaded / xhr.total * 100) + '% loaded');
-            },
-            // Add error callback
-            function (error) {
-                console.error('An error occurred loading the character:', error);
-            }
-        );
-
-        // Smooth expression handling
-        function lerpExpression(current, target, factor) {
-            return {
-                mouthOpen: THREE.MathUtils.lerp(current.mouthOpen, target.mouthOpen, factor),
-                mouthSmile: THREE.MathUtils.lerp(current.mouthSmile, target.mouthSmile, factor)
-            };
-        }
+@app.route('/')
+def chat():
+    return index_page.response()
+
+@app.route('/assets/<path:name>')
+def static_asset(name):
+    asset = assets.get(name)
+    if asset is None:
+        abort(404)
+    return asset.response()
+
+@app.route('/readyz')
+def readyz():
+    return jsonify(warm_up_status), 200 if warm_up_status["ready"] else 503
+
+
+# Cache, session and coalescing stats are read at scrape time; hits,
+# misses and the like are running totals, exported as counters
+REGISTRY.add_collector(lambda: stats_metrics(
+    "tts_cache", tts_cache.stats(), ("memory_hits", "disk_hits", "shared_hits", "misses")))
+REGISTRY.add_collector(lambda: stats_metrics(
+    "lipsync_cache", lipsync_cache.stats(), ("memory_hits", "disk_hits", "shared_hits", "misses")))
+REGISTRY.add_collector(lambda: stats_metrics(
+    "response_cache", response_cache.stats(),
+    ("exact_hits", "semantic_hits", "shared_hits", "misses", "evictions")))
+if shared_backend is not None:
+    REGISTRY.add_collector(lambda: stats_metrics(
+        "shared_cache", shared_backend.stats(), ("hits", "misses", "writes", "errors")))
+REGISTRY.add_collector(lambda: stats_metrics("conversations", conversations.stats(), ("evictions",)))
+REGISTRY.add_collector(lambda: stats_metrics("tts_flight", tts_flight.stats(), ("leaders", "coalesced")))
+REGISTRY.add_collector(lambda: stats_metrics("llm_flight", llm_flight.stats(), ("leaders", "coalesced")))
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+def route_label():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@app.before_request
+def start_request_metrics():
+    # A proxy's X-Request-ID is kept so log lines can be joined across hops
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    request_id.set(g.request_id)
+    g.request_start = time.perf_counter()
+    g.server_timing = ServerTiming()
+    current_timing.set(g.server_timing)
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+    HTTP_REQUEST_BYTES.observe(request.content_length or 0, route=route_label())
+
+
+# Per-client token buckets (see admission.py) for the routes that spend
+# upstream quota, in requests a minute; 0 turns a limit off. An IP address
+# gets RATE_LIMIT_ADDRESS_SHARE times a conversation's allowance.
+RATE_LIMIT_ADDRESS_SHARE = float(os.getenv("RATE_LIMIT_ADDRESS_SHARE", 1))
+RATE_LIMITS = {
+    "chat": ClientRateLimit(float(os.getenv("RATE_LIMIT_CHAT_PER_MIN", 20)) / 60,
+                            float(os.getenv("RATE_LIMIT_CHAT_BURST", 5)), RATE_LIMIT_ADDRESS_SHARE),
+    "tts": ClientRateLimit(float(os.getenv("RATE_LIMIT_TTS_PER_MIN", 60)) / 60,
+                           float(os.getenv("RATE_LIMIT_TTS_BURST", 15)), RATE_LIMIT_ADDRESS_SHARE),
+    "batch": ClientRateLimit(float(os.getenv("RATE_LIMIT_BATCH_PER_MIN", 2)) / 60,
+                             float(os.getenv("RATE_LIMIT_BATCH_BURST", 2)), RATE_LIMIT_ADDRESS_SHARE)
+}
+LIMITED_ROUTES = {
+    "/get_response": "chat",
+    "/get_response/stream": "chat",
+    "/converse": "chat",
+    "/get_response/batch": "batch",
+    "/text-to-speech": "tts",
+    "/text-to-speech/stream": "tts"
+}
 
-        // Expression presets with smoother transitions
-        const expressions = {
-            'A': { mouthOpen: 0.7, mouthSmile: 0.3 },
-            'E': { mouthOpen: 0.5, mouthSmile: 0.4 },
-            'I': { mouthOpen: 0.3, mouthSmile: 0.6 },
-            'O': { mouthOpen: 0.8, mouthSmile: 0.1 },
-            'U': { mouthOpen: 0.4, mouthSmile: 0.2 },
-            'closed': { mouthOpen: 0, mouthSmile: 0.1 }
-        };
-
-        function setExpression(expressionName) {
-            if (!character || !expressions[expressionName]) return;
-            targetExpression = expressions[expressionName];
-        }
 
-        // Define more varied mouth animations that simulate talking patterns
-        const talkingAnimations = [
-            // Basic talking movements
-            { mouthOpen: 0.3, mouthSmile: 0.2, mouthRound: 0.1 },    // slight open
-            { mouthOpen: 0.5, mouthSmile: 0.3, mouthRound: 0.2 },    // medium open
-            { mouthOpen: 0.7, mouthSmile: 0.2, mouthRound: 0.1 },    // wide open
-            
-            // Side movements
-            { mouthOpen: 0.4, mouthSmile: 0.6, mouthRound: 0.1 },    // smile talk
-            { mouthOpen: 0.3, mouthSmile: -0.2, mouthRound: 0.3 },   // side movement
-            
-            // Round shapes for O and U sounds
-            { mouthOpen: 0.4, mouthSmile: 0.1, mouthRound: 0.7 },    // round shape
-            { mouthOpen: 0.6, mouthSmile: 0.1, mouthRound: 0.5 },    // oval shape
-            
-            // Nearly closed positions
-            { mouthOpen: 0.1, mouthSmile: 0.2, mouthRound: 0.1 },    // almost closed
-            { mouthOpen: 0.2, mouthSmile: 0.3, mouthRound: 0.2 }     // slightly open
-        ];
-
-        // Define speech animation states and transitions
-        const speechAnimator = {
-            currentState: 'neutral',
-            transitionTime: 0,
-            
-            states: {
-                neutral: {
-                    values: { mouthOpen: 0.1, mouthSmile: 0.1, mouthRound: 0.1, eyebrowRaise: 0, eyesClosed: 0 },
-                    transitions: ['startTalk', 'smile', 'rest']
-                },
-                startTalk: {
-                    values: { mouthOpen: 0.3, mouthSmile: 0.2, mouthRound: 0.2, eyebrowRaise: 0.1, eyesClosed: 0 },
-                    transitions: ['wideOpen', 'roundShape', 'smile'],
-                    maxDuration: 200
-                },
-                wideOpen: {
-                    values: { mouthOpen: 0.7, mouthSmile: 0.2, mouthRound: 0.1, eyebrowRaise: 0.2, eyesClosed: 0 },
-                    transitions: ['narrowOpen', 'smile', 'startTalk'],
-                    maxDuration: 150
-                },
-                narrowOpen: {
-                    values: { mouthOpen: 0.4, mouthSmile: 0.3, mouthRound: 0.2, eyebrowRaise: 0.1, eyesClosed: 0 },
-                    transitions: ['roundShape', 'wideOpen', 'rest'],
-                    maxDuration: 180
-                },
-                roundShape: {
-                    values: { mouthOpen: 0.5, mouthSmile: 0.1, mouthRound: 0.8, eyebrowRaise: 0.2, eyesClosed: 0 },
-                    transitions: ['narrowOpen', 'startTalk'],
-                    maxDuration: 160
-                },
-                smile: {
-                    values: { mouthOpen: 0.3, mouthSmile: 0.6, mouthRound: 0.1, eyebrowRaise: 0.3, eyesClosed: 0 },
-                    transitions: ['wideOpen', 'startTalk'],
-                    maxDuration: 200
-                },
-                rest: {
-                    values: { mouthOpen: 0.15, mouthSmile: 0.2, mouthRound: 0.1, eyebrowRaise: 0.1, eyesClosed: 0 },
-                    transitions: ['startTalk', 'neutral'],
-                    maxDuration: 120
-                }
-            },
-
-            // Get next state based on current transitions
-            getNextState() {
-                const currentStateObj = this.states[this.currentState];
-                const possibleTransitions = currentStateObj.transitions;
-                return possibleTransitions[Math.floor(Math.random() * possibleTransitions.length)];
-            },
-
-            // Add natural variations to movements
-            addVariation(values) {
-                const variation = Math.random() * 0.15 - 0.075;
-                const result = { ...values };
-                Object.keys(result).forEach(key => {
-                    result[key] = Math.max(0, Math.min(1, result[key] + variation));
-                });
-                return result;
-            },
-
-            // Add blink handling
-            updateBlink() {
-                const now = Date.now();
-                
-                // Start a new blink if it's time
-                if (!blinkConfig.isBlinking && 
-                    now - blinkConfig.lastBlink > Math.random() * 
-                    (blinkConfig.maxInterval - blinkConfig.minInterval) + blinkConfig.minInterval) {
-                    
-                    blinkConfig.isBlinking = true;
-                    blinkConfig.lastBlink = now;
-                    return 1; // Eyes fully closed
-                }
-                
-                // End the blink if it's been long enough
-                if (blinkConfig.isBlinking && now - blinkConfig.lastBlink > blinkConfig.blinkDuration) {
-                    blinkConfig.isBlinking = false;
-                    return 0; // Eyes fully open
-                }
-                
-                // During blink animation
-                if (blinkConfig.isBlinking) {
-                    const blinkProgress = (now - blinkConfig.lastBlink) / blinkConfig.blinkDuration;
-                    // Create a smooth blink animation
-                    if (blinkProgress < 0.5) {
-                        return blinkProgress * 2; // Close eyes
-                    } else {
-                        return 2 - (blinkProgress * 2); // Open eyes
-                    }
-                }
-                
-                return 0; // Eyes open by default
-            }
-        };
-
-        // Add eye blinking configuration
-        const blinkConfig = {
-            isBlinking: false,
-            lastBlink: Date.now(),
-            minInterval: 1000,    // Minimum time between blinks (ms)
-            maxInterval: 5000,    // Maximum time between blinks (ms)
-            blinkDuration: 150    // How long a blink lasts (ms)
-        };
-
-        // Updated speak function using state machine
-        async function speak(text) {
-            try {
-                const response = await fetch('/text-to-speech', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({ text: text })
-                });
-
-                const data = await response.json();
-                if (data.audio) {
-                    const audio = new Audio('data:audio/mpeg;base64,' + data.audio);
-                    
-                    if (facialAnimations) {
-                        let animationFrame;
-                        
-                        audio.onplay = () => {
-                            isSpeaking = true;
-                            if (facialAnimations.startSpeaking) {
-                                facialAnimations.startSpeaking();
-                            }
-                        };
-
-                        audio.onended = () => {
-                            isSpeaking = false;
-                            if (facialAnimations.stopSpeaking) {
-                                facialAnimations.stopSpeaking();
-                            }
-                        };
-                    }
-                    
-                    await audio.play();
-                }
-            } catch (error) {
-                console.error('Error playing audio:', error);
-            }
-        }
+def retry_later(message, retry_after, status):
+    response = jsonify({"error": message, "retry_after": retry_after})
+    response.status_code = status
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def busy_response(e):
+    # An UpstreamBusyError: we are overloaded, not the client
+    return retry_later(str(e), e.retry_after, 503)
+
+
+@app.before_request
+def apply_rate_limit():
+    kind = LIMITED_ROUTES.get(route_label())
+    if kind is None:
+        return None
+    wait = RATE_LIMITS[kind].take(session.get("sid"), request.remote_addr)
+    if wait:
+        return retry_later("Too many requests", wait, 429)
+    return None
+
+
+def check_upstreams(speak):
+    # Turns a streamed reply away before its 200 goes out when Gemini (and
+    # ElevenLabs, if it is to be spoken) would turn its calls away anyway
+    gemini_slots.check()
+    if speak:
+        elevenlabs.slots.check()
+
+
+# Calls waiting for an upstream slot and requests turned away, by rate
+# limits or by full upstreams. The ASGI server adds its own limits.
+ADMISSION_LIMITS = [gemini_slots, elevenlabs.slots]
+
+
+def admission_metrics():
+    depth = Gauge("admission_queue_depth", "Calls waiting for a slot to an upstream",
+                  labels=("upstream",))
+    rejected = Counter("admission_rejections_total",
+                       "Requests turned away by rate limits and overloaded upstreams",
+                       labels=("limit", "reason"))
+    for limit in ADMISSION_LIMITS:
+        stats = limit.stats()
+        depth.inc(stats["waiting"], upstream=limit.name)
+        for reason, count in stats["rejected"].items():
+            rejected.inc(count, limit=limit.name, reason=reason)
+    for kind, limiter in RATE_LIMITS.items():
+        rejected.inc(limiter.stats()["limited"], limit=kind, reason="rate_limited")
+    return [depth, rejected]
+
+
+REGISTRY.add_collector(admission_metrics)
+
+
+@app.after_request
+def finish_request_metrics(response):
+    # Server-Timing covers the stages finished before the headers go out;
+    # for streamed bodies that is the part up to the first byte
+    start = g.get("request_start")
+    if start is None:
+        return response
+    g.server_timing.add("app", time.perf_counter() - start)
+    response.headers["Server-Timing"] = g.server_timing.header()
+    response.headers["X-Request-ID"] = g.request_id
+
+    labels = {"route": route_label(), "method": request.method, "status": response.status_code}
+    rid = g.request_id
+
+    def finish():
+        # Runs once the body has been sent, streamed or not
+        elapsed = time.perf_counter() - start
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+        HTTP_REQUEST_SECONDS.observe(elapsed, **labels)
+        logger.info("Request finished", extra=dict(
+            labels, request_id=rid, duration_ms=round(elapsed * 1000, 1), sampled=True))
+
+    response.call_on_close(finish)
+    return response
+
+# Fixed Hindi replies used when Gemini can't answer
+NO_RESPONSE_MESSAGE = "मैं क्षमा चाहता हूं, लेकिन मैं जवाब नहीं दे पाया।"
+NO_INPUT_MESSAGE = "मुझे कोई इनपुट नहीं मिला। कृपय फिर स प्रयास करें।"
+ERROR_MESSAGE_PREFIX = "क्षमा करें, एक त्रुटि हुई"
+
+
+def phrase_list(value):
+    return tuple(phrase.strip() for phrase in value.split("|") if phrase.strip())
+
+
+# Phrases kept ready to play in the audio bank (see audio_bank.py), for
+# each of AUDIO_BANK_FORMATS. Fillers and greetings are "|"-separated. An
+# error is spoken as ERROR_MESSAGE_PREFIX alone; the details are only shown.
+FILLER_PHRASES = phrase_list(os.getenv("FILLER_PHRASES", "हम्म…|एक सेकंड…|अच्छा, सोचने दीजिए…"))
+GREETING_PHRASES = phrase_list(os.getenv("GREETING_PHRASES", "नमस्ते! मैं आपकी क्या मदद कर सकता हूँ?"))
+BANK_PHRASES = {
+    "filler": FILLER_PHRASES,
+    "greeting": GREETING_PHRASES,
+    "fallback": (NO_RESPONSE_MESSAGE, NO_INPUT_MESSAGE, ERROR_MESSAGE_PREFIX)
+}
+AUDIO_BANK_FORMATS = [name.strip() for name in os.getenv(
+    "AUDIO_BANK_FORMATS", TTS_DEFAULTS.format.name).split(",") if name.strip()]
+AUDIO_BANK_BUILD_ON_START = os.getenv("AUDIO_BANK_BUILD_ON_START", "1") == "1"
+audio_bank = AudioBank(os.getenv("AUDIO_BANK_DIR", os.path.join(".cache", "audio_bank")))
+REGISTRY.add_collector(lambda: stats_metrics("audio_bank", audio_bank.stats(), ("hits",)))
+
+# A spoken reply whose first text takes longer than this starts with a
+# filler from the bank; 0 turns fillers off
+FILLER_AFTER = float(os.getenv("FILLER_AFTER_MS", 700)) / 1000
+
+
+def build_audio_bank(formats=None, force=False):
+    # Synthesizes the bank phrases missing from it (all of them with force)
+    # in each output format; returns how many clips were made. Under the
+    # bank's build lock, and starting from the manifest on disk, so of
+    # several workers warming up at once only the first synthesizes.
+    for name in formats or AUDIO_BANK_FORMATS:
+        if name not in speech_formats.FORMATS:
+            raise ValueError(f"Unknown output format {name!r}")
+    built = 0
+    with audio_bank.build_lock():
+        audio_bank.load()
+        for name in formats or AUDIO_BANK_FORMATS:
+            options = TTS_DEFAULTS._replace(format=speech_formats.FORMATS[name])
+            for kind, phrases in BANK_PHRASES.items():
+                for text in phrases:
+                    key = speech_cache_key(text, options)
+                    if key in audio_bank and not force:
+                        continue
+                    audio, alignment = request_speech(text, options, timestamps=LIPSYNC)
+                    timeline = None
+                    if LIPSYNC:
+                        duration = options.format.duration(len(audio))
+                        timeline = (lipsync.from_alignment(alignment, duration, LIPSYNC_FRAME_MS)
+                                    or lipsync.estimate(text, duration, LIPSYNC_FRAME_MS))
+                    audio_bank.add(key, kind, text, audio, timeline)
+                    built += 1
+    return built
+
+
+def banked_segment(text, options=None):
+    # The banked clip of a fixed phrase as a pipeline segment, or None
+    clip = audio_bank.get(speech_cache_key(text, options))
+    return {"text": text, "audio": clip.audio} if clip is not None else None
+
+
+def filler_segment(options=None):
+    keys = [speech_cache_key(text, options) for text in FILLER_PHRASES]
+    clip = audio_bank.pick(keys)
+    return {"text": clip.text, "audio": clip.audio, "filler": True} if clip is not None else None
+
+
+def build_prompt(user_input, history=""):
+    # Updated context to request Hindi responses
+    context = """You are a helpful AI assistant. Keep your responses concise and natural, as they will be spoken by a 3D character. 
+            """
+    if history:
+        context += f"""Conversation so far:
+            {history}
+            """
+    return context + f"""Please respond in Hindi (using Devanagari script) to the following query: {user_input}"""
+
+
+def conversation_id():
+    # Conversation memory is keyed by an id kept in the signed session cookie
+    if "sid" not in session:
+        session["sid"] = uuid.uuid4().hex
+    return session["sid"]
+
+
+def error_message(e):
+    return f"{ERROR_MESSAGE_PREFIX}: {str(e)}"
 
-        // Main animation loop
-        function animate() {
-            requestAnimationFrame(animate);
-            const delta = clock.getDelta();
 
-            if (facialAnimations) {
-                facialAnimations.update(delta);
-            }
+@app.route('/get_response', methods=['POST'])
+def get_response():
+    user_input = request.form.get("user_input", "").strip()
+    
+    if user_input:
+        sid = conversation_id()
+        history = conversations.history(sid, SESSION_HISTORY_TOKENS)
 
-            // Update controls if they exist
-            if (controls) {
-                controls.update();
-            }
+        # Cached replies only fit the first turn of a conversation
+        cached = None if history else response_cache.get(user_input)
+        if cached is not None:
+            conversations.add_turn(sid, user_input, cached)
+            return {"response": cached}
 
-            renderer.render(scene, camera);
-        }
+        try:
+            if history:
+                response_text = generate_reply(user_input, history)
+            else:
+                # Everyone asking the same first question shares one call
+                response_text = llm_flight.do(normalize_input(user_input),
+                                              lambda: generate_reply(user_input))
+            if response_text:
+                if not history:
+                    response_cache.put(user_input, response_text)
+                conversations.add_turn(sid, user_input, response_text)
+            
+            return {"response": response_text or NO_RESPONSE_MESSAGE}
+        except UpstreamBusyError as e:
+            return busy_response(e)
+        except Exception as e:
+            return {"response": error_message(e)}
+    
+    return {"response": NO_INPUT_MESSAGE}
+
+
+# Batches of first-turn replies for offline evaluation. Inputs are answered
+# BATCH_CONCURRENCY at a time (at most BATCH_MAX_CONCURRENCY), each within
+# its own timeout counted from when it starts. They don't touch conversation
+# memory and skip the response cache unless asked to use it, so a changed
+# prompt or model is what gets measured.
+BATCH_MAX_INPUTS = int(os.getenv("BATCH_MAX_INPUTS", 500))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 32))
+BATCH_ITEM_TIMEOUT = float(os.getenv("BATCH_ITEM_TIMEOUT", 30))
+
+
+def batch_request(params):
+    # The JSON body of /get_response/batch -> (inputs, concurrency, timeout,
+    # use_cache, stream); raises ValueError when it doesn't make sense
+    if not isinstance(params, dict):
+        raise ValueError("Expected a JSON object with an \"inputs\" list")
+    inputs = params.get("inputs")
+    if not isinstance(inputs, list) or not all(isinstance(text, str) for text in inputs):
+        raise ValueError("\"inputs\" must be a list of strings")
+    if not inputs:
+        raise ValueError("\"inputs\" is empty")
+    if len(inputs) > BATCH_MAX_INPUTS:
+        raise ValueError(f"At most {BATCH_MAX_INPUTS} inputs per batch")
+    try:
+        concurrency = int(params.get("concurrency", BATCH_CONCURRENCY))
+        timeout = float(params.get("timeout", BATCH_ITEM_TIMEOUT))
+    except (TypeError, ValueError):
+        raise ValueError("\"concurrency\" and \"timeout\" must be numbers")
+    if not 1 <= concurrency <= BATCH_MAX_CONCURRENCY:
+        raise ValueError(f"\"concurrency\" must be between 1 and {BATCH_MAX_CONCURRENCY}")
+    if not timeout > 0:
+        raise ValueError("\"timeout\" must be positive")
+    return ([text.strip() for text in inputs], concurrency, timeout,
+            bool(params.get("cache", False)), bool(params.get("stream", True)))
+
+
+def batch_result(index, user_input, started, response=None, error=None, cached=False):
+    return {
+        "index": index,
+        "input": user_input,
+        "response": response,
+        "error": error,
+        "cached": cached,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+
+
+def batch_error(e, timeout):
+    if isinstance(e, TimeoutError):
+        return f"timed out after {timeout:g}s"
+    return str(e) or type(e).__name__
+
+
+def batch_reply(user_input, timeout, use_cache):
+    # -> (reply, cached); errors are raised for the caller to report
+    if not user_input:
+        raise ValueError("empty input")
+    if use_cache:
+        cached = response_cache.get(user_input)
+        if cached is not None:
+            return cached, True
+    response_text = generate_reply(user_input, timeout=timeout)
+    if use_cache and response_text:
+        response_cache.put(user_input, response_text)
+    return response_text, False
+
+
+def batch_replies(inputs, concurrency=BATCH_CONCURRENCY, timeout=BATCH_ITEM_TIMEOUT, use_cache=False):
+    """Answers every input as a first turn; yields a batch_result per input
+    as it finishes, which is not input order (see "index").
+
+    A call still running at its deadline is reported as timed out and left
+    to Gemini's own request timeout. Closing the generator drops the inputs
+    not started yet.
+    """
+    started = {}
+
+    def run(index, user_input):
+        started[index] = time.perf_counter()
+        try:
+            response_text, cached = batch_reply(user_input, timeout, use_cache)
+        except Exception as e:
+            return batch_result(index, user_input, started[index], error=batch_error(e, timeout))
+        return batch_result(index, user_input, started[index], response_text, cached=cached)
 
-        // Window resize handler
-        window.addEventListener('resize', () => {
-            camera.aspect = window.innerWidth / 2 / window.innerHeight;
-            camera.updateProjectionMatrix();
-            renderer.setSize(window.innerWidth / 2, window.innerHeight);
-        });
-
-        // Chat interface
-        const input = document.getElementById('user-input');
-        const sendButton = document.getElementById('send-button');
-        const messagesContainer = document.getElementById('chat-messages');
-
-        function addMessage(text, isUser) {
-            const messageDiv = document.createElement('div');
-            messageDiv.className = `message ${isUser ? 'user-message' : 'ai-message'}`;
-            messageDiv.textContent = text;
-            messagesContainer.appendChild(messageDiv);
-            messagesContainer.scrollTop = messagesContainer.scrollHeight;
-        }
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+    try:
+        # Each input gets its own copy of the request's context (request id,
+        # Server-Timing)
+        pending = {executor.submit(contextvars.copy_context().run, run, index, user_input): index
+                   for index, user_input in enumerate(inputs)}
+        while pending:
+            now = time.perf_counter()
+            deadlines = [started[index] + timeout for index in pending.values() if index in started]
+            wait_for = max(0, min(deadlines) - now) if deadlines else timeout
+            done, _ = concurrent.futures.wait(pending, timeout=wait_for,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+                yield future.result()
+
+            now = time.perf_counter()
+            for future, index in list(pending.items()):
+                if index in started and now - started[index] >= timeout:
+                    del pending[future]
+                    yield batch_result(index, inputs[index], started[index],
+                                       error=batch_error(TimeoutError(), timeout))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_responses(inputs, concurrency=BATCH_CONCURRENCY, timeout=BATCH_ITEM_TIMEOUT, use_cache=False):
+    # batch_replies collected into input order
+    results = [None] * len(inputs)
+    for result in batch_replies(inputs, concurrency, timeout, use_cache):
+        results[result["index"]] = result
+    return results
+
+
+def batch_events(results):
+    # ("result", ...) per input as it finishes, then ("done", summary)
+    start = time.perf_counter()
+    count = errors = 0
+    for result in results:
+        count += 1
+        errors += result["error"] is not None
+        yield "result", result
+    yield "done", {"count": count, "errors": errors,
+                   "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+
+# Replies to a list of inputs in one request: JSON body {"inputs": [...],
+# "concurrency": 8, "timeout": 30, "cache": false}. Results stream back as
+# newline-delimited JSON as each one finishes, "type": "result" lines with
+# the input's "index", latency and error, then a "done" line. With
+# "stream": false the response is {"results": [...]} in input order.
+@app.route('/get_response/batch', methods=['POST'])
+def get_response_batch():
+    try:
+        inputs, concurrency, timeout, use_cache, stream = batch_request(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        check_upstreams(False)
+    except UpstreamBusyError as e:
+        return busy_response(e)
+    if not stream:
+        return {"results": get_responses(inputs, concurrency, timeout, use_cache)}
+    events = batch_events(batch_replies(inputs, concurrency, timeout, use_cache))
+    return Response(ndjson_lines(events), mimetype='application/x-ndjson', headers=STREAM_HEADERS)
 
-        // Update your sendMessage function to use the new addMessage function
-        async function sendMessage() {
-            const message = input.value.trim();
-            if (message) {
-                // Add user message
-                addMessage(message, true);
-                
-                // Disable input while processing
-                input.disabled = true;
-                sendButton.disabled = true;
-
-                try {
-                    const response = await fetch('/get_response', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/x-www-form-urlencoded',
-                        },
-                        body: 'user_input=' + encodeURIComponent(message)
-                    });
-                    
-                    const data = await response.json();
-                    const aiResponse = data.response;
-                    
-                    // Add AI message
-                    addMessage(aiResponse, false);
-                    
-                    await speak(aiResponse);
-                } catch (error) {
-                    console.error('Error:', error);
-                    addMessage('Error: Failed to get response', false);
-                }
-
-                // Re-enable input
-                input.disabled = false;
-                sendButton.disabled = false;
-                
-                input.value = '';
-                messagesContainer.scrollTop = messagesContainer.scrollHeight;
-            }
-        }
 
-        sendButton.addEventListener('click', sendMessage);
-        input.addEventListener('keypress', (e) => {
-            if (e.key === 'Enter') {
-                sendMessage();
-            }
-        });
+def sse_event(data, event=None):
+    # Format one Server-Sent Events frame
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-        function setupHeadMovements() {
-            let headBone, neckBone;
-            
-            // Find the head and neck bones
-            character.traverse((node) => {
-                if (node.type === 'Bone') {
-                    if (node.name === 'Head') headBone = node;
-                    if (node.name === 'Neck') neckBone = node;
-                }
-            });
-
-            if (!headBone || !neckBone) {
-                console.log('Could not find head or neck bones');
-                return;
-            }
-
-            // Store original rotations
-            const originalRotation = {
-                x: neckBone.rotation.x - 0.1,  // Lift head up slightly
-                y: neckBone.rotation.y,
-                z: neckBone.rotation.z
-            };
-
-            function updateHeadMovement() {
-                const time = Date.now() * 0.001;
-                
-                // Base position - slightly lifted, looking forward
-                const baseX = -0.1; // Lift head up
-                const baseY = 0;
-                const baseZ = 0;
-                
-                // Engagement movements (like nodding while explaining)
-                const engagementX = Math.sin(time * 0.7) * 0.05;  // Occasional nods
-                const engagementY = Math.sin(time * 0.4) * 0.08;  // Looking side to side while explaining
-                
-                // Micro movements for naturalness
-                const microX = Math.sin(time * 2.5) * 0.02;
-                const microY = Math.cos(time * 2.1) * 0.02;
-                const microZ = Math.sin(time * 1.8) * 0.01;
-                
-                // Very slow drift
-                const driftX = Math.sin(time * 0.1) * 0.02;
-                const driftY = Math.cos(time * 0.15) * 0.02;
-                
-                // Combine all movements
-                neckBone.rotation.x = originalRotation.x + baseX + engagementX + microX + driftX;
-                neckBone.rotation.y = originalRotation.y + baseY + engagementY + microY + driftY;
-                neckBone.rotation.z = originalRotation.z + baseZ + microZ;
-
-                // Head follows neck but with slightly reduced movement
-                headBone.rotation.x = neckBone.rotation.x * 0.3;
-                headBone.rotation.y = neckBone.rotation.y * 0.3;
-                headBone.rotation.z = neckBone.rotation.z * 0.3;
-
-                // Force update matrices
-                neckBone.updateMatrix();
-                neckBone.updateMatrixWorld(true);
-                headBone.updateMatrix();
-                headBone.updateMatrixWorld(true);
-            }
-
-            // Add to main animation loop
-            const existingAnimate = animate;
-            animate = function() {
-                existingAnimate();
-                updateHeadMovement();
-            };
-        }
 
-        function setupArmMovements() {
-            let leftArm, rightArm, leftForeArm, rightForeArm, leftHand, rightHand;
-            
-            // Find arm bones
-            character.traverse((node) => {
-                if (node.type === 'Bone') {
-                    switch(node.name) {
-                        case 'LeftArm': leftArm = node; break;
-                        case 'RightArm': rightArm = node; break;
-                        case 'LeftForeArm': leftForeArm = node; break;
-                        case 'RightForeArm': rightForeArm = node; break;
-                        case 'LeftHand': leftHand = node; break;
-                        case 'RightHand': rightHand = node; break;
-                    }
-                }
-            });
-
-            // Neutral position (keep this as reference) hands are staright down
-            const neutralPosition = {
-                leftArm: { x: 1.3, y: 0.1, z: 0.1 },
-                rightArm: { x: 1.3, y: 0.1, z: -0.1 },
-                leftForeArm: { x: 0.1, y: 0, z: 0 },
-                rightForeArm: { x: 0.1, y: 0, z: 0 },
-                leftHand: { x: 0, y: 0, z: 0 },
-                rightHand: { x: 0, y: 0, z: 0 },
-                duration: 1200
-            };
-
-            // Predefined empty gesture arrays for different animations
-            const gestureArrays = {
-                explaining: [{
-        leftArm: { x: 1.2, y: 0.2, z: 0.3 },
-        rightArm: { x: 1.2, y: -0.2, z: -0.3 },
-        leftForeArm: { x: 0.1, y: 0, z: 0.1 },
-        rightForeArm: { x: 0.1, y: 0, z: -0.1 },
-        leftHand: { x: 0, y: 0.1, z: 0 },
-        rightHand: { x: 0, y: 0.1, z: 0 },
-        duration: 1500
-    }],
-
-    presenting: [{
-        leftArm: { x: 0.9, y: 0.4, z: 0.4 },
-        rightArm: { x: 0.9, y: 0.4, z: -0.4 },
-        leftForeArm: { x: 0.3, y: 0.3, z: 0.2 },
-        rightForeArm: { x: 0.3, y: 0.3, z: -0.2 },
-        leftHand: { x: 0.2, y: 0.4, z: 0.1 },
-        rightHand: { x: 0.2, y: 0.4, z: -0.1 },
-        duration: 1400
-    }],
-
-    explainRight: [{
-        leftArm: { x: 1.4, y: 0, z: 0 },
-        rightArm: { x: 1.1, y: 0.3, z: -0.4 },
-        leftForeArm: { x: 0, y: 0, z: 0 },
-        rightForeArm: { x: 0.2, y: 0.2, z: -0.1 },
-        leftHand: { x: 0, y: 0, z: 0 },
-        rightHand: { x: 0.1, y: 0.2, z: 0 },
-        duration: 1300
-    }],
-
-    explainLeft: [{
-        leftArm: { x: 1.1, y: 0.3, z: 0.4 },
-        rightArm: { x: 1.4, y: 0, z: 0 },
-        leftForeArm: { x: 0.2, y: 0.2, z: 0.1 },
-        rightForeArm: { x: 0, y: 0, z: 0 },
-        leftHand: { x: 0.1, y: 0.2, z: 0 },
-        rightHand: { x: 0, y: 0, z: 0 },
-        duration: 1300
-    }],
-
-    presentLow: [{
-        leftArm: { x: 0.8, y: 0.3, z: 0.3 },
-        rightArm: { x: 0.8, y: 0.3, z: -0.3 },
-        leftForeArm: { x: 0.2, y: 0.2, z: 0.1 },
-        rightForeArm: { x: 0.2, y: 0.2, z: -0.1 },
-        leftHand: { x: 0.1, y: 0.3, z: 0.1 },
-        rightHand: { x: 0.1, y: 0.3, z: -0.1 },
-        duration: 1400
-    }],
-
-    presentHigh: [{
-        leftArm: { x: 1.0, y: 0.5, z: 0.4 },
-        rightArm: { x: 1.0, y: 0.5, z: -0.4 },
-        leftForeArm: { x: 0.4, y: 0.4, z: 0.2 },
-        rightForeArm: { x: 0.4, y: 0.4, z: -0.2 },
-        leftHand: { x: 0.3, y: 0.5, z: 0.1 },
-        rightHand: { x: 0.3, y: 0.5, z: -0.1 },
-        duration: 1400
-    }]
-
-            };
-
-            let lastGestureTime = Date.now();
-            let currentGestureCategory = 'explaining';
-            let usedGestures = new Set();
-
-            function updateArmMovements() {
-                if (!isSpeaking) {
-                    // Return to neutral position when not speaking
-                    if (leftArm && rightArm && leftForeArm && rightForeArm && leftHand && rightHand) {
-                        ['x', 'y', 'z'].forEach(axis => {
-                            leftArm.rotation[axis] = THREE.MathUtils.lerp(leftArm.rotation[axis], neutralPosition.leftArm[axis], 0.1);
-                            rightArm.rotation[axis] = THREE.MathUtils.lerp(rightArm.rotation[axis], neutralPosition.rightArm[axis], 0.1);
-                            leftForeArm.rotation[axis] = THREE.MathUtils.lerp(leftForeArm.rotation[axis], neutralPosition.leftForeArm[axis], 0.1);
-                            rightForeArm.rotation[axis] = THREE.MathUtils.lerp(rightForeArm.rotation[axis], neutralPosition.rightForeArm[axis], 0.1);
-                            leftHand.rotation[axis] = THREE.MathUtils.lerp(leftHand.rotation[axis], neutralPosition.leftHand[axis], 0.1);
-                            rightHand.rotation[axis] = THREE.MathUtils.lerp(rightHand.rotation[axis], neutralPosition.rightHand[axis], 0.1);
-                        });
-
-                        // Update matrices
-                        [leftArm, rightArm, leftForeArm, rightForeArm, leftHand, rightHand].forEach(bone => {
-                            bone.updateMatrix();
-                        });
-                    }
-                    return;
-                }
-
-                const currentTime = Date.now();
-                if (currentTime - lastGestureTime > 2000) { // Change gesture every 2 seconds
-                    const availableGestures = Object.keys(gestureArrays).filter(gesture => !usedGestures.has(gesture));
-                    
-                    // If all gestures have been used, reset the used gestures set
-                    if (availableGestures.length === 0) {
-                        usedGestures.clear();
-                        currentGestureCategory = Object.keys(gestureArrays)[Math.floor(Math.random() * Object.keys(gestureArrays).length)];
-                    } else {
-                        // Select a random unused gesture
-                        currentGestureCategory = availableGestures[Math.floor(Math.random() * availableGestures.length)];
-                    }
-                    
-                    usedGestures.add(currentGestureCategory);
-                    lastGestureTime = currentTime;
-                    
-                    // Update the animation display
-                    const animationDisplay = document.getElementById('current-animation');
-                    if (animationDisplay) {
-                        animationDisplay.textContent = `Current Animation: ${currentGestureCategory}`;
-                    }
-                }
-
-                // Get the current gesture
-                const targetGesture = gestureArrays[currentGestureCategory][0];
-                
-                if (leftArm && rightArm && leftForeArm && rightForeArm && leftHand && rightHand) {
-                    ['x', 'y', 'z'].forEach(axis => {
-                        leftArm.rotation[axis] = THREE.MathUtils.lerp(leftArm.rotation[axis], targetGesture.leftArm[axis], 0.1);
-                        rightArm.rotation[axis] = THREE.MathUtils.lerp(rightArm.rotation[axis], targetGesture.rightArm[axis], 0.1);
-                        leftForeArm.rotation[axis] = THREE.MathUtils.lerp(leftForeArm.rotation[axis], targetGesture.leftForeArm[axis], 0.1);
-                        rightForeArm.rotation[axis] = THREE.MathUtils.lerp(rightForeArm.rotation[axis], targetGesture.rightForeArm[axis], 0.1);
-                        leftHand.rotation[axis] = THREE.MathUtils.lerp(leftHand.rotation[axis], targetGesture.leftHand[axis], 0.1);
-                        rightHand.rotation[axis] = THREE.MathUtils.lerp(rightHand.rotation[axis], targetGesture.rightHand[axis], 0.1);
-                    });
-
-                    // Update matrices
-                    [leftArm, rightArm, leftForeArm, rightForeArm, leftHand, rightHand].forEach(bone => {
-                        bone.updateMatrix();
-                    });
-                }
-            }
-
-            // Add to animation loop
-            const existingAnimate = animate;
-            animate = function() {
-                existingAnimate();
-                updateArmMovements();
-            };
-        }
+def generate_reply(user_input, history="", timeout=None):
+    with gemini_slots.slot(), UPSTREAM_IN_FLIGHT.track(upstream="gemini"), \
+            stage("llm", LLM_SECONDS, mode="full"):
+        try:
+            response = get_model().generate_content(
+                build_prompt(user_input, history),
+                request_options={"timeout": timeout} if timeout else None)
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(upstream="gemini", kind=error_kind(e))
+            raise
+    return response.text if response else None
+
+
+def gemini_text_chunks(prompt):
+    with gemini_slots.slot():
+        start = time.perf_counter()
+        first_token = True
+        with UPSTREAM_IN_FLIGHT.track(upstream="gemini"):
+            try:
+                for chunk in get_model().generate_content(prompt, stream=True):
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunks without text parts (e.g. safety-only chunks) are skipped
+                        continue
+                    if text:
+                        if first_token:
+                            first_token = False
+                            LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                            record_timing("llm_ttft", time.perf_counter() - start)
+                        yield text
+            except Exception as e:
+                UPSTREAM_ERRORS.inc(upstream="gemini", kind=error_kind(e))
+                raise
+        LLM_SECONDS.observe(time.perf_counter() - start, mode="stream")
+
+
+def stream_and_cache_reply(user_input):
+    parts = []
+    for text in gemini_text_chunks(build_prompt(user_input)):
+        parts.append(text)
+        yield text
+    response_cache.put(user_input, "".join(parts))
+
+
+def stream_response_text(user_input, history=""):
+    # Yield the reply text chunk by chunk as Gemini generates it. A cached
+    # reply comes back as a single chunk.
+    if history:
+        yield from gemini_text_chunks(build_prompt(user_input, history))
+        return
+
+    cached = response_cache.get(user_input)
+    if cached is not None:
+        yield cached
+        return
+
+    # Concurrent identical first questions all read the same Gemini stream
+    yield from llm_flight.stream(normalize_input(user_input),
+                                 lambda: stream_and_cache_reply(user_input))
+
+
+def audio_payload(segment, options=None):
+    if "audio" in segment:
+        options = options or TTS_DEFAULTS
+        timeline = speech_lipsync(segment["text"], segment["audio"], options=options)
+        with stage("encode", ENCODE_SECONDS):
+            segment = dict(segment, audio=base64.b64encode(segment["audio"]).decode('utf-8'),
+                           content_type=options.format.content_type, lipsync=timeline)
+    return segment
+
+
+_END = object()
+# Put in a read_ahead queue when a sentence's audio may be ready
+_READY = object()
+
+
+def read_ahead(chunks, items, stop, delay=None):
+    # chunks, read into the queue items on a background thread so that
+    # waiting for the next one can be cut short: preceded by one None if the
+    # first takes longer than delay seconds, and with a _READY wherever one
+    # was put in items meanwhile (see reply_events). Once the event stop is
+    # set the thread stops reading at the next chunk and closes chunks.
+    def pump():
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                items.put((chunk, None))
+            items.put((_END, None))
+        except Exception as e:
+            items.put((_END, e))
+        finally:
+            # Ends the Gemini call and frees its slot; a shared single-flight
+            # stream goes on for its other readers
+            chunks.close()
+
+    threading.Thread(target=contextvars.copy_context().run, args=(pump,),
+                     name="read-ahead", daemon=True).start()
+    if delay is None:
+        item = items.get()
+    else:
+        try:
+            item = items.get(timeout=delay)
+        except queue.Empty:
+            yield None
+            item = items.get()
+    while True:
+        chunk, error = item
+        if chunk is _END:
+            if error is not None:
+                raise error
+            return
+        yield chunk
+        item = items.get()
+
+
+def reply_events(user_input, sid, speak, options=None):
+    # Yields (event, payload) pairs for one turn: "text" chunks as Gemini
+    # generates them, an "audio" segment for each finished sentence when
+    # speak is set, then "done" (or "error"). A spoken turn starts with a
+    # filler when Gemini is slow, and fixed replies come from the audio bank.
+    if not user_input:
+        segment = banked_segment(NO_INPUT_MESSAGE, options) if speak else None
+        if segment:
+            yield "audio", audio_payload(segment, options)
+        yield "done", {"response": NO_INPUT_MESSAGE}
+        return
+
+    history = conversations.history(sid, SESSION_HISTORY_TOKENS)
+
+    synthesize = functools.partial(synthesize_speech, options=options)
+    items = queue.Queue()
+    pipeline = SpeechPipeline(synthesize, TTS_MAX_CONCURRENCY,
+                              on_done=lambda: items.put((_READY, None))) if speak else None
+    chunks = stream_response_text(user_input, history)
+    filler = filler_segment(options) if pipeline and FILLER_AFTER > 0 else None
+    stop = threading.Event()
+    if pipeline:
+        # A sentence's audio goes out as soon as it is synthesized, not
+        # when Gemini next sends a chunk
+        chunks = read_ahead(chunks, items, stop, FILLER_AFTER if filler else None)
+    parts = []
+    try:
+        try:
+            for text in chunks:
+                if text is None:
+                    yield "audio", audio_payload(filler, options)
+                    continue
+                if text is _READY:
+                    for segment in pipeline.ready():
+                        yield "audio", audio_payload(segment, options)
+                    continue
+                parts.append(text)
+                yield "text", {"text": text}
+                if pipeline:
+                    pipeline.feed(text)
+                    for segment in pipeline.ready():
+                        yield "audio", audio_payload(segment, options)
+        except Exception as e:
+            segment = banked_segment(ERROR_MESSAGE_PREFIX, options) if pipeline else None
+            if segment:
+                yield "audio", audio_payload(segment, options)
+            yield "error", {"error": error_message(e)}
+            return
+
+        if pipeline:
+            for segment in pipeline.finish():
+                yield "audio", audio_payload(segment, options)
+            if not parts:
+                segment = banked_segment(NO_RESPONSE_MESSAGE, options)
+                if segment:
+                    yield "audio", audio_payload(segment, options)
+    finally:
+        # Also reached when the client disconnects and the generator is
+        # closed: Gemini's stream is no longer read, which frees its slot,
+        # and sentences still being synthesized are cancelled
+        stop.set()
+        chunks.close()
+        if pipeline:
+            pipeline.close()
+
+    response_text = "".join(parts) or NO_RESPONSE_MESSAGE
+    if parts:
+        conversations.add_turn(sid, user_input, response_text)
+    yield "done", {"response": response_text, "spoken": speak}
+
+
+def sse_frames(events):
+    # Text chunks go out as unnamed (default "message") events
+    for event, payload in events:
+        yield sse_event(payload, event=None if event == "text" else event)
+
+
+def ndjson_lines(events):
+    for event, payload in events:
+        yield json.dumps(dict(payload, type=event), ensure_ascii=False) + "\n"
+
+
+STREAM_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
 
-        // Update the voice input setup function
-        function setupVoiceInput() {
-            const micButton = document.getElementById('mic-button');
-
-            // Speech recognition setup with error handling and logging
-            let recognition;
-            try {
-                const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
-                if (!SpeechRecognition) {
-                    console.error('Speech Recognition API not supported in this browser');
-                    micButton.innerHTML = 'Voice input not supported';
-                    micButton.disabled = true;
-                    return;
-                }
-                recognition = new SpeechRecognition();
-            } catch (e) {
-                console.error('Speech recognition error:', e);
-                micButton.innerHTML = 'Voice input error';
-                micButton.disabled = true;
-                return;
-            }
-
-            // Configure recognition settings
-            recognition.continuous = false; // Changed to false to prevent multiple results
-            recognition.interimResults = true;
-            recognition.lang = 'hi-IN'; // Set to Hindi for Hindi recognition
-            
-            let isListening = false;
-            let currentTranscript = '';
-
-            recognition.onstart = () => {
-                console.log('Speech recognition started');
-                isListening = true;
-                micButton.style.backgroundColor = '#ff4444';
-                micButton.innerHTML = '🎤 Release to Send';
-            };
-
-            recognition.onend = () => {
-                console.log('Speech recognition ended');
-                isListening = false;
-                micButton.style.background = 'linear-gradient(135deg, #2563eb 0%, #3b82f6 100%)';
-                micButton.innerHTML = '🎤 Hold to Speak';
-            };
-
-            recognition.onresult = (event) => {
-                console.log('Speech recognition result received');
-                currentTranscript = '';
-                for (const result of event.results) {
-                    if (result.isFinal) {
-                        currentTranscript += result[0].transcript;
-                        console.log('Final transcript:', currentTranscript);
-                    }
-                }
-                
-                document.getElementById('user-input').value = currentTranscript;
-            };
-
-            recognition.onerror = (event) => {
-                console.error('Speech recognition error:', event.error);
-                stopListening();
-                micButton.style.background = 'linear-gradient(135deg, #2563eb 0%, #3b82f6 100%)';
-                micButton.innerHTML = '🎤 Hold to Speak';
-            };
-
-            function startListening() {
-                try {
-                    if (!isListening) {
-                        console.log('Starting speech recognition...');
-                        recognition.start();
-                    }
-                } catch (e) {
-                    console.error('Error starting speech recognition:', e);
-                }
-            }
-
-            function stopListening() {
-                try {
-                    if (isListening) {
-                        console.log('Stopping speech recognition...');
-                        recognition.stop();
-                        
-                        if (currentTranscript.trim()) {
-                            console.log('Sending message:', currentTranscript);
-                            document.getElementById('user-input').value = currentTranscript;
-                            sendMessage();
-                            currentTranscript = '';
-                        }
-                    }
-                } catch (e) {
-                    console.error('Error stopping speech recognition:', e);
-                }
-            }
-
-            // Mouse events
-            micButton.addEventListener('mousedown', (e) => {
-                e.preventDefault();
-                startListening();
-            });
-
-            micButton.addEventListener('mouseup', (e) => {
-                e.preventDefault();
-                stopListening();
-            });
-
-            micButton.addEventListener('mouseleave', (e) => {
-                e.preventDefault();
-                if (isListening) stopListening();
-            });
-
-            // Touch events for mobile
-            micButton.addEventListener('touchstart', (e) => {
-                e.preventDefault();
-                startListening();
-            });
-
-            micButton.addEventListener('touchend', (e) => {
-                e.preventDefault();
-                stopListening();
-            });
-        }
 
-        // Make sure to call setupVoiceInput after DOM is loaded
-        document.addEventListener('DOMContentLoaded', () => {
-            setupVoiceInput();
-            console.log('Voice input setup completed');
-        });
-    </script>
-</body>
-</html>
-'''
+# Streaming variant of /get_response: sends text chunks as Server-Sent Events
+# so the page can show the reply while it is still being generated.
+# With speak=1 each finished sentence is also synthesized right away and sent
+# as an "audio" event, in sentence order.
+@app.route('/get_response/stream', methods=['POST'])
+def get_response_stream():
+    user_input = request.form.get("user_input", "").strip()
+    speak = request.form.get("speak") == "1" and bool(ELEVEN_LABS_API_KEY)
+    try:
+        options = speech_options(request.form.to_dict()) if speak else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        check_upstreams(speak)
+    except UpstreamBusyError as e:
+        return busy_response(e)
+    events = reply_events(user_input, conversation_id(), speak, options)
+    return Response(sse_frames(events), mimetype='text/event-stream', headers=STREAM_HEADERS)
+
+
+# One round trip per turn: the reply text and its audio come back together
+# as newline-delimited JSON. Each line has a "type": "text" chunks while the
+# reply is generated, "audio" segments (base64 audio in the negotiated
+# format, one per sentence, in order) as soon as each sentence is
+# synthesized, then "done" or "error". Send speak=0 to get text only.
+@app.route('/converse', methods=['POST'])
+def converse():
+    user_input = request.form.get("user_input", "").strip()
+    speak = request.form.get("speak", "1") == "1" and bool(ELEVEN_LABS_API_KEY)
+    try:
+        options = speech_options(request.form.to_dict()) if speak else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        check_upstreams(speak)
+    except UpstreamBusyError as e:
+        return busy_response(e)
+    events = reply_events(user_input, conversation_id(), speak, options)
+    return Response(ndjson_lines(events), mimetype='application/x-ndjson', headers=STREAM_HEADERS)
 
-@app.route('/')
-def chat():
-    return render_template_string(HTML_TEMPLATE)
 
-@app.route('/get_response', methods=['POST'])
-def get_response():
-    user_input = request.form.get("user_input", "").strip()
-    
-    if user_input:
-        try:
-            model = genai.GenerativeModel(
-                model_name="gemini-1.0-pro",
-                generation_config=generation_config
-            )
-
-            # Updated context to request Hindi responses
-            context = f"""You are a helpful AI assistant. Keep your responses concise and natural, as they will be spoken by a 3D character. 
-            Please respond in Hindi (using Devanagari script) to the following query: {user_input}"""
-            
-            response = model.generate_content(context)
-            response_text = response.text if response else "मैं क्षमा चाहता हूं, लेकिन मैं जवाब नहीं दे पाया।"
-            
-            return {"response": response_text}
-        except Exception as e:
-            return {"response": f"क्षमा करें, एक त्रुटि हुई: {str(e)}"}
-    
-    return {"response": "मुझे कोई इनपुट नहीं मिला। कृपय फिर स प्रयास करें।"}
+if os.getenv("WARM_UP_ON_START", "1") == "1":
+    start_warm_up()
 
+# Development server. In production run gunicorn -c gunicorn.conf.py
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.getenv("FLASK_DEBUG") == "1")
 
@@ -0,0 +1,911 @@
+"""ASGI serving mode with the same routes as app.py, on Starlette.
+
+Gemini is called through its async client and ElevenLabs through httpx, so a
+turn that is waiting on either upstream doesn't hold a worker thread and one
+process can keep many conversations in flight. Run it with
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+It also serves /ws/session, a WebSocket that carries a whole voice
+conversation (see VoiceSession); uvicorn needs a WebSocket implementation for
+it, e.g. pip install 'uvicorn[standard]'.
+"""
+import asyncio
+import base64
+import functools
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+
+# The thread-based warm-up in app.py is for the Flask server; this one warms
+# its own async clients in the lifespan handler below
+os.environ.setdefault("WARM_UP_ON_START", "0")
+
+from app import (
+    ADMISSION_LIMITS, AUDIO_CHUNK_SIZE, BATCH_CONCURRENCY, BATCH_ITEM_TIMEOUT, ELEVEN_LABS_API_KEY, ELEVENLABS_BASE_URL, ERROR_MESSAGE_PREFIX, FILLER_AFTER,
+    GEMINI_API_ENDPOINT, LIMITED_ROUTES, LIPSYNC, LOG_DETAILS_CHARS, RATE_LIMITS, NO_INPUT_MESSAGE, NO_RESPONSE_MESSAGE,
+    SESSION_HISTORY_TOKENS, STREAM_HEADERS, TTS_MAX_CONCURRENCY, TextToSpeechError, assets,
+    audio_payload, banked_segment, batch_error, batch_request, batch_result, build_prompt, cached_speech, conversations, error_message,
+    filler_segment, get_model, index_page, llm_flight, response_cache, speech_cache_key,
+    speech_lipsync, speech_options, speech_request, speech_text, sse_event, store_lipsync, tts_cache, tts_flight,
+    warm_up_audio_bank
+)
+from app import app as flask_app
+from app import gemini_text_chunks as gemini_text_chunks_sync, generate_reply as generate_reply_sync
+from app import gemini_slots as gemini_slots_sync
+from metrics import (
+    REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, ServerTiming, current_timing, record_timing,
+    stage, error_kind, HTTP_REQUESTS_IN_FLIGHT, HTTP_REQUEST_SECONDS, HTTP_REQUEST_BYTES,
+    LLM_FIRST_TOKEN_SECONDS, LLM_SECONDS, TTS_FIRST_BYTE_SECONDS, TTS_SECONDS, TTS_BYTES,
+    ENCODE_SECONDS, UPSTREAM_IN_FLIGHT, UPSTREAM_ERRORS
+)
+from response_cache import normalize_input
+from structured_logging import request_id
+from speech_pipeline import AsyncSpeechPipeline
+from upstream import AsyncConcurrencyLimit, AsyncUpstreamClient, UpstreamBusyError
+
+logger = logging.getLogger(__name__)
+
+elevenlabs = AsyncUpstreamClient(
+    ELEVENLABS_BASE_URL,
+    pool_size=int(os.getenv("ELEVENLABS_POOL_SIZE", 100)),
+    max_in_flight=int(os.getenv("ELEVENLABS_MAX_IN_FLIGHT", 100)),
+    connect_timeout=float(os.getenv("ELEVENLABS_CONNECT_TIMEOUT", 3.05)),
+    read_timeout=float(os.getenv("ELEVENLABS_READ_TIMEOUT", 30)),
+    retries=int(os.getenv("ELEVENLABS_RETRIES", 2)),
+    queue_timeout=float(os.getenv("ELEVENLABS_QUEUE_TIMEOUT", 5)),
+    max_queue=int(os.getenv("ELEVENLABS_MAX_QUEUE", 0)) or None,
+    name="elevenlabs"
+)
+# Gemini calls made through the async client; the REST transport's go
+# through app.gemini_slots on the thread pool
+gemini_slots = AsyncConcurrencyLimit(
+    "gemini",
+    int(os.getenv("GEMINI_MAX_IN_FLIGHT", 100)),
+    max_queue=int(os.getenv("GEMINI_MAX_QUEUE", 0)) or None,
+    max_wait=float(os.getenv("GEMINI_QUEUE_TIMEOUT", 5))
+)
+ADMISSION_LIMITS.extend([gemini_slots, elevenlabs.slots])
+ELEVENLABS_WARM_CONNECTIONS = int(os.getenv("ELEVENLABS_WARM_CONNECTIONS", 2))
+
+warm_up_status = {"ready": False, "gemini": None, "elevenlabs": None, "audio_bank": None}
+
+async def request_speech(text, options=None, timestamps=False):
+    # Returns (audio bytes, character alignment or None) for text, raises
+    # TextToSpeechError on API errors
+    path, headers, data = speech_request(text, options, timestamps=timestamps)
+    with UPSTREAM_IN_FLIGHT.track(upstream="elevenlabs"), stage("tts", TTS_SECONDS, mode="full"):
+        try:
+            response = await elevenlabs.post(path, json=data, headers=headers)
+        except UpstreamBusyError:
+            # Turned away by our own admission control, which counts it
+            raise
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(upstream="elevenlabs", kind=error_kind(e))
+            raise
+    if response.status_code != 200:
+        UPSTREAM_ERRORS.inc(upstream="elevenlabs", kind=str(response.status_code))
+        logger.warning("ElevenLabs API error", extra={
+            "status": response.status_code, "details": response.text[:LOG_DETAILS_CHARS]})
+        raise TextToSpeechError(response.status_code, response.text)
+    if timestamps:
+        body = response.json()
+        audio = base64.b64decode(body["audio_base64"])
+        alignment = body.get("alignment")
+    else:
+        audio, alignment = response.content, None
+    TTS_BYTES.observe(len(audio))
+    return audio, alignment
+
+
+async def synthesize_speech(text, options=None):
+    key = speech_cache_key(text, options)
+    audio = await run_in_threadpool(cached_speech, key)
+    if audio is None:
+        audio = await tts_flight.do_async(key, lambda: fetch_speech(text, key, options))
+    return audio
+
+
+async def fetch_speech(text, key, options=None):
+    audio, alignment = await request_speech(text, options, timestamps=LIPSYNC)
+    await run_in_threadpool(tts_cache.put, key, audio)
+    await run_in_threadpool(store_lipsync, key, audio, alignment, options)
+    return audio
+
+
+async def open_speech_stream(text, options=None):
+    path, headers, data = speech_request(text, options, stream=True)
+    with stage("tts_ttfb", TTS_FIRST_BYTE_SECONDS):
+        try:
+            response = await elevenlabs.post(path, json=data, headers=headers, stream=True)
+        except UpstreamBusyError:
+            # Turned away by our own admission control, which counts it
+            raise
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(upstream="elevenlabs", kind=error_kind(e))
+            raise
+    if response.status_code != 200:
+        UPSTREAM_ERRORS.inc(upstream="elevenlabs", kind=str(response.status_code))
+        details = (await response.aread()).decode('utf-8', 'replace')
+        await response.aclose()
+        logger.warning("ElevenLabs API error", extra={
+            "status": response.status_code, "details": details[:LOG_DETAILS_CHARS]})
+        raise TextToSpeechError(response.status_code, details)
+    return response
+
+
+async def iter_speech_stream(upstream, key):
+    chunks = []
+    try:
+        async for chunk in upstream.aiter_bytes(AUDIO_CHUNK_SIZE):
+            chunks.append(chunk)
+            yield chunk
+        await run_in_threadpool(tts_cache.put, key, b"".join(chunks))
+    finally:
+        await upstream.aclose()
+
+
+async def stream_speech(text, key, options=None):
+    start = time.perf_counter()
+    size = 0
+    with UPSTREAM_IN_FLIGHT.track(upstream="elevenlabs"):
+        async for chunk in iter_speech_stream(await open_speech_stream(text, options), key):
+            size += len(chunk)
+            yield chunk
+    TTS_SECONDS.observe(time.perf_counter() - start, mode="stream")
+    TTS_BYTES.observe(size)
+
+
+async def gemini_text_chunks(prompt):
+    # The REST transport that GEMINI_API_ENDPOINT selects has no async
+    # client, so with it the blocking calls run on the thread pool
+    if GEMINI_API_ENDPOINT:
+        async for text in iterate_in_threadpool(gemini_text_chunks_sync(prompt)):
+            yield text
+        return
+
+    async with gemini_slots.slot():
+        start = time.perf_counter()
+        first_token = True
+        with UPSTREAM_IN_FLIGHT.track(upstream="gemini"):
+            try:
+                response = await get_model().generate_content_async(prompt, stream=True)
+                async for chunk in response:
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        continue
+                    if text:
+                        if first_token:
+                            first_token = False
+                            LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                            record_timing("llm_ttft", time.perf_counter() - start)
+                        yield text
+            except Exception as e:
+                UPSTREAM_ERRORS.inc(upstream="gemini", kind=error_kind(e))
+                raise
+        LLM_SECONDS.observe(time.perf_counter() - start, mode="stream")
+
+
+async def stream_and_cache_reply(user_input):
+    parts = []
+    async for text in gemini_text_chunks(build_prompt(user_input)):
+        parts.append(text)
+        yield text
+    await run_in_threadpool(response_cache.put, user_input, "".join(parts))
+
+
+async def stream_response_text(user_input, history=""):
+    if history:
+        async for text in gemini_text_chunks(build_prompt(user_input, history)):
+            yield text
+        return
+
+    cached = await run_in_threadpool(response_cache.get, user_input)
+    if cached is not None:
+        yield cached
+        return
+
+    shared = llm_flight.stream_async(normalize_input(user_input),
+                                     lambda: stream_and_cache_reply(user_input))
+    async for text in shared:
+        yield text
+
+
+async def generate_reply(user_input, history="", timeout=None):
+    if GEMINI_API_ENDPOINT:
+        return await run_in_threadpool(generate_reply_sync, user_input, history, timeout)
+    async with gemini_slots.slot():
+        with UPSTREAM_IN_FLIGHT.track(upstream="gemini"), stage("llm", LLM_SECONDS, mode="full"):
+            try:
+                response = await get_model().generate_content_async(
+                    build_prompt(user_input, history),
+                    request_options={"timeout": timeout} if timeout else None)
+            except Exception as e:
+                UPSTREAM_ERRORS.inc(upstream="gemini", kind=error_kind(e))
+                raise
+    return response.text if response else None
+
+
+def asset_response(asset, request):
+    status, body, headers = asset.negotiate(
+        request.headers.get("accept-encoding"),
+        request.headers.get("if-none-match")
+    )
+    return Response(body, status_code=status, headers=headers)
+
+
+async def chat(request):
+    return asset_response(index_page, request)
+
+
+async def static_asset(request):
+    asset = assets.get(request.path_params["name"])
+    if asset is None:
+        return Response(status_code=404)
+    return asset_response(asset, request)
+
+
+async def readyz(request):
+    return JSONResponse(warm_up_status, status_code=200 if warm_up_status["ready"] else 503)
+
+
+async def prometheus_metrics(request):
+    return Response(REGISTRY.render(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+class RequestMiddleware:
+    # Request ID, metrics and Server-Timing: the ASGI counterpart of the
+    # before/after_request hooks in app.py
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        rid = headers.get(b"x-request-id", b"").decode('latin-1') or uuid.uuid4().hex
+        rid_token = request_id.set(rid)
+        start = time.perf_counter()
+        timing = ServerTiming()
+        token = current_timing.set(timing)
+        status = 500
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing.add("app", time.perf_counter() - start)
+                response_headers = MutableHeaders(scope=message)
+                response_headers.append("Server-Timing", timing.header())
+                response_headers.append("X-Request-ID", rid)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            length = headers.get(b"content-length", b"0")
+            HTTP_REQUEST_BYTES.observe(int(length) if length.isdigit() else 0, route=route)
+            elapsed = time.perf_counter() - start
+            labels = {"route": route, "method": scope["method"], "status": status}
+            HTTP_REQUEST_SECONDS.observe(elapsed, **labels)
+            logger.info("Request finished", extra=dict(
+                labels, duration_ms=round(elapsed * 1000, 1), sampled=True))
+            current_timing.reset(token)
+            request_id.reset(rid_token)
+
+
+class RateLimitMiddleware:
+    # app.apply_rate_limit; inside SessionMiddleware, so it sees the
+    # conversation id
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        kind = LIMITED_ROUTES.get(scope["path"]) if scope["type"] == "http" else None
+        if kind is not None:
+            wait = RATE_LIMITS[kind].take(scope["session"].get("sid"), client_address(scope))
+            if wait:
+                await retry_later("Too many requests", wait, 429)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+def client_address(scope):
+    client = scope.get("client")
+    return client[0] if client else None
+
+
+def retry_later(message, retry_after, status_code):
+    return JSONResponse({"error": message, "retry_after": retry_after}, status_code=status_code,
+                        headers={"Retry-After": str(retry_after)})
+
+
+def busy_response(e):
+    return retry_later(str(e), e.retry_after, 503)
+
+
+def check_upstreams(speak):
+    # app.check_upstreams, with this server's limits
+    (gemini_slots_sync if GEMINI_API_ENDPOINT else gemini_slots).check()
+    if speak:
+        elevenlabs.slots.check()
+
+
+def conversation_id(request):
+    if "sid" not in request.session:
+        request.session["sid"] = uuid.uuid4().hex
+    return request.session["sid"]
+
+
+async def read_form(request):
+    # The page only sends urlencoded forms, which don't need python-multipart.
+    # Raises ValueError for a body that isn't UTF-8.
+    try:
+        body = (await request.body()).decode('utf-8')
+    except UnicodeDecodeError:
+        raise ValueError("Form body is not valid UTF-8")
+    form = parse_qs(body)
+    return {name: values[0] for name, values in form.items()}
+
+
+async def get_response(request):
+    try:
+        form = await read_form(request)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    user_input = form.get("user_input", "").strip()
+
+    if user_input:
+        sid = conversation_id(request)
+        history = conversations.history(sid, SESSION_HISTORY_TOKENS)
+
+        cached = None if history else await run_in_threadpool(response_cache.get, user_input)
+        if cached is not None:
+            conversations.add_turn(sid, user_input, cached)
+            return JSONResponse({"response": cached})
+
+        try:
+            if history:
+                response_text = await generate_reply(user_input, history)
+            else:
+                response_text = await llm_flight.do_async(normalize_input(user_input),
+                                                          lambda: generate_reply(user_input))
+            if response_text:
+                if not history:
+                    await run_in_threadpool(response_cache.put, user_input, response_text)
+                conversations.add_turn(sid, user_input, response_text)
+            return JSONResponse({"response": response_text or NO_RESPONSE_MESSAGE})
+        except UpstreamBusyError as e:
+            return busy_response(e)
+        except Exception as e:
+            return JSONResponse({"response": error_message(e)})
+
+    return JSONResponse({"response": NO_INPUT_MESSAGE})
+
+
+async def batch_reply(user_input, timeout, use_cache):
+    # Async version of app.batch_reply
+    if not user_input:
+        raise ValueError("empty input")
+    if use_cache:
+        cached = await run_in_threadpool(response_cache.get, user_input)
+        if cached is not None:
+            return cached, True
+    response_text = await generate_reply(user_input, timeout=timeout)
+    if use_cache and response_text:
+        await run_in_threadpool(response_cache.put, user_input, response_text)
+    return response_text, False
+
+
+async def batch_replies(inputs, concurrency=BATCH_CONCURRENCY, timeout=BATCH_ITEM_TIMEOUT, use_cache=False):
+    """Async version of app.batch_replies: a batch_result per input as it
+    finishes. A call past its deadline is cancelled; closing the generator
+    cancels every call still running or waiting.
+    """
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(index, user_input):
+        async with slots:
+            started = time.perf_counter()
+            try:
+                response_text, cached = await asyncio.wait_for(
+                    batch_reply(user_input, timeout, use_cache), timeout)
+            except Exception as e:
+                return batch_result(index, user_input, started, error=batch_error(e, timeout))
+            return batch_result(index, user_input, started, response_text, cached=cached)
+
+    tasks = [asyncio.ensure_future(run(index, user_input)) for index, user_input in enumerate(inputs)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def get_responses(inputs, concurrency=BATCH_CONCURRENCY, timeout=BATCH_ITEM_TIMEOUT, use_cache=False):
+    results = [None] * len(inputs)
+    async for result in batch_replies(inputs, concurrency, timeout, use_cache):
+        results[result["index"]] = result
+    return results
+
+
+async def batch_events(results):
+    # Async version of app.batch_events
+    start = time.perf_counter()
+    count = errors = 0
+    async for result in results:
+        count += 1
+        errors += result["error"] is not None
+        yield "result", result
+    yield "done", {"count": count, "errors": errors,
+                   "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+
+async def get_response_batch(request):
+    try:
+        inputs, concurrency, timeout, use_cache, stream = batch_request(await read_json_value(request))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        check_upstreams(False)
+    except UpstreamBusyError as e:
+        return busy_response(e)
+    if not stream:
+        return JSONResponse({"results": await get_responses(inputs, concurrency, timeout, use_cache)})
+    events = batch_events(batch_replies(inputs, concurrency, timeout, use_cache))
+    return StreamingResponse(ndjson_lines(events), media_type='application/x-ndjson', headers=STREAM_HEADERS)
+
+
+_END = object()
+# Put in a read_ahead queue when a sentence's audio may be ready
+_READY = object()
+
+
+async def read_ahead(chunks, items, delay=None):
+    # Async version of app.read_ahead: chunks are read into the asyncio
+    # queue items by a task, which is cancelled when this generator closes
+    async def pump():
+        try:
+            async for chunk in chunks:
+                items.put_nowait((chunk, None))
+            items.put_nowait((_END, None))
+        except Exception as e:
+            items.put_nowait((_END, e))
+
+    task = asyncio.ensure_future(pump())
+    first = asyncio.ensure_future(items.get())
+    try:
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if not done:
+            yield None
+        item = await first
+        while True:
+            chunk, error = item
+            if chunk is _END:
+                if error is not None:
+                    raise error
+                return
+            yield chunk
+            item = await items.get()
+    finally:
+        first.cancel()
+        task.cancel()
+
+
+async def reply_events(user_input, sid, speak, options=None, encode_audio=audio_payload):
+    # Async version of app.reply_events
+    async def encode(segment):
+        # Lip-sync, whose cache may be read from disk or the shared
+        # backend, and base64 run off the event loop
+        return await run_in_threadpool(encode_audio, segment, options)
+
+    if not user_input:
+        segment = banked_segment(NO_INPUT_MESSAGE, options) if speak else None
+        if segment:
+            yield "audio", await encode(segment)
+        yield "done", {"response": NO_INPUT_MESSAGE}
+        return
+
+    history = conversations.history(sid, SESSION_HISTORY_TOKENS)
+
+    synthesize = functools.partial(synthesize_speech, options=options)
+    items = asyncio.Queue()
+    pipeline = AsyncSpeechPipeline(synthesize, TTS_MAX_CONCURRENCY,
+                                   on_done=lambda: items.put_nowait((_READY, None))) if speak else None
+    chunks = stream_response_text(user_input, history)
+    filler = filler_segment(options) if pipeline and FILLER_AFTER > 0 else None
+    if pipeline:
+        # A sentence's audio goes out as soon as it is synthesized, not
+        # when Gemini next sends a chunk
+        chunks = read_ahead(chunks, items, FILLER_AFTER if filler else None)
+    parts = []
+    try:
+        try:
+            async for text in chunks:
+                if text is None:
+                    yield "audio", await encode(filler)
+                    continue
+                if text is _READY:
+                    for segment in pipeline.ready():
+                        yield "audio", await encode(segment)
+                    continue
+                parts.append(text)
+                yield "text", {"text": text}
+                if pipeline:
+                    pipeline.feed(text)
+                    for segment in pipeline.ready():
+                        yield "audio", await encode(segment)
+        except Exception as e:
+            segment = banked_segment(ERROR_MESSAGE_PREFIX, options) if pipeline else None
+            if segment:
+                yield "audio", await encode(segment)
+            yield "error", {"error": error_message(e)}
+            return
+
+        if pipeline:
+            async for segment in pipeline.finish():
+                yield "audio", await encode(segment)
+            if not parts:
+                segment = banked_segment(NO_RESPONSE_MESSAGE, options)
+                if segment:
+                    yield "audio", await encode(segment)
+    finally:
+        # Also reached when the client goes away or interrupts the turn:
+        # sentences still being synthesized are cancelled and Gemini's
+        # stream is no longer read
+        if pipeline:
+            pipeline.close()
+            await chunks.aclose()
+
+    response_text = "".join(parts) or NO_RESPONSE_MESSAGE
+    if parts:
+        conversations.add_turn(sid, user_input, response_text)
+    yield "done", {"response": response_text, "spoken": speak}
+
+
+async def sse_frames(events):
+    async for event, payload in events:
+        yield sse_event(payload, event=None if event == "text" else event)
+
+
+async def ndjson_lines(events):
+    async for event, payload in events:
+        yield json.dumps(dict(payload, type=event), ensure_ascii=False) + "\n"
+
+
+async def get_response_stream(request):
+    try:
+        form = await read_form(request)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    user_input = form.get("user_input", "").strip()
+    speak = form.get("speak") == "1" and bool(ELEVEN_LABS_API_KEY)
+    try:
+        options = speech_options(form) if speak else None
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        check_upstreams(speak)
+    except UpstreamBusyError as e:
+        return busy_response(e)
+    events = reply_events(user_input, conversation_id(request), speak, options)
+    return StreamingResponse(sse_frames(events), media_type='text/event-stream', headers=STREAM_HEADERS)
+
+
+async def converse(request):
+    try:
+        form = await read_form(request)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    user_input = form.get("user_input", "").strip()
+    speak = form.get("speak", "1") == "1" and bool(ELEVEN_LABS_API_KEY)
+    try:
+        options = speech_options(form) if speak else None
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        check_upstreams(speak)
+    except UpstreamBusyError as e:
+        return busy_response(e)
+    events = reply_events(user_input, conversation_id(request), speak, options)
+    return StreamingResponse(ndjson_lines(events), media_type='application/x-ndjson', headers=STREAM_HEADERS)
+
+
+def socket_audio(segment, options=None):
+    # audio_payload for /ws/session: the clip stays raw bytes and is sent as
+    # a binary frame right after the JSON header
+    if "audio" in segment:
+        timeline = speech_lipsync(segment["text"], segment["audio"], options=options)
+        segment = dict(segment, content_type=options.format.content_type, lipsync=timeline)
+    return segment
+
+
+class VoiceSession:
+    """One /ws/session socket, open for a whole voice conversation.
+
+    Client messages are JSON:
+
+        {"type": "transcript", "text": "...", "final": false}
+        {"type": "barge_in"}
+
+    Each final transcript starts a turn; turns are numbered from 1 in the
+    order they arrive, and everything sent for one carries its number.
+    Interim transcripts are only remembered, for a final one that arrives
+    empty. A barge-in, or a final transcript while a reply is still going,
+    cancels that reply: its Gemini stream and any speech not yet
+    synthesized. The server sends the events /converse streams (text,
+    audio, done, error) as JSON plus "interrupted"; an audio event with
+    "bytes" is followed by a binary frame holding the clip. A turn turned
+    away by the chat rate limit or an overloaded upstream gets an error
+    with "retry_after" instead.
+    """
+
+    def __init__(self, websocket, sid, address, speak, options):
+        self.websocket = websocket
+        self.sid = sid
+        self.address = address
+        self.speak = speak
+        self.options = options
+        self.interim = ""
+        self.turns = 0
+        self.task = None
+        self.sending = asyncio.Lock()
+
+    async def send(self, message, data=None):
+        async with self.sending:
+            await self.websocket.send_text(json.dumps(message, ensure_ascii=False))
+            if data is not None:
+                await self.websocket.send_bytes(data)
+
+    async def reply(self, turn, user_input):
+        request_id.set(uuid.uuid4().hex)
+        events = reply_events(user_input, self.sid, self.speak, self.options, socket_audio)
+        try:
+            async for event, payload in events:
+                message = dict(payload, type=event, turn=turn)
+                data = message.pop("audio", None)
+                if data is not None:
+                    message["bytes"] = len(data)
+                # Shielded so cancelling the turn never splits a header
+                # from its audio
+                await asyncio.shield(self.send(message, data))
+        finally:
+            await events.aclose()
+
+    async def interrupt(self, notify=True):
+        task, self.task = self.task, None
+        if task is None:
+            return
+        running = not task.done()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        if running and notify:
+            await self.send({"type": "interrupted", "turn": self.turns})
+
+    def admit(self):
+        # The rate limit and overload checks an HTTP turn gets; returns why
+        # the turn is refused, or None
+        wait = RATE_LIMITS["chat"].take(self.sid, self.address)
+        if wait:
+            return {"error": "Too many requests", "retry_after": wait}
+        try:
+            check_upstreams(self.speak)
+        except UpstreamBusyError as e:
+            return {"error": str(e), "retry_after": e.retry_after}
+        return None
+
+    async def handle(self, message):
+        kind = message.get("type")
+        if kind == "transcript":
+            text = str(message.get("text") or "").strip()
+            if not message.get("final"):
+                self.interim = text
+                return
+            text, self.interim = text or self.interim, ""
+            await self.interrupt()
+            self.turns += 1
+            refused = self.admit()
+            if refused:
+                await self.send(dict(refused, type="error", turn=self.turns))
+                return
+            self.task = asyncio.create_task(self.reply(self.turns, text))
+        elif kind == "barge_in":
+            self.interim = ""
+            await self.interrupt()
+        else:
+            await self.send({"type": "error", "error": f"Unknown message type {kind!r}"})
+
+    async def run(self):
+        start = time.perf_counter()
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                try:
+                    message = json.loads(message.get("text") or "")
+                except ValueError:
+                    await self.send({"type": "error", "error": "Messages must be JSON text"})
+                    continue
+                if isinstance(message, dict):
+                    await self.handle(message)
+        finally:
+            await self.interrupt(notify=False)
+            logger.info("Voice session closed", extra={
+                "turns": self.turns, "duration_ms": round((time.perf_counter() - start) * 1000, 1)})
+
+
+async def session_socket(websocket):
+    # Speech preferences come in the query string, as the form fields they
+    # are for /converse
+    params = dict(websocket.query_params)
+    speak = params.get("speak", "1") == "1" and bool(ELEVEN_LABS_API_KEY)
+    try:
+        options = speech_options(params) if speak else None
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+    await websocket.accept()
+    await VoiceSession(websocket, conversation_id(websocket), client_address(websocket.scope),
+                       speak, options).run()
+
+
+async def read_json_value(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def text_to_speech(request):
+    params = await read_json_value(request)
+    try:
+        text = speech_text(params)
+        # Accept describes the JSON response here, so only the body counts
+        options = speech_options(params)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    key = speech_cache_key(text, options)
+    audio = await run_in_threadpool(cached_speech, key)
+    if audio is None:
+        if not ELEVEN_LABS_API_KEY:
+            return JSONResponse({"error": "ElevenLabs API key not configured"}, status_code=500)
+        try:
+            audio = await tts_flight.do_async(key, lambda: fetch_speech(text, key, options))
+        except TextToSpeechError as e:
+            return JSONResponse({"error": str(e), "details": e.details}, status_code=500)
+        except UpstreamBusyError as e:
+            return busy_response(e)
+        except Exception as e:
+            logger.exception("Error in text-to-speech")
+            return JSONResponse({"error": str(e)}, status_code=500)
+
+    with stage("encode", ENCODE_SECONDS):
+        audio_base64 = base64.b64encode(audio).decode('utf-8')
+    lipsync = await run_in_threadpool(speech_lipsync, text, audio, key, options)
+    return JSONResponse({
+        "audio": audio_base64,
+        "format": options.format.name,
+        "content_type": options.format.content_type,
+        "lipsync": lipsync
+    })
+
+
+async def text_to_speech_stream(request):
+    params = await read_json_value(request)
+    try:
+        text = speech_text(params)
+        options = speech_options(params, request.headers.get("accept"))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    key = speech_cache_key(text, options)
+    audio = await run_in_threadpool(cached_speech, key)
+    if audio is not None:
+        headers = {
+            "Cache-Control": "no-store",
+            "X-Audio-Format": options.format.name,
+            "X-Cache": "HIT"
+        }
+        timeline = await run_in_threadpool(speech_lipsync, text, audio, key, options)
+        if timeline is not None:
+            headers["X-Lipsync"] = json.dumps(timeline)
+        return Response(audio, media_type=options.format.content_type, headers=headers)
+
+    if not ELEVEN_LABS_API_KEY:
+        return JSONResponse({"error": "ElevenLabs API key not configured"}, status_code=500)
+
+    shared = tts_flight.stream_async(key, lambda: stream_speech(text, key, options))
+    error = await shared.wait_started()
+    if isinstance(error, TextToSpeechError):
+        return JSONResponse({"error": str(error), "details": error.details}, status_code=500)
+    if isinstance(error, UpstreamBusyError):
+        return busy_response(error)
+    if error is not None:
+        logger.error("Error in text-to-speech stream", exc_info=error)
+        return JSONResponse({"error": str(error)}, status_code=502)
+
+    return StreamingResponse(shared, media_type=options.format.content_type, headers={
+        "Cache-Control": "no-store",
+        "X-Audio-Format": options.format.name,
+        "X-Cache": "MISS"
+    })
+
+
+async def warm_up():
+    try:
+        if GEMINI_API_ENDPOINT:
+            await run_in_threadpool(get_model().count_tokens, "नमस्ते")
+        else:
+            await get_model().count_tokens_async("नमस्ते")
+        warm_up_status["gemini"] = "ok"
+    except Exception as e:
+        logger.warning("Gemini warm-up failed: %s", e)
+        warm_up_status["gemini"] = f"error: {str(e)}"
+
+    if ELEVEN_LABS_API_KEY:
+        async def open_connection():
+            response = await elevenlabs.get("/v1/models", headers={"xi-api-key": ELEVEN_LABS_API_KEY})
+            await response.aclose()
+
+        try:
+            await asyncio.gather(*[open_connection() for _ in range(ELEVENLABS_WARM_CONNECTIONS)])
+            warm_up_status["elevenlabs"] = "ok"
+        except Exception as e:
+            logger.warning("ElevenLabs warm-up failed: %s", e)
+            warm_up_status["elevenlabs"] = f"error: {str(e)}"
+    else:
+        warm_up_status["elevenlabs"] = "skipped"
+
+    # A handful of one-off calls, made with app.py's client on a thread
+    warm_up_status["audio_bank"] = await run_in_threadpool(warm_up_audio_bank)
+    warm_up_status["ready"] = True
+    logger.info("Warm-up finished", extra={"status": dict(warm_up_status)})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    warm_up_task.cancel()
+    await elevenlabs.aclose()
+
+
+app = Starlette(routes=[
+    Route('/', chat),
+    Route('/assets/{name:path}', static_asset),
+    Route('/readyz', readyz),
+    Route('/metrics', prometheus_metrics),
+    Route('/get_response', get_response, methods=['POST']),
+    Route('/get_response/stream', get_response_stream, methods=['POST']),
+    Route('/get_response/batch', get_response_batch, methods=['POST']),
+    Route('/converse', converse, methods=['POST']),
+    Route('/text-to-speech', text_to_speech, methods=['POST']),
+    Route('/text-to-speech/stream', text_to_speech_stream, methods=['POST']),
+    WebSocketRoute('/ws/session', session_socket),
+], middleware=[
+    Middleware(RequestMiddleware),
+    Middleware(SessionMiddleware, secret_key=flask_app.secret_key),
+    Middleware(RateLimitMiddleware)
+], lifespan=lifespan)
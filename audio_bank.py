@@ -0,0 +1,180 @@
+"""Ready-to-serve clips of the phrases the app says over and over.
+
+    python -m audio_bank
+    python -m audio_bank --format mp3_44100_128 --format mp3_44100_32 --force
+
+Short fillers played while Gemini is slow to start ("हम्म…"), greetings and
+every fixed fallback and error phrase are synthesized once for the
+configured voice and kept in AUDIO_BANK_DIR (default .cache/audio_bank),
+each with its lip-sync timeline. The server loads the bank at startup and
+says these phrases without calling ElevenLabs; its warm-up also synthesizes
+any that are missing when an API key is configured.
+
+Building holds a lock file in the bank's directory, so when several worker
+processes start at once (see gunicorn.conf.py) one of them synthesizes the
+missing clips and the others wait and load what it built.
+
+Clips are keyed like the TTS cache (app.speech_cache_key), so a banked
+phrase asked for through /text-to-speech comes from here too, in the
+formats the bank was built for (AUDIO_BANK_FORMATS).
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds in several processes aren't serialized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+Clip = namedtuple("Clip", "kind text audio lipsync")
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = ".build.lock"
+
+
+class AudioBank:
+    def __init__(self, directory):
+        self.directory = directory
+        self.clips = {}
+        self.hits = 0
+        self.lock = threading.Lock()
+        self.load()
+
+    def __contains__(self, key):
+        return key in self.clips
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        # manifest.json maps each key to its kind, text and lip-sync
+        # timeline; the audio is in <key>.audio next to it
+        try:
+            manifest = self.read_manifest()
+        except ValueError as e:
+            logger.warning("Ignoring unreadable audio bank manifest: %s", e)
+            return
+
+        clips = {}
+        for key, entry in manifest.items():
+            try:
+                with open(self._path(f"{key}.audio"), "rb") as f:
+                    audio = f.read()
+            except OSError:
+                continue
+            clips[key] = Clip(entry["kind"], entry["text"], audio, entry.get("lipsync"))
+        with self.lock:
+            self.clips = clips
+        logger.info("Audio bank loaded", extra={"clips": len(clips), "directory": self.directory})
+
+    def get(self, key):
+        clip = self.clips.get(key)
+        if clip is not None:
+            with self.lock:
+                self.hits += 1
+        return clip
+
+    def lipsync(self, key):
+        clip = self.clips.get(key)
+        return clip.lipsync if clip is not None else None
+
+    def pick(self, keys):
+        # A random one of the banked clips among keys, or None
+        found = [key for key in keys if key in self.clips]
+        return self.get(random.choice(found)) if found else None
+
+    @contextmanager
+    def build_lock(self):
+        # Exclusive between processes (and threads) on this host
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(LOCK_NAME), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read_manifest(self):
+        try:
+            with open(self._path(MANIFEST_NAME), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def add(self, key, kind, text, audio, lipsync=None):
+        os.makedirs(self.directory, exist_ok=True)
+        write_file(self._path(f"{key}.audio"), audio)
+        with self.lock:
+            self.clips[key] = Clip(kind, text, audio, lipsync)
+            # Entries another process added since this one loaded are kept
+            try:
+                manifest = self.read_manifest()
+            except ValueError:
+                manifest = {}
+            manifest.update({key: {"kind": clip.kind, "text": clip.text, "lipsync": clip.lipsync}
+                             for key, clip in self.clips.items()})
+            write_file(self._path(MANIFEST_NAME),
+                       json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8"))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "clips": len(self.clips),
+                "bytes": sum(len(clip.audio) for clip in self.clips.values()),
+                "hits": self.hits
+            }
+
+
+def write_file(path, data):
+    # Written to a temp file of its own next to the target and renamed, so
+    # a running server never reads half a file and concurrent writers of
+    # the same file don't trip over each other's temp file
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--format", action="append", dest="formats",
+                        help="output format to build for, repeatable (default AUDIO_BANK_FORMATS)")
+    parser.add_argument("--force", action="store_true", help="synthesize every phrase again")
+    args = parser.parse_args()
+
+    # Only the bank is wanted from the app, not its warm-up
+    os.environ.setdefault("WARM_UP_ON_START", "0")
+    import app
+
+    if not app.ELEVEN_LABS_API_KEY:
+        parser.error("ELEVEN_LABS_API_KEY is not set")
+    try:
+        built = app.build_audio_bank(args.formats, args.force)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{app.audio_bank.directory}: {built} clips synthesized, "
+          f"{len(app.audio_bank.clips)} in the bank")
+    for clip in sorted(app.audio_bank.clips.values(), key=lambda clip: (clip.kind, clip.text)):
+        print(f"  {clip.kind:9} {len(clip.audio):7} bytes  {clip.text}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+"""Self-hosted three.js and an optimized avatar.
+
+    python -m avatar_assets
+    python -m avatar_assets --url https://models.readyplayer.me/<id>.glb --max-texture 512
+    python -m avatar_assets --input avatar.glb --output small.glb --skip-scripts
+
+Fetches the avatar (AVATAR_URL) once, keeps the original under .cache/avatar
+and writes an optimized copy, plus the three.js scripts the page loads, to
+VENDOR_DIR (default vendor/). The app serves that directory as fingerprinted,
+immutable assets under /assets/vendor/ and falls back to the CDNs for
+anything missing.
+
+A Ready Player Me GLB carries dozens of blend shapes, an idle animation and
+large textures; the page animates bones itself and drives only the morph
+targets in static/app.js's FACE_KEYS. The optimizer:
+
+- drops animations, and morph targets not in --keep-morphs
+- quantizes normals and tangents to bytes, texture coordinates to shorts
+  and skin weights and joints to bytes (KHR_mesh_quantization, which
+  three.js' GLTFLoader reads). Positions stay float: skinned meshes ignore
+  node transforms, so there is nowhere to put the dequantization scale
+- downscales textures above --max-texture pixels, when Pillow is installed
+- rewrites the binary chunk with only the data still referenced
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import struct
+
+import requests
+
+from audio_bank import write_file
+
+try:
+    import numpy as np
+except ImportError:  # without NumPy nothing is quantized
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow textures keep their size
+    Image = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+AVATAR_URL = os.getenv("AVATAR_URL", "https://models.readyplayer.me/6737560f478002db197d3b84.glb")
+VENDOR_DIR = os.getenv("VENDOR_DIR", os.path.join(ROOT, "vendor"))
+ORIGINALS_DIR = os.path.join(ROOT, ".cache", "avatar")
+AVATAR_NAME = "avatar.glb"
+
+# Served from VENDOR_DIR under these names, or from the CDN if not downloaded
+VENDOR_SCRIPTS = {
+    "three.min.js": "https://cdnjs.cloudflare.com/ajax/libs/three.js/r128/three.min.js",
+    "GLTFLoader.js": "https://cdn.jsdelivr.net/npm/three@0.128.0/examples/js/loaders/GLTFLoader.js",
+    "OrbitControls.js": "https://cdn.jsdelivr.net/npm/three@0.128.0/examples/js/controls/OrbitControls.js"
+}
+
+# The morph targets static/app.js animates (FACE_KEYS)
+KEEP_MORPHS = ("mouthOpen", "mouthSmile", "mouthRound", "eyebrowRaise", "eyesClosed")
+MAX_TEXTURE = 1024
+JPEG_QUALITY = 85
+FETCH_TIMEOUT = 60
+
+GLB_MAGIC = 0x46546C67
+JSON_CHUNK = 0x4E4F534A
+BIN_CHUNK = 0x004E4942
+
+BYTE, UNSIGNED_BYTE, SHORT, UNSIGNED_SHORT, UNSIGNED_INT, FLOAT = 5120, 5121, 5122, 5123, 5125, 5126
+ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER = 34962, 34963
+COMPONENTS = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT2": 4, "MAT3": 9, "MAT4": 16}
+if np is not None:
+    DTYPES = {BYTE: np.int8, UNSIGNED_BYTE: np.uint8, SHORT: np.int16,
+              UNSIGNED_SHORT: np.uint16, UNSIGNED_INT: np.uint32, FLOAT: np.float32}
+
+
+def read_glb(data):
+    magic, version, length = struct.unpack_from("<III", data, 0)
+    if magic != GLB_MAGIC or version != 2:
+        raise ValueError("Not a glTF 2.0 binary")
+    gltf, binary = None, b""
+    offset = 12
+    while offset < length:
+        chunk_length, chunk_type = struct.unpack_from("<II", data, offset)
+        chunk = data[offset + 8:offset + 8 + chunk_length]
+        if chunk_type == JSON_CHUNK:
+            gltf = json.loads(chunk)
+        elif chunk_type == BIN_CHUNK:
+            binary = bytes(chunk)
+        offset += 8 + chunk_length
+    if gltf is None:
+        raise ValueError("GLB has no JSON chunk")
+    if any("uri" in buffer for buffer in gltf.get("buffers", [])):
+        raise ValueError("GLB references external buffers")
+    return gltf, binary
+
+
+def write_glb(gltf, binary):
+    text = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    text += b" " * (-len(text) % 4)
+    binary += b"\0" * (-len(binary) % 4)
+    length = 12 + 8 + len(text) + (8 + len(binary) if binary else 0)
+    parts = [struct.pack("<III", GLB_MAGIC, 2, length), struct.pack("<II", len(text), JSON_CHUNK), text]
+    if binary:
+        parts += [struct.pack("<II", len(binary), BIN_CHUNK), binary]
+    return b"".join(parts)
+
+
+class BufferBuilder:
+    # Collects buffer views for the rewritten binary chunk
+    def __init__(self):
+        self.chunks = []
+        self.length = 0
+        self.views = []
+
+    def add(self, data, **view):
+        # Every view starts 4-byte aligned, as vertex attributes must
+        padding = -self.length % 4
+        if padding:
+            self.chunks.append(b"\0" * padding)
+            self.length += padding
+        self.views.append(dict(buffer=0, byteOffset=self.length, byteLength=len(data), **view))
+        self.chunks.append(data)
+        self.length += len(data)
+        return len(self.views) - 1
+
+    def binary(self):
+        return b"".join(self.chunks)
+
+
+def view_bytes(gltf, binary, index):
+    view = gltf["bufferViews"][index]
+    start = view.get("byteOffset", 0)
+    return binary[start:start + view["byteLength"]]
+
+
+def read_accessor(gltf, binary, accessor):
+    # Dense accessor -> (count, components) array
+    dtype = np.dtype(DTYPES[accessor["componentType"]])
+    components = COMPONENTS[accessor["type"]]
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    stride = view.get("byteStride") or dtype.itemsize * components
+    offset = view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+    array = np.ndarray((accessor["count"], components), dtype=dtype, buffer=binary,
+                       offset=offset, strides=(stride, dtype.itemsize))
+    return array.copy()
+
+
+def pack_rows(values):
+    # Vertex attribute elements must be 4-byte aligned: pad each row
+    row = values.shape[1] * values.itemsize
+    padding = -row % 4
+    if padding:
+        values = np.hstack([values, np.zeros((len(values), padding // values.itemsize), values.dtype)])
+    return values.tobytes(), row + padding if padding else None
+
+
+def quantize_weights(values):
+    # Bytes that still sum to exactly 255, or the skin drifts
+    weights = np.round(values * 255).astype(np.int16)
+    rows = np.flatnonzero(values.sum(axis=1) > 0)
+    residual = 255 - weights[rows].sum(axis=1)
+    weights[rows, weights[rows].argmax(axis=1)] += residual
+    return np.clip(weights, 0, 255).astype(np.uint8)
+
+
+def quantize(gltf, binary, accessor, semantic):
+    # Returns (data, accessor, byteStride, target), or None to keep the
+    # accessor as it is
+    if np is None or semantic is None or accessor.get("sparse") or "bufferView" not in accessor:
+        return None
+    values = read_accessor(gltf, binary, accessor)
+    component_type = accessor["componentType"]
+    normalized = True
+
+    if semantic == "INDICES":
+        # 65535 is the primitive restart value
+        if component_type != UNSIGNED_INT or values.max(initial=0) >= 65535:
+            return None
+        quantized, component_type, normalized = values.astype(np.uint16), UNSIGNED_SHORT, False
+    elif semantic.startswith("JOINTS_"):
+        if component_type == UNSIGNED_BYTE or values.max(initial=0) > 255:
+            return None
+        quantized, component_type, normalized = values.astype(np.uint8), UNSIGNED_BYTE, False
+    elif component_type != FLOAT:
+        return None
+    elif semantic in ("NORMAL", "TANGENT"):
+        quantized = np.round(np.clip(values, -1, 1) * 127).astype(np.int8)
+        component_type = BYTE
+    elif semantic.startswith("TEXCOORD_"):
+        if values.min(initial=0) < 0 or values.max(initial=0) > 1:
+            return None
+        quantized = np.round(values * 65535).astype(np.uint16)
+        component_type = UNSIGNED_SHORT
+    elif semantic.startswith("WEIGHTS_"):
+        quantized = quantize_weights(values)
+        component_type = UNSIGNED_BYTE
+    else:
+        return None
+
+    accessor = {key: value for key, value in accessor.items()
+                if key not in ("byteOffset", "min", "max", "normalized")}
+    accessor["componentType"] = component_type
+    if normalized:
+        accessor["normalized"] = True
+    if semantic == "INDICES":
+        return quantized.tobytes(), accessor, None, ELEMENT_ARRAY_BUFFER
+    data, stride = pack_rows(quantized)
+    return data, accessor, stride, ARRAY_BUFFER
+
+
+def drop_morph_targets(gltf, keep):
+    # Meshes without target names are left alone: nothing says which are used
+    dropped = 0
+    for mesh in gltf.get("meshes", []):
+        names = (mesh.get("extras") or {}).get("targetNames")
+        if not names:
+            continue
+        kept = [i for i, name in enumerate(names) if name in keep]
+        dropped += len(names) - len(kept)
+        for primitive in mesh["primitives"]:
+            if "targets" in primitive:
+                primitive["targets"] = [primitive["targets"][i] for i in kept]
+        if "weights" in mesh:
+            mesh["weights"] = [mesh["weights"][i] for i in kept]
+        mesh["extras"]["targetNames"] = [names[i] for i in kept]
+        if not kept:
+            del mesh["extras"]["targetNames"]
+            mesh.pop("weights", None)
+            for primitive in mesh["primitives"]:
+                primitive.pop("targets", None)
+    return dropped
+
+
+def downscale_image(data, mime_type, max_size):
+    if Image is None or mime_type not in ("image/jpeg", "image/png"):
+        return data
+    image = Image.open(io.BytesIO(data))
+    if max(image.size) <= max_size:
+        return data
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    out = io.BytesIO()
+    if mime_type == "image/jpeg":
+        image.convert("RGB").save(out, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    else:
+        image.save(out, "PNG", optimize=True)
+    return out.getvalue() if out.tell() < len(data) else data
+
+
+def optimize(data, keep_morphs=KEEP_MORPHS, max_texture=MAX_TEXTURE, quantize_attributes=True):
+    # GLB bytes -> (optimized GLB bytes, summary dict)
+    gltf, binary = read_glb(data)
+    if "KHR_draco_mesh_compression" in gltf.get("extensionsUsed", []):
+        raise ValueError("Draco-compressed GLBs aren't supported")
+
+    summary = {
+        "animations": len(gltf.pop("animations", [])),
+        "morph_targets_dropped": drop_morph_targets(gltf, set(keep_morphs)),
+        "accessors_quantized": 0,
+        "textures_downscaled": 0
+    }
+
+    builder = BufferBuilder()
+    accessors = []
+    new_accessors = {}  # (old index, semantic) -> new index
+    new_views = {}      # old view index -> new index, for copied views
+    extension_needed = False
+
+    def copy_view(index):
+        if index not in new_views:
+            view = gltf["bufferViews"][index]
+            extra = {key: view[key] for key in ("byteStride", "target") if key in view}
+            new_views[index] = builder.add(view_bytes(gltf, binary, index), **extra)
+        return new_views[index]
+
+    def keep(index, semantic=None):
+        nonlocal extension_needed
+        key = (index, semantic if quantize_attributes else None)
+        if key not in new_accessors:
+            accessor = gltf["accessors"][index]
+            packed = quantize(gltf, binary, accessor, semantic) if quantize_attributes else None
+            if packed:
+                data, accessor, stride, target = packed
+                view = {"target": target}
+                if stride:
+                    view["byteStride"] = stride
+                accessor["bufferView"] = builder.add(data, **view)
+                summary["accessors_quantized"] += 1
+                # Core glTF has no byte normals or tangents
+                extension_needed |= semantic in ("NORMAL", "TANGENT")
+            else:
+                accessor = json.loads(json.dumps(accessor))
+                if "bufferView" in accessor:
+                    accessor["bufferView"] = copy_view(accessor["bufferView"])
+                sparse = accessor.get("sparse")
+                if sparse:
+                    sparse["indices"]["bufferView"] = copy_view(sparse["indices"]["bufferView"])
+                    sparse["values"]["bufferView"] = copy_view(sparse["values"]["bufferView"])
+            new_accessors[key] = len(accessors)
+            accessors.append(accessor)
+        return new_accessors[key]
+
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh["primitives"]:
+            primitive["attributes"] = {name: keep(index, name)
+                                       for name, index in primitive["attributes"].items()}
+            if "indices" in primitive:
+                primitive["indices"] = keep(primitive["indices"], "INDICES")
+            if "targets" in primitive:
+                # Morph deltas stay float
+                primitive["targets"] = [{name: keep(index) for name, index in target.items()}
+                                        for target in primitive["targets"]]
+    for skin in gltf.get("skins", []):
+        if "inverseBindMatrices" in skin:
+            skin["inverseBindMatrices"] = keep(skin["inverseBindMatrices"])
+    for image in gltf.get("images", []):
+        if "bufferView" in image:
+            original = view_bytes(gltf, binary, image["bufferView"])
+            data = downscale_image(original, image.get("mimeType"), max_texture)
+            summary["textures_downscaled"] += data is not original
+            image["bufferView"] = builder.add(data)
+
+    gltf["accessors"] = accessors
+    gltf["bufferViews"] = builder.views
+    gltf["buffers"] = [{"byteLength": builder.length}] if builder.length else []
+    if extension_needed:
+        for key in ("extensionsUsed", "extensionsRequired"):
+            if "KHR_mesh_quantization" not in gltf.setdefault(key, []):
+                gltf[key].append("KHR_mesh_quantization")
+    return write_glb(gltf, builder.binary()), summary
+
+
+def fetch(url):
+    response = requests.get(url, timeout=FETCH_TIMEOUT)
+    response.raise_for_status()
+    return response.content
+
+
+def fetch_once(url, force=False):
+    # The original is kept, so re-running with other options doesn't refetch
+    path = os.path.join(ORIGINALS_DIR, hashlib.sha256(url.encode("utf-8")).hexdigest()[:16] + ".glb")
+    if force or not os.path.exists(path):
+        data = fetch(url)
+        os.makedirs(ORIGINALS_DIR, exist_ok=True)
+        write_file(path, data)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def format_mb(size):
+    return f"{size / (1024 * 1024):.2f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default=AVATAR_URL, help="avatar to fetch")
+    parser.add_argument("--input", help="optimize this local GLB instead of fetching --url")
+    parser.add_argument("--output", default=os.path.join(VENDOR_DIR, AVATAR_NAME))
+    parser.add_argument("--keep-morphs", default=",".join(KEEP_MORPHS),
+                        help="comma-separated morph target names to keep")
+    parser.add_argument("--max-texture", type=int, default=MAX_TEXTURE, help="longest texture side, in pixels")
+    parser.add_argument("--no-quantize", dest="quantize", action="store_false")
+    parser.add_argument("--skip-scripts", action="store_true", help="don't download the three.js scripts")
+    parser.add_argument("--force", action="store_true", help="download again even if already fetched")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, "rb") as f:
+            original = f.read()
+    else:
+        original = fetch_once(args.url, args.force)
+    keep_morphs = [name.strip() for name in args.keep_morphs.split(",") if name.strip()]
+    optimized, summary = optimize(original, keep_morphs, args.max_texture, args.quantize)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_file(args.output, optimized)
+    print(f"{args.output}: {format_mb(len(original))} -> {format_mb(len(optimized))}")
+    print("  " + ", ".join(f"{name.replace('_', ' ')}: {value}" for name, value in summary.items()))
+    if Image is None:
+        print("  textures kept their size: install Pillow to downscale them")
+
+    if not args.skip_scripts:
+        os.makedirs(VENDOR_DIR, exist_ok=True)
+        for name, url in VENDOR_SCRIPTS.items():
+            path = os.path.join(VENDOR_DIR, name)
+            if args.force or not os.path.exists(path):
+                write_file(path, fetch(url))
+            print(f"{path}: {format_mb(os.path.getsize(path))}")
+
+
+if __name__ == '__main__':
+    main()
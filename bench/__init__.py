@@ -0,0 +1 @@
+"""Load testing harness: stand-in upstream servers and a load driver."""
@@ -0,0 +1,253 @@
+"""Local stand-in for a Redis server, for the shared cache's redis:// backend.
+
+    python -m bench.fake_redis --port 6390
+    SHARED_CACHE_URL=redis://127.0.0.1:6390/0 python app.py
+
+It speaks enough of the Redis protocol (RESP2) for shared_cache and for
+redis-cli: PING, ECHO, AUTH, SELECT, GET, SET with EX/PX/NX/XX, DEL, EXISTS,
+DBSIZE, FLUSHDB, FLUSHALL and QUIT. Keys live in memory, per database, and
+with --max-mb the least recently used ones are evicted like maxmemory-policy
+allkeys-lru. With --password, AUTH is required before other commands.
+"""
+import argparse
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+
+
+class Store:
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.databases = {}  # db -> OrderedDict key -> (value, expires)
+        self.bytes = 0
+
+    def _db(self, db):
+        return self.databases.setdefault(db, OrderedDict())
+
+    def _live(self, entries, key, now):
+        # Caller holds the lock
+        entry = entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            self._delete(entries, key)
+            return None
+        return entry
+
+    def _delete(self, entries, key):
+        value, _ = entries.pop(key)
+        self.bytes -= len(key) + len(value)
+
+    def get(self, db, key):
+        with self.lock:
+            entries = self._db(db)
+            entry = self._live(entries, key, time.monotonic())
+            if entry is None:
+                return None
+            entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, db, key, value, ttl=None, only_if=None):
+        now = time.monotonic()
+        with self.lock:
+            entries = self._db(db)
+            exists = self._live(entries, key, now) is not None
+            if (only_if == "NX" and exists) or (only_if == "XX" and not exists):
+                return False
+            if exists:
+                self._delete(entries, key)
+            entries[key] = (value, now + ttl if ttl is not None else None)
+            self.bytes += len(key) + len(value)
+            self._evict()
+            return True
+
+    def _evict(self):
+        # Caller holds the lock; the least recently used key of the
+        # largest database goes first
+        while self.max_bytes and self.bytes > self.max_bytes:
+            oldest = [entries for entries in self.databases.values() if entries]
+            if not oldest:
+                return
+            entries = max(oldest, key=len)
+            self._delete(entries, next(iter(entries)))
+
+    def delete(self, db, keys):
+        now = time.monotonic()
+        with self.lock:
+            entries = self._db(db)
+            removed = 0
+            for key in keys:
+                if self._live(entries, key, now) is not None:
+                    self._delete(entries, key)
+                    removed += 1
+            return removed
+
+    def exists(self, db, keys):
+        now = time.monotonic()
+        with self.lock:
+            entries = self._db(db)
+            return sum(self._live(entries, key, now) is not None for key in keys)
+
+    def size(self, db):
+        with self.lock:
+            return len(self._db(db))
+
+    def flush(self, db=None):
+        with self.lock:
+            for number in list(self.databases) if db is None else [db]:
+                for key in list(self._db(number)):
+                    self._delete(self.databases[number], key)
+
+
+class CommandError(Exception):
+    pass
+
+
+class RedisHandler(socketserver.StreamRequestHandler):
+    store = None
+    password = None
+
+    def handle(self):
+        self.db = 0
+        self.authenticated = not self.password
+        while True:
+            try:
+                command = self.read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            if not command:
+                continue
+            name = command[0].decode("utf-8", "replace").upper()
+            try:
+                reply = self.run(name, command[1:])
+            except CommandError as e:
+                self.wfile.write(b"-" + str(e).encode("utf-8") + b"\r\n")
+                continue
+            self.wfile.write(encode(reply))
+            if name == "QUIT":
+                return
+
+    def read_command(self):
+        # An array of bulk strings, or an inline command as redis-cli may send
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            header = self.rfile.readline()
+            if not header.startswith(b"$"):
+                raise ValueError("expected a bulk string")
+            length = int(header[1:])
+            data = self.rfile.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("client went away")
+            args.append(data[:-2])
+        return args
+
+    def run(self, name, args):
+        if name == "AUTH":
+            if not self.password:
+                raise CommandError("ERR Client sent AUTH, but no password is set")
+            if args[-1:] != [self.password.encode("utf-8")]:
+                raise CommandError("WRONGPASS invalid username-password pair")
+            self.authenticated = True
+            return "OK"
+        if not self.authenticated:
+            raise CommandError("NOAUTH Authentication required.")
+
+        if name == "PING":
+            return args[0] if args else "PONG"
+        if name == "ECHO":
+            return args[0]
+        if name == "QUIT":
+            return "OK"
+        if name == "SELECT":
+            self.db = int(args[0])
+            return "OK"
+        if name == "GET":
+            return self.store.get(self.db, args[0])
+        if name == "SET":
+            return self.set(args)
+        if name == "DEL":
+            return self.store.delete(self.db, args)
+        if name == "EXISTS":
+            return self.store.exists(self.db, args)
+        if name == "DBSIZE":
+            return self.store.size(self.db)
+        if name == "FLUSHDB":
+            self.store.flush(self.db)
+            return "OK"
+        if name == "FLUSHALL":
+            self.store.flush()
+            return "OK"
+        raise CommandError(f"ERR unknown command '{name.lower()}'")
+
+    def set(self, args):
+        if len(args) < 2:
+            raise CommandError("ERR wrong number of arguments for 'set' command")
+        key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+        ttl = only_if = None
+        i = 0
+        while i < len(options):
+            option = options[i]
+            if option in (b"EX", b"PX") and i + 1 < len(options):
+                amount = int(options[i + 1])
+                ttl = amount if option == b"EX" else amount / 1000
+                i += 2
+            elif option in (b"NX", b"XX"):
+                only_if = option.decode("ascii")
+                i += 1
+            else:
+                raise CommandError("ERR syntax error")
+        return "OK" if self.store.set(self.db, key, value, ttl, only_if) else None
+
+
+def encode(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, str):
+        return b"+" + reply.encode("utf-8") + b"\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+
+class RedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(host="127.0.0.1", port=0, max_bytes=0, password=None):
+    # Starts a server thread and returns the server; port 0 picks a free port
+    handler = type("RedisHandler", (RedisHandler,), {
+        "store": Store(max_bytes), "password": password
+    })
+    server = RedisServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="fake-redis", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    parser.add_argument("--max-mb", type=float, default=0,
+                        help="evict least recently used keys above this size, default no limit")
+    parser.add_argument("--password", help="require AUTH with this password")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, int(args.max_mb * 1024 * 1024), args.password)
+    auth = f":{args.password}@" if args.password else ""
+    print(f"SHARED_CACHE_URL=redis://{auth}{args.host}:{server.server_address[1]}/0")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+"""Local stand-ins for the Gemini and ElevenLabs HTTP APIs.
+
+Point the app at them with GEMINI_API_ENDPOINT and ELEVENLABS_BASE_URL and
+it can be load tested without spending API quota:
+
+    python -m bench.fake_upstreams --gemini-port 9001 --elevenlabs-port 9002
+    GEMINI_API_ENDPOINT=http://127.0.0.1:9001 \\
+    ELEVENLABS_BASE_URL=http://127.0.0.1:9002 python app.py
+
+Latencies are drawn from a log-normal distribution given by its median and
+95th percentile. Gemini replies are streamed at a fixed token rate and
+ElevenLabs audio at a fixed byte rate, with a size proportional to the text.
+
+With --record DIR every request is proxied to the real API and the response
+(status, headers, chunks and their timing) is saved under DIR. With
+--replay DIR the saved responses are served back with the same timing, so a
+run is reproducible offline; requests that weren't recorded fall back to
+the synthetic responses.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+GEMINI_UPSTREAM = "https://generativelanguage.googleapis.com"
+ELEVENLABS_UPSTREAM = "https://api.elevenlabs.io"
+
+# Request headers forwarded to the real API when recording
+FORWARD_HEADERS = ("content-type", "accept", "x-goog-api-key", "x-goog-api-client", "xi-api-key")
+
+EMBEDDING_DIMENSIONS = 768
+
+# Bits per second of the MP3 the app asks for (mp3_44100_128)
+MP3_BITRATE = 128000
+
+# Filler for synthetic replies; a danda every few words gives the speech
+# pipeline sentences to split on
+WORDS = ("नमस्ते", "मैं", "आपकी", "मदद", "कर", "सकता", "हूँ", "यह", "एक",
+         "अच्छा", "सवाल", "है", "आज", "मौसम", "बहुत", "सुंदर", "और", "हम",
+         "साथ", "बात", "करेंगे")
+WORDS_PER_SENTENCE = 12
+
+
+class Latency:
+    def __init__(self, median, p95):
+        # p95 = median * exp(1.645 * sigma) for a log-normal distribution
+        self.mu = math.log(max(median, 1e-6))
+        self.sigma = math.log(max(p95, median) / max(median, 1e-6)) / 1.645 if median > 0 else 0
+        self.zero = median <= 0
+
+    def sample(self, rng):
+        if self.zero:
+            return 0.0
+        return rng.lognormvariate(self.mu, self.sigma)
+
+
+class Profile:
+    def __init__(self, gemini_latency, tokens_per_second, reply_tokens,
+                 tts_latency, audio_bytes_per_char, audio_bytes_per_second, seed=None):
+        self.gemini_latency = gemini_latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.tts_latency = tts_latency
+        self.audio_bytes_per_char = audio_bytes_per_char
+        self.audio_bytes_per_second = audio_bytes_per_second
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def gemini_delay(self):
+        with self.lock:
+            return self.gemini_latency.sample(self.rng)
+
+    def tts_delay(self):
+        with self.lock:
+            return self.tts_latency.sample(self.rng)
+
+
+def reply_words(prompt, count):
+    # Deterministic per prompt, so caches see the same reply every time
+    rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).digest())
+    words = []
+    for i in range(count):
+        word = rng.choice(WORDS)
+        if (i + 1) % WORDS_PER_SENTENCE == 0 or i == count - 1:
+            word += "।"
+        words.append(word + " ")
+    return words
+
+
+def fake_audio(text, size):
+    # MPEG frame sync bytes followed by filler derived from the text
+    seed = hashlib.sha256(text.encode('utf-8')).digest()
+    filler = (seed * (size // len(seed) + 1))[:max(size - 4, 0)]
+    return b"\xff\xf3\x44\xc4" + filler
+
+
+def alignment(text, duration):
+    # Character timings as /with-timestamps reports them, every character
+    # taking the same time
+    step = duration / max(len(text), 1)
+    return {
+        "characters": list(text),
+        "character_start_times_seconds": [round(i * step, 3) for i in range(len(text))],
+        "character_end_times_seconds": [round((i + 1) * step, 3) for i in range(len(text))]
+    }
+
+
+def embedding(text):
+    # A unit vector seeded by the text: equal texts embed equally
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    values = [rng.gauss(0, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+def candidate(text):
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0
+        }]
+    }
+
+
+def prompt_text(body):
+    try:
+        contents = json.loads(body or b"{}").get("contents", [])
+        return " ".join(part.get("text", "") for c in contents for part in c.get("parts", []))
+    except ValueError:
+        return ""
+
+
+class Fixtures:
+    # One JSON file per request, named by a hash of method, path and body
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(method, path, body):
+        path = path.split("?", 1)[0]
+        return hashlib.sha256(method.encode() + b" " + path.encode() + b"\n" + body).hexdigest()
+
+    def load(self, key):
+        try:
+            with open(os.path.join(self.directory, key + ".json"), encoding='utf-8') as f:
+                fixture = json.load(f)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return fixture
+
+    def save(self, key, fixture):
+        path = os.path.join(self.directory, key + ".json")
+        temp = path + ".tmp"
+        with open(temp, "w", encoding='utf-8') as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=1)
+        os.replace(temp, path)
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    # Keep-alive like the real APIs; streamed bodies use chunked encoding
+    protocol_version = "HTTP/1.1"
+    upstream = None   # set by the subclasses below
+    profile = None
+    mode = None       # None, "record" or "replay"
+    fixtures = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, payload, status=200):
+        self.send_body(status, "application/json", json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+    def start_chunked(self, status, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, data):
+        if data:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        self.dispatch("GET", b"")
+
+    def do_POST(self):
+        self.dispatch("POST", self.read_body())
+
+    def dispatch(self, method, body):
+        key = Fixtures.key(method, self.path, body)
+        if self.mode == "record":
+            self.record(method, body, key)
+            return
+        if self.mode == "replay":
+            fixture = self.fixtures.load(key)
+            if fixture is not None:
+                self.replay(fixture)
+                return
+        self.synthetic(method, self.path.split("?", 1)[0], body)
+
+    def synthetic(self, method, path, body):
+        raise NotImplementedError
+
+    def record(self, method, body, key):
+        headers = {k: v for k, v in self.headers.items() if k.lower() in FORWARD_HEADERS}
+        start = time.monotonic()
+        try:
+            upstream = requests.request(method, self.upstream + self.path, data=body or None,
+                                        headers=headers, stream=True, timeout=(5, 60))
+        except requests.RequestException as e:
+            self.send_json({"error": f"Recording failed: {str(e)}"}, status=502)
+            return
+
+        content_type = upstream.headers.get("Content-Type", "application/octet-stream")
+        chunks = []
+        self.start_chunked(upstream.status_code, content_type)
+        try:
+            for chunk in upstream.iter_content(chunk_size=None):
+                chunks.append([round(time.monotonic() - start, 4), base64.b64encode(chunk).decode('ascii')])
+                self.write_chunk(chunk)
+            self.end_chunked()
+        finally:
+            upstream.close()
+        self.fixtures.save(key, {
+            "request": self.path,
+            "status": upstream.status_code,
+            "content_type": content_type,
+            "chunks": chunks
+        })
+
+    def replay(self, fixture):
+        start = time.monotonic()
+        self.start_chunked(fixture["status"], fixture["content_type"])
+        for offset, data in fixture["chunks"]:
+            delay = offset - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+            self.write_chunk(base64.b64decode(data))
+        self.end_chunked()
+
+
+class FakeGemini(FakeHandler):
+    upstream = GEMINI_UPSTREAM
+    route = re.compile(r"^/v1(?:beta)?/models/(?P<model>[^:]+):(?P<method>\w+)$")
+
+    def synthetic(self, method, path, body):
+        match = self.route.match(path)
+        if method != "POST" or not match:
+            self.send_json({"error": {"code": 404, "message": f"No route for {path}"}}, status=404)
+            return
+
+        action = match.group("method")
+        if action == "countTokens":
+            self.send_json({"totalTokens": len(prompt_text(body)) // 3 + 1})
+        elif action == "embedContent":
+            text = " ".join(p.get("text", "") for p in json.loads(body).get("content", {}).get("parts", []))
+            self.send_json({"embedding": {"values": embedding(text)}})
+        elif action == "generateContent":
+            words = reply_words(prompt_text(body), self.profile.reply_tokens)
+            time.sleep(self.profile.gemini_delay() + len(words) / self.profile.tokens_per_second)
+            self.send_json(candidate("".join(words).strip()))
+        elif action == "streamGenerateContent":
+            self.stream_reply(reply_words(prompt_text(body), self.profile.reply_tokens))
+        else:
+            self.send_json({"error": {"code": 404, "message": f"Unknown method {action}"}}, status=404)
+
+    def stream_reply(self, words):
+        # The REST transport reads a JSON array whose elements arrive one at
+        # a time; each element carries a few tokens, like the real API
+        time.sleep(self.profile.gemini_delay())
+        self.start_chunked(200, "application/json")
+        per_chunk = 4
+        for i in range(0, len(words), per_chunk):
+            part = words[i:i + per_chunk]
+            time.sleep(len(part) / self.profile.tokens_per_second)
+            prefix = b"[" if i == 0 else b",\r\n"
+            self.write_chunk(prefix + json.dumps(candidate("".join(part)), ensure_ascii=False).encode('utf-8'))
+        self.write_chunk(b"]" if words else b"[]")
+        self.end_chunked()
+
+
+class FakeElevenLabs(FakeHandler):
+    upstream = ELEVENLABS_UPSTREAM
+    route = re.compile(r"^/v1/text-to-speech/(?P<voice>[^/]+)(?P<stream>/stream)?"
+                       r"(?P<timestamps>/with-timestamps)?$")
+    stream_chunk_size = 4096
+
+    def synthetic(self, method, path, body):
+        if method == "GET" and path == "/v1/models":
+            self.send_json([{"model_id": "eleven_multilingual_v2"}])
+            return
+
+        match = self.route.match(path)
+        if method != "POST" or not match:
+            self.send_json({"detail": f"No route for {path}"}, status=404)
+            return
+
+        try:
+            text = json.loads(body).get("text", "")
+        except ValueError:
+            text = ""
+        if not text:
+            self.send_json({"detail": "text is required"}, status=422)
+            return
+
+        audio = fake_audio(text, len(text) * self.profile.audio_bytes_per_char)
+        time.sleep(self.profile.tts_delay())
+        if match.group("timestamps") and not match.group("stream"):
+            time.sleep(len(audio) / self.profile.audio_bytes_per_second)
+            self.send_json({"audio_base64": base64.b64encode(audio).decode('ascii'),
+                            "alignment": alignment(text, len(audio) * 8 / MP3_BITRATE)})
+            return
+        if not match.group("stream"):
+            time.sleep(len(audio) / self.profile.audio_bytes_per_second)
+            self.send_body(200, "audio/mpeg", audio)
+            return
+
+        self.start_chunked(200, "audio/mpeg")
+        for i in range(0, len(audio), self.stream_chunk_size):
+            chunk = audio[i:i + self.stream_chunk_size]
+            time.sleep(len(chunk) / self.profile.audio_bytes_per_second)
+            self.write_chunk(chunk)
+        self.end_chunked()
+
+
+def serve(handler, host, port, profile, mode=None, fixtures_dir=None):
+    # Starts a server thread and returns the server; port 0 picks a free port
+    fixtures = Fixtures(os.path.join(fixtures_dir, handler.__name__)) if fixtures_dir else None
+    handler = type(handler.__name__, (handler,), {
+        "profile": profile, "mode": mode, "fixtures": fixtures
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=handler.__name__, daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("fake upstreams")
+    group.add_argument("--gemini-latency", type=float, nargs=2, default=(0.4, 1.2),
+                       metavar=("MEDIAN", "P95"), help="seconds to Gemini's first token")
+    group.add_argument("--tokens-per-second", type=float, default=80.0)
+    group.add_argument("--reply-tokens", type=int, default=60)
+    group.add_argument("--tts-latency", type=float, nargs=2, default=(0.3, 0.9),
+                       metavar=("MEDIAN", "P95"), help="seconds to ElevenLabs' first byte")
+    group.add_argument("--audio-bytes-per-char", type=int, default=400)
+    group.add_argument("--audio-bytes-per-second", type=int, default=64000,
+                       help="how fast ElevenLabs delivers audio")
+    group.add_argument("--seed", type=int, default=None)
+    modes = group.add_mutually_exclusive_group()
+    modes.add_argument("--record", metavar="DIR", help="proxy to the real APIs and save fixtures")
+    modes.add_argument("--replay", metavar="DIR", help="serve fixtures recorded with --record")
+
+
+def profile_from_args(args):
+    return Profile(
+        Latency(*args.gemini_latency), args.tokens_per_second, args.reply_tokens,
+        Latency(*args.tts_latency), args.audio_bytes_per_char, args.audio_bytes_per_second,
+        seed=args.seed
+    )
+
+
+def start_from_args(args, host="127.0.0.1", gemini_port=0, elevenlabs_port=0):
+    # Returns (gemini_server, elevenlabs_server)
+    profile = profile_from_args(args)
+    mode = "record" if args.record else "replay" if args.replay else None
+    fixtures_dir = args.record or args.replay
+    return (serve(FakeGemini, host, gemini_port, profile, mode, fixtures_dir),
+            serve(FakeElevenLabs, host, elevenlabs_port, profile, mode, fixtures_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--gemini-port", type=int, default=9001)
+    parser.add_argument("--elevenlabs-port", type=int, default=9002)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    gemini, elevenlabs = start_from_args(args, args.host, args.gemini_port, args.elevenlabs_port)
+    print(f"GEMINI_API_ENDPOINT=http://{args.host}:{gemini.server_port}")
+    print(f"ELEVENLABS_BASE_URL=http://{args.host}:{elevenlabs.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+"""Load driver for the app's HTTP routes.
+
+Runs a closed loop of concurrent clients against one or more scenarios and
+reports latency and time-to-first-byte percentiles, throughput and the
+server's resident memory. By default it starts the fake upstreams from
+bench/fake_upstreams.py and the app itself, pointed at them:
+
+    python -m bench.load --scenario get_response --concurrency 16 --duration 30
+    python -m bench.load --server asgi --scenario all --json results.json
+    python -m bench.load --replay fixtures/ --scenario tts
+
+--url runs against a server that is already up instead (pass --pid to also
+sample its memory). The fake upstream options (latencies, token rate, audio
+size, --record/--replay) are the same as for bench.fake_upstreams.
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+from bench import fake_upstreams
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROMPTS = (
+    "नमस्ते, आप कैसे हैं?",
+    "आज का मौसम कैसा है?",
+    "मुझे एक कहानी सुनाइए।",
+    "भारत की राजधानी क्या है?",
+    "What can you help me with?",
+    "हिंदी सीखने का सबसे अच्छा तरीका क्या है?",
+    "एक अच्छी किताब का नाम बताइए।",
+    "चाय बनाने की विधि बताइए।"
+)
+
+SENTENCES = (
+    "नमस्ते, मैं आपकी क्या मदद कर सकता हूँ?",
+    "आज मौसम बहुत सुंदर है।",
+    "यह एक अच्छा सवाल है।",
+    "चलिए साथ में बात करते हैं।"
+)
+
+
+class Scenario:
+    def __init__(self, name, method, path, body=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body  # callable(i, unique) -> (headers, bytes)
+
+    def request(self, i, unique):
+        if self.body is None:
+            return {}, None
+        return self.body(i, unique)
+
+
+def pick(texts, i, unique):
+    # unique makes every request distinct, so no cache can answer it
+    text = texts[i % len(texts)]
+    return f"{text} ({uuid.uuid4().hex[:8]})" if unique else text
+
+
+def form_body(i, unique):
+    body = urlencode({"user_input": pick(PROMPTS, i, unique)}).encode('utf-8')
+    return {"Content-Type": "application/x-www-form-urlencoded"}, body
+
+
+def json_body(i, unique):
+    body = json.dumps({"text": pick(SENTENCES, i, unique)}, ensure_ascii=False).encode('utf-8')
+    return {"Content-Type": "application/json"}, body
+
+
+SCENARIOS = {
+    "index": Scenario("index", "GET", "/"),
+    "get_response": Scenario("get_response", "POST", "/get_response", form_body),
+    "tts": Scenario("tts", "POST", "/text-to-speech", json_body),
+}
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class MemorySampler:
+    # Reads the server's resident set size from /proc every interval
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def rss(self):
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            rss = self.rss()
+            if rss is not None:
+                self.samples.append(rss)
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        if not self.samples:
+            return None
+        return {"start": self.samples[0], "peak": max(self.samples), "end": self.samples[-1]}
+
+
+class Worker(threading.Thread):
+    def __init__(self, index, target, scenario, deadline, counter, unique, timeout):
+        super().__init__(name=f"load-{index}", daemon=True)
+        self.target = target
+        self.scenario = scenario
+        self.deadline = deadline
+        self.counter = counter
+        self.unique = unique
+        self.timeout = timeout
+        self.results = []  # (latency, ttfb, status, bytes)
+        self.errors = 0
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.target.hostname, self.target.port,
+                                                         timeout=self.timeout)
+        return self.connection
+
+    def one(self, i):
+        headers, body = self.scenario.request(i, self.unique)
+        headers["Accept-Encoding"] = "gzip, br"
+        start = time.perf_counter()
+        connection = self.connect()
+        connection.request(self.scenario.method, self.scenario.path, body=body, headers=headers)
+        response = connection.getresponse()
+        first = response.read(1)
+        ttfb = time.perf_counter() - start
+        size = len(first) + len(response.read())
+        latency = time.perf_counter() - start
+        if response.will_close:
+            connection.close()
+            self.connection = None
+        return latency, ttfb, response.status, size
+
+    def run(self):
+        while time.perf_counter() < self.deadline:
+            i = self.counter()
+            if i is None:
+                break
+            try:
+                self.results.append(self.one(i))
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                if self.connection is not None:
+                    self.connection.close()
+                    self.connection = None
+        if self.connection is not None:
+            self.connection.close()
+
+
+def make_counter(limit):
+    lock = threading.Lock()
+    state = {"next": 0}
+
+    def counter():
+        with lock:
+            i = state["next"]
+            if limit is not None and i >= limit:
+                return None
+            state["next"] = i + 1
+            return i
+    return counter
+
+
+def run_scenario(url, scenario, concurrency, duration, requests_limit, unique, timeout, pid):
+    target = urlsplit(url)
+    sampler = MemorySampler(pid).start() if pid else None
+    start = time.perf_counter()
+    deadline = start + duration if duration else float("inf")
+    counter = make_counter(requests_limit)
+    workers = [Worker(i, target, scenario, deadline, counter, unique, timeout) for i in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    memory = sampler.stop() if sampler else None
+
+    results = [r for w in workers for r in w.results]
+    latencies = sorted(r[0] for r in results)
+    ttfbs = sorted(r[1] for r in results)
+    statuses = {}
+    for r in results:
+        statuses[str(r[2])] = statuses.get(str(r[2]), 0) + 1
+    return {
+        "scenario": scenario.name,
+        "requests": len(results),
+        "errors": sum(w.errors for w in workers) + sum(1 for r in results if r[2] >= 400),
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(results) / elapsed, 2) if elapsed else 0,
+        "bytes": sum(r[3] for r in results),
+        "latency": {f"p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+        "ttfb": {f"p{p}": percentile(ttfbs, p) for p in (50, 95, 99)},
+        "rss": memory
+    }
+
+
+def format_ms(value):
+    return "-" if value is None else f"{value * 1000:.1f}"
+
+
+def format_mb(value):
+    return "-" if value is None else f"{value / (1024 * 1024):.1f}"
+
+
+def print_report(report):
+    print(f"{'scenario':<14}{'reqs':>7}{'err':>6}{'req/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'ttfb50':>9}{'ttfb95':>9}{'ttfb99':>9}{'rss MB':>9}{'peak MB':>9}")
+    for r in report:
+        rss = r["rss"] or {}
+        print(f"{r['scenario']:<14}{r['requests']:>7}{r['errors']:>6}{r['throughput']:>9.1f}"
+              f"{format_ms(r['latency']['p50']):>9}{format_ms(r['latency']['p95']):>9}"
+              f"{format_ms(r['latency']['p99']):>9}{format_ms(r['ttfb']['p50']):>9}"
+              f"{format_ms(r['ttfb']['p95']):>9}{format_ms(r['ttfb']['p99']):>9}"
+              f"{format_mb(rss.get('end')):>9}{format_mb(rss.get('peak')):>9}")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, process, timeout=30):
+    target = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection(target.hostname, target.port, timeout=2)
+            connection.request("GET", "/readyz")
+            if connection.getresponse().status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} didn't become ready in {timeout}s")
+
+
+def start_server(kind, port, env):
+    if kind == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1",
+                   "--port", str(port), "--log-level", "warning"]
+    else:
+        # flask run without the reloader, so the pid is the process serving
+        command = [sys.executable, "-m", "flask", "--app", "app", "run",
+                   "--host", "127.0.0.1", "--port", str(port), "--no-reload"]
+    return subprocess.Popen(command, cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenario", default="all", choices=sorted(SCENARIOS) + ["all"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per scenario")
+    parser.add_argument("--requests", type=int, default=None,
+                        help="stop each scenario after this many requests")
+    parser.add_argument("--unique", action="store_true",
+                        help="make every request distinct so caches always miss")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--server", default="flask", choices=("flask", "asgi"))
+    parser.add_argument("--url", help="load an already running server instead")
+    parser.add_argument("--pid", type=int, help="server process to sample memory of, with --url")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    fake_upstreams.add_arguments(parser)
+    args = parser.parse_args()
+
+    names = sorted(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    process = None
+    cache_dir = None
+    url, pid = args.url, args.pid
+    if url is None:
+        # Fresh TTS, lip-sync and audio bank caches, so a run doesn't start
+        # warm from the last one
+        cache_dir = tempfile.mkdtemp(prefix="bench-tts-")
+        gemini, elevenlabs = fake_upstreams.start_from_args(args)
+        env = dict(os.environ,
+                   GEMINI_API_ENDPOINT=f"http://127.0.0.1:{gemini.server_port}",
+                   ELEVENLABS_BASE_URL=f"http://127.0.0.1:{elevenlabs.server_port}",
+                   TTS_CACHE_DIR=os.path.join(cache_dir, "tts"),
+                   LIPSYNC_CACHE_DIR=os.path.join(cache_dir, "lipsync"),
+                   AUDIO_BANK_DIR=os.path.join(cache_dir, "audio_bank"),
+                   # Every simulated user comes from the same address
+                   RATE_LIMIT_CHAT_PER_MIN="0", RATE_LIMIT_TTS_PER_MIN="0")
+        if not args.record:
+            # The stand-ins accept any key; recording needs the real ones
+            env.update(GOOGLE_API_KEY="bench", ELEVEN_LABS_API_KEY="bench")
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        process = start_server(args.server, port, env)
+        pid = process.pid
+
+    try:
+        if process is not None:
+            wait_until_up(url, process)
+        report = []
+        for name in names:
+            result = run_scenario(url, SCENARIOS[name], args.concurrency, args.duration,
+                                  args.requests, args.unique, args.timeout, pid)
+            report.append(result)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if cache_dir is not None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding='utf-8') as f:
+            json.dump({"url": url, "server": args.server if args.url is None else None,
+                       "concurrency": args.concurrency, "results": report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
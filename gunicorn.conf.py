@@ -0,0 +1,90 @@
+"""Production server settings for gunicorn.
+
+    gunicorn -c gunicorn.conf.py                  # app:app on threaded workers
+    SERVER=asgi gunicorn -c gunicorn.conf.py      # asgi:app on uvicorn workers
+
+python app.py is Werkzeug's development server: one process, no graceful
+restarts. Use this instead; it needs pip install gunicorn, and for
+SERVER=asgi also uvicorn (uvicorn-worker if installed, for newer uvicorns).
+
+The app is imported once in the master (preload_app) and workers are forked
+from it, so they start fast, share the imported code's memory and a broken
+import fails before any worker starts. Nothing may connect to an upstream
+before the fork, so the warm-up runs in each worker after it (post_fork for
+the Flask app, the lifespan handler for asgi). The audio bank is built by
+whichever worker takes its build lock first; the others load its manifest.
+
+Caches are shared between the workers through SHARED_CACHE_URL, which
+defaults here to a SQLite file (see shared_cache). Everything else is per
+worker: conversation memory, rate limit buckets and the upstream in-flight
+caps, so ELEVENLABS_MAX_IN_FLIGHT and GEMINI_MAX_IN_FLIGHT are per worker.
+
+kill -HUP <master> reloads this file and replaces the workers gracefully,
+letting in-flight replies finish for up to GRACEFUL_TIMEOUT. Being
+preloaded, the app's code is not reloaded by HUP: deploy new code with
+USR2 (a new master next to the old one) and then QUIT the old master.
+
+Environment:
+    SERVER            wsgi (default) or asgi
+    PORT              port to listen on, default 5000 (or BIND=host:port)
+    WEB_CONCURRENCY   worker processes, default one per CPU this process may use
+    THREADS           threads per Flask worker, default 32; a streamed reply
+                      holds one for its whole length
+    GRACEFUL_TIMEOUT  seconds given to in-flight requests on reload/stop, default 30
+    MAX_REQUESTS      restart a worker after this many requests, default 0 (never)
+"""
+import importlib.util
+import os
+
+SERVER = os.getenv("SERVER", "wsgi")
+if SERVER not in ("wsgi", "asgi"):
+    raise ValueError(f"SERVER must be wsgi or asgi, not {SERVER!r}")
+
+
+def cpu_count():
+    # CPUs this process may run on, which in a container can be fewer
+    # than the machine has
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+wsgi_app = "asgi:app" if SERVER == "asgi" else "app:app"
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', 5000)}")
+workers = int(os.getenv("WEB_CONCURRENCY", 0)) or cpu_count()
+if SERVER == "asgi":
+    if importlib.util.find_spec("uvicorn_worker"):
+        worker_class = "uvicorn_worker.UvicornWorker"
+    else:
+        worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    worker_class = "gthread"
+    threads = int(os.getenv("THREADS", 32))
+
+preload_app = True
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+# Seconds a worker may go without checking in before it is restarted
+timeout = int(os.getenv("WORKER_TIMEOUT", 30))
+keepalive = 5
+max_requests = int(os.getenv("MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+if os.path.isdir("/dev/shm"):
+    # The workers' heartbeat files, kept off a possibly slow disk
+    worker_tmp_dir = "/dev/shm"
+
+# Requests are logged by the app itself
+accesslog = None
+errorlog = "-"
+
+os.environ.setdefault("SHARED_CACHE_URL", "sqlite:///" + os.path.join(".cache", "shared.db"))
+
+# The warm-up opens upstream connections, which must not be made in the
+# master and inherited by every worker
+warm_up = os.getenv("WARM_UP_ON_START", "1") == "1"
+os.environ["WARM_UP_ON_START"] = "0"
+
+
+def post_fork(server, worker):
+    if warm_up and SERVER == "wsgi":
+        import app
+        app.start_warm_up()
@@ -0,0 +1,106 @@
+"""Lip-sync timelines for synthesized speech.
+
+A timeline is one keyframe per FRAME_MS of audio: how far the mouth is open
+(0-255) and which viseme it is shaping. It is built from ElevenLabs'
+per-character alignment (the /with-timestamps endpoints) when we have it,
+otherwise estimated by spreading the text evenly over the clip. The browser
+only interpolates between keyframes while the audio plays.
+
+Serialized form, small enough for a JSON field or a response header:
+
+    {"frame_ms": 40, "visemes": "XXAACEO...", "amplitude": "<base64 uint8>"}
+
+Visemes: X rest, A open, E spread, O rounded, M lips closed, F lip to
+teeth, C other consonants.
+"""
+import base64
+import math
+
+try:
+    import numpy as np
+except ImportError:  # without NumPy no timelines are built
+    np = None
+
+FRAME_MS = 40
+
+VISEMES = "XAEOMFC"
+# How far the jaw opens for each viseme, in VISEMES order
+OPENNESS = (0.0, 1.0, 0.6, 0.75, 0.0, 0.15, 0.35)
+# Spreads each keyframe into its neighbours so the jaw doesn't snap
+SMOOTHING = (0.25, 0.5, 0.25)
+
+VOWEL_SIGNS = {
+    # Independent Devanagari vowels
+    "अ": "A", "आ": "A", "इ": "E", "ई": "E", "ए": "E", "ऐ": "E", "ऋ": "E",
+    "उ": "O", "ऊ": "O", "ओ": "O", "औ": "O",
+    # Dependent vowel signs (matras)
+    "ा": "A", "ि": "E", "ी": "E", "े": "E", "ै": "E", "ृ": "E",
+    "ु": "O", "ू": "O", "ो": "O", "ौ": "O",
+    # Latin
+    "a": "A", "e": "E", "i": "E", "y": "E", "o": "O", "u": "O", "w": "O"
+}
+CLOSED = set("पफबभमpbm")
+LABIODENTAL = set("वfv")
+
+
+def viseme(ch):
+    ch = ch.lower()
+    if ch in VOWEL_SIGNS:
+        return VOWEL_SIGNS[ch]
+    if ch in CLOSED:
+        return "M"
+    if ch in LABIODENTAL:
+        return "F"
+    if ch.isalnum() or "ऀ" <= ch <= "ॿ":
+        # Devanagari consonants carry an inherent vowel; signs like virama
+        # and anusvara barely move the mouth either way
+        return "C"
+    return "X"
+
+
+def build(characters, starts, ends, duration=None, frame_ms=FRAME_MS):
+    # characters with their start/end times in seconds -> timeline dict
+    if np is None or not characters:
+        return None
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    codes = np.array([VISEMES.index(viseme(ch)) for ch in characters], dtype=np.uint8)
+
+    duration = duration or float(ends[-1])
+    frames = max(1, math.ceil(duration * 1000 / frame_ms))
+    centers = (np.arange(frames) + 0.5) * (frame_ms / 1000)
+
+    # The character being spoken at the middle of each frame, if any
+    index = np.clip(np.searchsorted(starts, centers, side='right') - 1, 0, len(codes) - 1)
+    speaking = (centers >= starts[index]) & (centers < ends[index])
+    frame_codes = np.where(speaking, codes[index], 0).astype(np.uint8)
+
+    amplitude = np.asarray(OPENNESS)[frame_codes]
+    amplitude = np.convolve(amplitude, SMOOTHING, mode='same')
+    amplitude = np.round(np.clip(amplitude, 0, 1) * 255).astype(np.uint8)
+
+    letters = np.frombuffer(VISEMES.encode('ascii'), dtype=np.uint8)[frame_codes]
+    return {
+        "frame_ms": frame_ms,
+        "visemes": letters.tobytes().decode('ascii'),
+        "amplitude": base64.b64encode(amplitude.tobytes()).decode('ascii')
+    }
+
+
+def from_alignment(alignment, duration=None, frame_ms=FRAME_MS):
+    # alignment as ElevenLabs returns it with /with-timestamps
+    if not alignment:
+        return None
+    return build(alignment.get("characters") or [],
+                 alignment.get("character_start_times_seconds") or [],
+                 alignment.get("character_end_times_seconds") or [],
+                 duration, frame_ms)
+
+
+def estimate(text, duration, frame_ms=FRAME_MS):
+    # No alignment: every character gets the same share of the clip
+    if np is None or not text or duration <= 0:
+        return None
+    step = duration / len(text)
+    starts = np.arange(len(text)) * step
+    return build(list(text), starts, starts + step, duration, frame_ms)
@@ -0,0 +1,262 @@
+"""Prometheus metrics and Server-Timing headers.
+
+Counters, gauges and histograms live in process and are rendered in the
+Prometheus text format for /metrics, so no client library is needed. Each
+process reports its own numbers; scrape every worker to get the total.
+
+A stage() block observes a histogram and adds an entry to the current
+request's ServerTiming, which the app sends back as a Server-Timing
+header, so devtools show where a request spent its time. The current
+ServerTiming is a context variable: it follows a request through its
+thread (Flask) or task (ASGI), but not into executor threads.
+"""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a cache hit to a slow multi-sentence Gemini reply
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Bytes, from a short form post to a long TTS clip
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> value
+
+    def key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self.samples(key, value))
+        return lines
+
+    def samples(self, key, value):
+        return [f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    @contextmanager
+    def track(self, **labels):
+        # Counts the block as in progress while it runs
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # Per-bucket counts (not cumulative), then sum
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+
+    def samples(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = format_labels(self.label_names, key, [("le", format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collect):
+        # collect() is called at scrape time and returns more metrics to render
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        metrics = list(self.metrics)
+        for collect in self.collectors:
+            metrics.extend(collect())
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "Requests being served, including open streams")
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to serve a request, to the end of its body",
+    labels=("route", "method", "status"))
+HTTP_REQUEST_BYTES = REGISTRY.histogram(
+    "http_request_size_bytes", "Size of request bodies", labels=("route",), buckets=SIZE_BUCKETS)
+
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "llm_time_to_first_token_seconds", "Time from calling Gemini to its first streamed text")
+LLM_SECONDS = REGISTRY.histogram(
+    "llm_duration_seconds", "Time for a complete Gemini reply", labels=("mode",))
+TTS_FIRST_BYTE_SECONDS = REGISTRY.histogram(
+    "tts_time_to_first_byte_seconds", "Time from calling ElevenLabs to a streamed response")
+TTS_SECONDS = REGISTRY.histogram(
+    "tts_duration_seconds", "Time for a complete ElevenLabs clip", labels=("mode",))
+TTS_BYTES = REGISTRY.histogram(
+    "tts_audio_bytes", "Size of ElevenLabs clips", buckets=SIZE_BUCKETS)
+ENCODE_SECONDS = REGISTRY.histogram(
+    "audio_encode_seconds", "Time spent base64-encoding audio for JSON responses",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    "upstream_requests_in_flight", "Calls to an upstream API in progress", labels=("upstream",))
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "upstream_errors_total", "Failed upstream calls, by HTTP status or exception type",
+    labels=("upstream", "kind"))
+
+
+def stats_metrics(prefix, stats, totals=()):
+    # Turns a stats() dict such as tts_cache.stats() into metrics, for
+    # Registry.add_collector. The names in totals count up for the life of
+    # the process and become counters named <prefix>_<name>_total; the rest
+    # are snapshots and become gauges.
+    metrics = []
+    for name, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            words = f"{prefix} {name.replace('_', ' ')}"
+            if name in totals:
+                metric = Counter(f"{prefix}_{name}_total", f"{words}, since the process started")
+                metric.inc(value)
+            else:
+                metric = Gauge(f"{prefix}_{name}", words)
+                metric.set(value)
+            metrics.append(metric)
+    return metrics
+
+
+def error_kind(e):
+    status = getattr(e, "status_code", None)
+    return str(status) if status else type(e).__name__
+
+
+class ServerTiming:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []  # (name, milliseconds)
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.entries.append((name, seconds * 1000))
+
+    def header(self):
+        with self.lock:
+            return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.entries)
+
+
+current_timing = contextvars.ContextVar("server_timing", default=None)
+
+
+def record_timing(name, seconds):
+    timing = current_timing.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+@contextmanager
+def stage(name, histogram=None, **labels):
+    # Times the block into histogram and the request's Server-Timing
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
+        record_timing(name, elapsed)
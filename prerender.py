@@ -0,0 +1,300 @@
+"""Pre-render replies and speech into the server's caches.
+
+    python -m prerender questions.csv
+    python -m prerender questions.jsonl --format mp3_44100_128 --format mp3_22050_32
+    python -m prerender announcements.txt --texts --tts-rate 120
+
+Each input is either a prompt, answered the way /get_response answers a
+first turn (build_prompt, Gemini, the response cache), or a fixed text.
+The reply or text is then synthesized the way /text-to-speech would, both
+whole and sentence by sentence as /converse and /ws/session speak it, with
+lip-sync timelines. Anything already cached is skipped.
+
+Inputs come from a CSV with a "prompt" and/or "text" column (otherwise its
+first column), from JSONL of {"prompt": ...} / {"text": ...} objects or bare
+strings, or from a text file with one input per line. Bare inputs are
+prompts, or fixed texts with --texts.
+
+Work runs on --workers threads, with Gemini and ElevenLabs calls held to
+--llm-rate and --tts-rate a minute. Every finished input is appended to a
+checkpoint file (default <input>.prerender.jsonl, with the reply and any
+error), so an interrupted run picks up where it stopped; inputs that
+failed are tried again.
+
+Run it with the server's environment so the same caches are written.
+Replies only reach a server through the shared cache (SHARED_CACHE_URL),
+so prompts need it. Clips go to the TTS cache directory, where a running
+server picks them up on first use, and to the shared cache if there is one.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from admission import RateLimiter
+from speech_pipeline import SentenceSplitter
+
+AUDIO_MODES = ("both", "whole", "sentences", "none")
+
+
+def read_inputs(path, texts=False):
+    # -> [(kind, text)] with kind "prompt" or "text", duplicates dropped
+    default = "text" if texts else "prompt"
+    items = []
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, encoding="utf-8", newline="") as f:
+        if extension == ".csv":
+            reader = csv.reader(f)
+            header = next(reader, [])
+            columns = [name.strip().lower() for name in header]
+            if "prompt" in columns or "text" in columns:
+                for row in reader:
+                    fields = dict(zip(columns, row))
+                    for kind in ("prompt", "text"):
+                        if fields.get(kind, "").strip():
+                            items.append((kind, fields[kind]))
+                            break
+            else:
+                # No known column: the first one, and the "header" was data
+                for row in [header, *reader]:
+                    if row:
+                        items.append((default, row[0]))
+        elif extension in (".jsonl", ".ndjson"):
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"{path}:{number}: {e}")
+                if isinstance(entry, str):
+                    items.append((default, entry))
+                elif isinstance(entry, dict) and isinstance(entry.get("prompt"), str):
+                    items.append(("prompt", entry["prompt"]))
+                elif isinstance(entry, dict) and isinstance(entry.get("text"), str):
+                    items.append(("text", entry["text"]))
+                else:
+                    raise ValueError(f"{path}:{number}: expected a string or a prompt/text object")
+        else:
+            items = [(default, line) for line in f]
+
+    seen = set()
+    unique = []
+    for kind, text in items:
+        text = text.strip()
+        if text and (kind, text) not in seen:
+            seen.add((kind, text))
+            unique.append((kind, text))
+    return unique
+
+
+def item_id(kind, text, formats, audio):
+    # The same input rendered with other settings is other work
+    payload = json.dumps([kind, text, sorted(formats), audio], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class Checkpoint:
+    """Append-only JSONL of finished inputs, one line each."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line of a run that was killed mid-write
+                        continue
+                    if entry.get("error") is None:
+                        self.done.add(entry["id"])
+                    else:
+                        self.done.discard(entry["id"])
+        except FileNotFoundError:
+            pass
+        self.file = open(path, "a", encoding="utf-8")
+
+    def record(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            if entry.get("error") is None:
+                self.done.add(entry["id"])
+
+    def close(self):
+        self.file.close()
+
+
+class Throttle:
+    # Blocks until the limiter lets one more call through
+    def __init__(self, per_minute, burst):
+        self.limiter = RateLimiter(per_minute / 60, burst)
+
+    def wait(self):
+        while True:
+            delay = self.limiter.take("prerender")
+            if not delay:
+                return
+            time.sleep(delay)
+
+
+class Prerenderer:
+    def __init__(self, app, options, audio, llm_throttle, tts_throttle, force=False):
+        self.app = app
+        self.options = options
+        self.audio = audio
+        self.llm_throttle = llm_throttle
+        self.tts_throttle = tts_throttle
+        self.force = force
+        self.lock = threading.Lock()
+        self.counts = {"replies_generated": 0, "replies_cached": 0,
+                       "clips_synthesized": 0, "clips_cached": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def reply(self, prompt):
+        # As get_response() answers a first turn
+        app = self.app
+        if not self.force:
+            cached = app.response_cache.get(prompt)
+            if cached is not None:
+                self.count("replies_cached")
+                return cached
+        self.llm_throttle.wait()
+        reply = app.generate_reply(prompt)
+        if not reply:
+            raise ValueError("Gemini returned an empty reply")
+        app.response_cache.put(prompt, reply)
+        self.count("replies_generated")
+        return reply
+
+    def spoken_texts(self, text):
+        # The whole text for /text-to-speech, its sentences for /converse
+        texts = []
+        if self.audio in ("both", "whole"):
+            texts.append(text)
+        if self.audio in ("both", "sentences"):
+            splitter = SentenceSplitter()
+            texts += splitter.feed(text) + splitter.flush()
+        return list(dict.fromkeys(texts))
+
+    def speak(self, text):
+        app = self.app
+        for options in self.options:
+            key = app.speech_cache_key(text, options)
+            if not self.force and app.cached_speech(key) is not None:
+                self.count("clips_cached")
+                continue
+            self.tts_throttle.wait()
+            app.fetch_speech(text, key, options)
+            self.count("clips_synthesized")
+
+    def render(self, kind, text):
+        # -> the reply for a prompt, the text itself otherwise
+        spoken = self.reply(text) if kind == "prompt" else text
+        for piece in self.spoken_texts(spoken):
+            self.speak(piece)
+        return spoken
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("input", help="CSV, JSONL or text file of prompts or texts")
+    parser.add_argument("--texts", action="store_true",
+                        help="inputs without a prompt/text field are fixed texts, not prompts")
+    parser.add_argument("--format", action="append", dest="formats",
+                        help="output format to synthesize, repeatable (default TTS_OUTPUT_FORMAT)")
+    parser.add_argument("--audio", choices=AUDIO_MODES, default="both",
+                        help="whole replies, their sentences, both (default) or no audio")
+    parser.add_argument("--workers", type=int, default=4, help="inputs rendered at a time")
+    parser.add_argument("--llm-rate", type=float, default=30, help="Gemini calls a minute")
+    parser.add_argument("--tts-rate", type=float, default=60, help="ElevenLabs calls a minute")
+    parser.add_argument("--ttl", type=int, help="seconds the replies stay cached (default RESPONSE_CACHE_TTL)")
+    parser.add_argument("--checkpoint", help="progress file (default <input>.prerender.jsonl)")
+    parser.add_argument("--force", action="store_true", help="render again what is already cached")
+    args = parser.parse_args()
+
+    if args.workers < 1 or args.llm_rate <= 0 or args.tts_rate <= 0:
+        parser.error("--workers, --llm-rate and --tts-rate must be positive")
+    try:
+        items = read_inputs(args.input, args.texts)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    # Only the caches and upstream clients are wanted from the app
+    os.environ.setdefault("WARM_UP_ON_START", "0")
+    import app
+
+    try:
+        options = [app.speech_options({"format": name}) for name in args.formats or [None]]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.audio != "none" and not app.ELEVEN_LABS_API_KEY:
+        parser.error("ELEVEN_LABS_API_KEY is not set (or pass --audio none)")
+    if any(kind == "prompt" for kind, _ in items) and app.shared_backend is None:
+        parser.error("replies only reach the server through SHARED_CACHE_URL; "
+                     "set it to the server's, or pass --texts")
+    if args.ttl:
+        app.response_cache.ttl = args.ttl
+
+    formats = [option.format.name for option in options]
+    checkpoint = Checkpoint(args.checkpoint or f"{args.input}.prerender.jsonl")
+    todo = [(item_id(kind, text, formats, args.audio), kind, text) for kind, text in items]
+    todo = [item for item in todo if args.force or item[0] not in checkpoint.done]
+    print(f"{len(items)} inputs, {len(items) - len(todo)} already done, {len(todo)} to render")
+
+    renderer = Prerenderer(app, options, args.audio,
+                           Throttle(args.llm_rate, args.workers), Throttle(args.tts_rate, args.workers),
+                           args.force)
+
+    def render(ident, kind, text):
+        start = time.perf_counter()
+        entry = {"id": ident, "kind": kind, "input": text, "reply": None, "error": None}
+        try:
+            reply = renderer.render(kind, text)
+            if kind == "prompt":
+                entry["reply"] = reply
+        except Exception as e:
+            entry["error"] = str(e) or type(e).__name__
+        entry["seconds"] = round(time.perf_counter() - start, 2)
+        checkpoint.record(entry)
+        return entry
+
+    errors = 0
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="prerender")
+    try:
+        futures = [executor.submit(render, *item) for item in todo]
+        for finished, future in enumerate(as_completed(futures), 1):
+            entry = future.result()
+            if entry["error"] is not None:
+                errors += 1
+                print(f"  error: {entry['input'][:60]}: {entry['error']}", file=sys.stderr)
+            if finished % 10 == 0 or finished == len(futures):
+                print(f"  {finished}/{len(futures)} rendered, {errors} errors")
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume", file=sys.stderr)
+        executor.shutdown(wait=False, cancel_futures=True)
+        checkpoint.close()
+        sys.exit(130)
+    executor.shutdown()
+    checkpoint.close()
+
+    print(", ".join(f"{count} {name.replace('_', ' ')}" for name, count in renderer.counts.items()))
+    if errors:
+        print(f"{errors} inputs failed; run again to retry them", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
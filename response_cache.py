@@ -0,0 +1,213 @@
+"""Cache of Gemini replies in front of /get_response.
+
+Tier 1 is an exact match on the normalized user input with a TTL. Tier 2 is
+an optional semantic match: inputs are embedded and kept in an in-process
+matrix, and a lookup takes the most similar earlier input when its cosine
+similarity clears a threshold. Both tiers are bounded and count hits/misses.
+
+With a shared backend (see shared_cache) the exact tier is also kept there,
+so a reply one worker process got from Gemini is a hit in the others. The
+semantic index stays per process.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # without NumPy only the exact tier is available
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_input(text):
+    # NFC, casefold (Latin; Devanagari has no case but is left intact),
+    # punctuation including danda dropped, whitespace collapsed
+    text = unicodedata.normalize('NFC', text).casefold()
+    text = ''.join(' ' if unicodedata.category(ch).startswith('P') else ch for ch in text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def shared_key(normalized):
+    return "response:" + hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class SemanticIndex:
+    def __init__(self, embed, threshold, max_entries=1000, embedding_cache_size=256):
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.matrix = None                # (max_entries, dim) float32, unit rows
+        self.expires = np.zeros(max_entries)
+        self.responses = [None] * max_entries
+        self.count = 0
+        self.next_slot = 0
+
+        # The embedding from a miss is reused by the put that follows it
+        self.embeddings = OrderedDict()
+        self.embedding_cache_size = embedding_cache_size
+
+    def embedding(self, normalized, lock):
+        # The embed call itself runs without holding the cache lock
+        with lock:
+            vector = self.embeddings.get(normalized)
+            if vector is not None:
+                self.embeddings.move_to_end(normalized)
+                return vector
+
+        vector = np.asarray(self.embed(normalized), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+
+        with lock:
+            self.embeddings[normalized] = vector
+            if len(self.embeddings) > self.embedding_cache_size:
+                self.embeddings.popitem(last=False)
+        return vector
+
+    def search(self, vector, now):
+        # Caller holds the lock
+        if not self.count:
+            return None
+        scores = self.matrix[:self.count] @ vector
+        scores[self.expires[:self.count] < now] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return self.responses[best]
+        return None
+
+    def add(self, vector, response, expires):
+        # Caller holds the lock
+        if self.matrix is None:
+            self.matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+        # Oldest slot is overwritten once the matrix is full
+        slot = self.next_slot
+        self.matrix[slot] = vector
+        self.expires[slot] = expires
+        self.responses[slot] = response
+        self.next_slot = (slot + 1) % self.max_entries
+        self.count = min(self.count + 1, self.max_entries)
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1000, ttl=3600, embed=None,
+                 semantic_threshold=None, semantic_max_entries=1000, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # normalized input -> (expires, response)
+
+        self.semantic = None
+        if embed is not None and semantic_threshold is not None:
+            if np is None:
+                logger.warning("NumPy is not installed, semantic response cache disabled")
+            else:
+                self.semantic = SemanticIndex(embed, semantic_threshold, semantic_max_entries)
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_input):
+        normalized = normalize_input(user_input)
+        if not normalized:
+            return None
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(normalized)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(normalized)
+                    self.exact_hits += 1
+                    return entry[1]
+                del self.entries[normalized]
+
+        response = self._get_shared(normalized, now)
+        if response is not None:
+            return response
+
+        if self.semantic is not None:
+            try:
+                vector = self.semantic.embedding(normalized, self.lock)
+                with self.lock:
+                    response = self.semantic.search(vector, now)
+            except Exception as e:
+                logger.warning("Semantic cache lookup failed: %s", e)
+                response = None
+            if response is not None:
+                with self.lock:
+                    self.semantic_hits += 1
+                return response
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, user_input, response):
+        normalized = normalize_input(user_input)
+        if not normalized or not response:
+            return
+        expires = time.time() + self.ttl
+
+        self._remember(normalized, expires, response)
+        if self.shared is not None:
+            self.shared.set(shared_key(normalized),
+                            json.dumps([expires, response], ensure_ascii=False).encode('utf-8'),
+                            ttl=self.ttl)
+
+        if self.semantic is not None:
+            try:
+                vector = self.semantic.embedding(normalized, self.lock)
+                with self.lock:
+                    self.semantic.add(vector, response, expires)
+            except Exception as e:
+                logger.warning("Semantic cache insert failed: %s", e)
+
+    def _remember(self, normalized, expires, response):
+        with self.lock:
+            self.entries.pop(normalized, None)
+            self.entries[normalized] = (expires, response)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def _get_shared(self, normalized, now):
+        # An entry another process stored keeps the expiry it was given there
+        if self.shared is None:
+            return None
+        value = self.shared.get(shared_key(normalized))
+        if value is None:
+            return None
+        try:
+            expires, response = json.loads(value)
+        except ValueError:
+            return None
+        if expires <= now:
+            return None
+        self._remember(normalized, expires, response)
+        with self.lock:
+            self.shared_hits += 1
+        return response
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "semantic_entries": self.semantic.count if self.semantic else 0,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,180 @@
+"""Per-session conversation memory.
+
+Each session keeps a ring buffer of its most recent turns. Turns that fall
+out of the ring are folded into a short rolling summary in the background,
+so a prompt is the summary plus as many recent turns as fit a fixed token
+budget, however long the conversation runs. Idle sessions are evicted when
+the store exceeds its session count or memory caps.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Longest summary kept when the summarizer is unavailable
+FALLBACK_SUMMARY_CHARS = 600
+
+
+def estimate_tokens(text):
+    # Gemini averages roughly 3 characters per token over mixed
+    # Hindi/English text; this errs on the side of overestimating
+    return len(text) // 3 + 1
+
+
+def turn_text(user, reply):
+    return f"User: {user}\nAssistant: {reply}"
+
+
+class Session:
+    def __init__(self, session_id, max_turns):
+        self.id = session_id
+        self.turns = deque(maxlen=max_turns)
+        self.unsummarized = []  # turns pushed out of the ring, not yet summarized
+        self.summary = ""
+        self.summarizing = False
+        self.last_seen = time.time()
+        self.size = 0
+
+    def recompute_size(self):
+        texts = [self.summary] + [u + r for u, r in self.turns] + [u + r for u, r in self.unsummarized]
+        self.size = sum(len(t.encode('utf-8')) for t in texts)
+
+
+class SessionStore:
+    def __init__(self, summarize=None, max_turns=6, max_sessions=10000,
+                 max_total_bytes=64 * 1024 * 1024, max_session_bytes=32 * 1024,
+                 idle_ttl=1800):
+        self.summarize = summarize
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.max_total_bytes = max_total_bytes
+        self.max_session_bytes = max_session_bytes
+        self.idle_ttl = idle_ttl
+
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # least recently seen first
+        self.total_bytes = 0
+        self.evictions = 0
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summarize")
+
+    def _get(self, session_id):
+        # Caller holds the lock
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = Session(session_id, self.max_turns)
+            self.sessions[session_id] = session
+        else:
+            self.sessions.move_to_end(session_id)
+        session.last_seen = time.time()
+        return session
+
+    def history(self, session_id, token_budget):
+        # Conversation so far as prompt text, newest turns kept first when
+        # everything doesn't fit the budget
+        with self.lock:
+            session = self._get(session_id)
+            summary = session.summary
+            turns = list(session.unsummarized) + list(session.turns)
+            # A first read creates the session, so reads alone can fill the store
+            self._evict()
+
+        lines = []
+        used = 0
+        if summary:
+            summary_text = f"Summary of the earlier conversation: {summary}"
+            # The summary may use at most half the budget
+            if estimate_tokens(summary_text) > token_budget // 2:
+                summary_text = summary_text[:(token_budget // 2) * 3]
+            used += estimate_tokens(summary_text)
+        for user, reply in reversed(turns):
+            text = turn_text(user, reply)
+            cost = estimate_tokens(text)
+            if used + cost > token_budget:
+                break
+            lines.append(text)
+            used += cost
+        lines.reverse()
+        if summary:
+            lines.insert(0, summary_text)
+        return "\n".join(lines)
+
+    def add_turn(self, session_id, user, reply):
+        with self.lock:
+            session = self._get(session_id)
+            if len(session.turns) == session.turns.maxlen:
+                session.unsummarized.append(session.turns[0])
+            session.turns.append((user, reply))
+
+            # A session over its own cap folds its oldest turns early
+            self._resize(session)
+            while session.size > self.max_session_bytes and len(session.turns) > 1:
+                session.unsummarized.append(session.turns.popleft())
+                self._resize(session)
+
+            start_summary = bool(session.unsummarized) and not session.summarizing
+            if start_summary:
+                session.summarizing = True
+            self._evict()
+
+        if start_summary:
+            self.executor.submit(self._summarize, session)
+
+    def _summarize(self, session):
+        while True:
+            with self.lock:
+                turns = session.unsummarized
+                session.unsummarized = []
+                summary = session.summary
+                if not turns:
+                    session.summarizing = False
+                    return
+
+            text = "\n".join(turn_text(u, r) for u, r in turns)
+            try:
+                new_summary = self.summarize(summary, text) if self.summarize else None
+            except Exception as e:
+                logger.warning("Conversation summary failed: %s", e)
+                new_summary = None
+            if not new_summary:
+                # Keep the most recent part of what we know
+                new_summary = (summary + "\n" + text).strip()[-FALLBACK_SUMMARY_CHARS:]
+
+            with self.lock:
+                session.summary = new_summary.strip()
+                # The session may have been evicted meanwhile, and another
+                # one created under its id
+                if self.sessions.get(session.id) is session:
+                    self._resize(session)
+
+    def _resize(self, session):
+        # Caller holds the lock
+        self.total_bytes -= session.size
+        session.recompute_size()
+        self.total_bytes += session.size
+
+    def _evict(self):
+        # Caller holds the lock. Drops sessions idle past the TTL, then the
+        # least recently seen ones until the store is within its caps.
+        now = time.time()
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            over_cap = (len(self.sessions) > self.max_sessions or
+                        self.total_bytes > self.max_total_bytes)
+            if not over_cap and now - session.last_seen < self.idle_ttl:
+                break
+            if len(self.sessions) == 1 and not now - session.last_seen >= self.idle_ttl:
+                break
+            del self.sessions[session_id]
+            self.total_bytes -= session.size
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "bytes": self.total_bytes,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,291 @@
+"""Cache storage shared by every worker process on a host.
+
+The TTS, lip-sync and response caches keep their hot entries in process
+memory. Under a multi-worker server (see gunicorn.conf.py) that memory is
+per worker, so each worker would synthesize and ask Gemini for what its
+siblings already have. Given a backend, those caches look entries up here
+after their own memory and store what they fetch, so a clip or reply
+produced by one worker is a hit for all of them.
+
+SHARED_CACHE_URL picks the backend:
+
+    sqlite:///.cache/shared.db    one SQLite file in WAL mode (relative path;
+                                  sqlite:////var/cache/app.db is absolute)
+    redis://[:password@]host:6379/0
+                                  any server speaking the Redis protocol;
+                                  bench/fake_redis.py is a local stand-in
+
+A backend is a plain bytes store: get(key) returns the value or None and
+set(key, value, ttl=None) stores it. Failures are logged and count as a
+miss, so a backend that is down slows the app instead of breaking it.
+
+The SQLite file is kept under max_bytes by dropping the least recently read
+entries. A Redis server evicts by its own maxmemory policy; give it one,
+e.g. allkeys-lru, since TTS entries are stored without a TTL.
+"""
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Reading an entry refreshes its last-used time at most this often, so hot
+# keys don't turn every read into a write
+TOUCH_INTERVAL = 60
+# Puts from one process between checks of the SQLite file's size
+TRIM_EVERY = 200
+
+
+class CacheBackend:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def get(self, key):
+        try:
+            value = self._get(key)
+        except Exception as e:
+            self._failed("read", key, e)
+            return None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        try:
+            self._set(key, value, ttl)
+        except Exception as e:
+            self._failed("write", key, e)
+            return
+        with self.lock:
+            self.writes += 1
+
+    def _failed(self, action, key, error):
+        with self.lock:
+            self.errors += 1
+        logger.warning("Shared cache %s failed for %s: %s", action, key, error)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "errors": self.errors
+            }
+
+
+class PerThread:
+    # One connection per thread and process: a connection opened before a
+    # worker was forked is never used by the worker
+    def __init__(self, connect):
+        self.connect = connect
+        self.local = threading.local()
+
+    def get(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = self.connect()
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def drop(self):
+        connection = getattr(self.local, "connection", None)
+        self.local.connection = None
+        if connection is not None and self.local.pid == os.getpid():
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+class SQLiteBackend(CacheBackend):
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024, timeout=5.0):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.puts = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connections = PerThread(self._connect)
+
+        db = self.connections.get()
+        # WAL lets readers in every worker go on while one of them writes
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                   "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                   "expires REAL, used REAL NOT NULL)")
+        db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                             check_same_thread=False)
+        # Durable enough for a cache, and a commit doesn't wait for fsync
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _get(self, key):
+        db = self.connections.get()
+        row = db.execute("SELECT value, expires, used FROM entries WHERE key = ?",
+                         (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires, used = row
+        now = time.time()
+        if expires is not None and expires <= now:
+            return None
+        if used < now - TOUCH_INTERVAL:
+            db.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key))
+        return value
+
+    def _set(self, key, value, ttl):
+        now = time.time()
+        expires = now + ttl if ttl else None
+        db = self.connections.get()
+        db.execute("INSERT OR REPLACE INTO entries (key, value, size, expires, used) "
+                   "VALUES (?, ?, ?, ?, ?)", (key, value, len(value), expires, now))
+        with self.lock:
+            self.puts += 1
+            trim = self.puts % TRIM_EVERY == 1
+        if trim:
+            self.trim(db, now)
+
+    def trim(self, db, now):
+        # Expired entries go first, then the least recently used ones until
+        # the file's entries fit in max_bytes
+        db.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        evict = []
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY used"):
+            evict.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        db.executemany("DELETE FROM entries WHERE key = ?", evict)
+        logger.info("Shared cache trimmed", extra={"evicted": len(evict), "path": self.path})
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    # Just enough of RESP2 for GET/SET: commands go out as arrays of bulk
+    # strings, replies are parsed off a buffered reader
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+
+    def command(self, *args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            elif isinstance(arg, int):
+                arg = str(arg).encode("ascii")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self.sock.sendall(b"".join(parts))
+        return self.reply()
+
+    def reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed by the server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(rest.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("connection closed by the server")
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self.reply() for _ in range(length)]
+        raise RedisError(f"unexpected reply {line[:32]!r}")
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class RedisBackend(CacheBackend):
+    def __init__(self, host="127.0.0.1", port=6379, db=0, password=None, timeout=1.0):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.connections = PerThread(self._connect)
+
+    def _connect(self):
+        connection = RedisConnection(self.host, self.port, self.timeout)
+        try:
+            if self.password:
+                connection.command("AUTH", self.password)
+            if self.db:
+                connection.command("SELECT", self.db)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def _command(self, *args):
+        try:
+            return self.connections.get().command(*args)
+        except (OSError, RedisError):
+            # The connection may be half-read; the next command opens another
+            self.connections.drop()
+            raise
+
+    def _get(self, key):
+        return self._command("GET", key)
+
+    def _set(self, key, value, ttl):
+        if ttl:
+            self._command("SET", key, value, "PX", int(ttl * 1000))
+        else:
+            self._command("SET", key, value)
+
+
+def open_backend(url, max_bytes=None):
+    # A backend for SHARED_CACHE_URL, or None when it is empty
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        if not path:
+            raise ValueError("sqlite:/// needs a file path")
+        return SQLiteBackend(path, max_bytes) if max_bytes else SQLiteBackend(path)
+    parts = urlsplit(url)
+    if parts.scheme == "redis":
+        db = parts.path.strip("/")
+        return RedisBackend(parts.hostname or "127.0.0.1", parts.port or 6379,
+                            db=int(db) if db else 0,
+                            password=unquote(parts.password) if parts.password else None)
+    raise ValueError(f"Unsupported shared cache URL {url!r}; use sqlite:///PATH or redis://HOST:PORT/DB")
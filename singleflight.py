@@ -0,0 +1,219 @@
+"""Single-flight coalescing of identical in-flight upstream requests.
+
+When several requests with the same key arrive while the first one is still
+waiting on Gemini or ElevenLabs, only that first one (the leader) calls the
+upstream; the others wait for it and share its result. Streams are shared
+too: the leader's chunks are pumped into a SharedStream that every request
+for the key replays from the start.
+
+SingleFlight works from threads (Flask) and from asyncio (ASGI); the two
+sides keep separate tables and share the counters.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SharedStream:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def append(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def wait_started(self):
+        # Blocks until the first chunk or the end of the stream. Returns the
+        # error if the producer failed before producing anything.
+        with self.cond:
+            self.cond.wait_for(lambda: self.chunks or self.done)
+            return self.error if not self.chunks else None
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: index < len(self.chunks) or self.done)
+                chunks = self.chunks[index:]
+                done, error = self.done, self.error
+            index += len(chunks)
+            yield from chunks
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+class AsyncSharedStream:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def _notify(self):
+        # Wake everyone waiting now; later waiters wait on a fresh event
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def wait_started(self):
+        while not self.chunks and not self.done:
+            await self.changed.wait()
+        return self.error if not self.chunks else None
+
+    async def __aiter__(self):
+        index = 0
+        while True:
+            while index >= len(self.chunks) and not self.done:
+                await self.changed.wait()
+            chunks = self.chunks[index:]
+            index += len(chunks)
+            for chunk in chunks:
+                yield chunk
+            if self.done and index >= len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}          # key -> Future
+        self.streams = {}        # key -> SharedStream
+        self.async_calls = {}    # key -> asyncio.Task
+        self.async_streams = {}  # key -> AsyncSharedStream
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _count(self, leader):
+        with self.lock:
+            if leader:
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+    def do(self, key, fn):
+        # Runs fn() once for all concurrent callers with the same key
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+        self._count(leader)
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+
+    def stream(self, key, produce):
+        # produce() returns an iterator of chunks. It runs on a background
+        # thread, so it finishes (and can fill caches) even if every client
+        # goes away. Returns the SharedStream to read from.
+        with self.lock:
+            shared = self.streams.get(key)
+            leader = shared is None
+            if leader:
+                shared = SharedStream()
+                self.streams[key] = shared
+        self._count(leader)
+
+        if leader:
+            threading.Thread(target=self._pump, args=(key, shared, produce),
+                             name=f"{self.name}-stream", daemon=True).start()
+        return shared
+
+    def _pump(self, key, shared, produce):
+        error = None
+        try:
+            for chunk in produce():
+                shared.append(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            with self.lock:
+                if self.streams.get(key) is shared:
+                    del self.streams[key]
+            shared.finish(error)
+
+    async def do_async(self, key, make_coro):
+        # The work runs as its own task, so a leader whose client disconnects
+        # doesn't cancel it for the others
+        task = self.async_calls.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(make_coro())
+            self.async_calls[key] = task
+            task.add_done_callback(lambda t: self._forget_task(key, t))
+        self._count(leader)
+        return await asyncio.shield(task)
+
+    def _forget_task(self, key, task):
+        if self.async_calls.get(key) is task:
+            del self.async_calls[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if nobody is left awaiting
+
+    def stream_async(self, key, produce):
+        # produce() returns an async iterator of chunks
+        shared = self.async_streams.get(key)
+        leader = shared is None
+        if leader:
+            shared = AsyncSharedStream()
+            self.async_streams[key] = shared
+            asyncio.ensure_future(self._pump_async(key, shared, produce))
+        self._count(leader)
+        return shared
+
+    async def _pump_async(self, key, shared, produce):
+        error = None
+        try:
+            async for chunk in produce():
+                shared.append(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            if self.async_streams.get(key) is shared:
+                del self.async_streams[key]
+            shared.finish(error)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self.calls) + len(self.streams) +
+                             len(self.async_calls) + len(self.async_streams)
+            }
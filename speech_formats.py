@@ -0,0 +1,175 @@
+"""Output formats, models and latency tiers for synthesized speech.
+
+Each TTS request can pick its own, from these fields of its JSON body (or
+form, for /converse and /get_response/stream):
+
+    format   an ElevenLabs output format such as "opus_48000_64", or just a
+             codec: "mp3", "opus" or "pcm"
+    bitrate  kbps, for mp3 and opus: the richest format at or below it
+    accept   audio types the client can play, like an Accept header
+    model    one of MODELS
+    latency  ElevenLabs' optimize_streaming_latency tier, 0 (off) to 4
+
+Without a format, the codec is the server default's if the client accepts
+it, otherwise the client's most preferred one we can produce. /text-to-
+speech/stream also reads the Accept header. Anything not asked for comes
+from the server defaults.
+
+PCM is raw signed 16-bit little-endian mono, for clients that play it
+through Web Audio.
+"""
+import math
+from collections import namedtuple
+
+from werkzeug.http import parse_accept_header
+
+CODEC_TYPES = {
+    "mp3": ("audio/mpeg", "audio/mp3"),
+    "opus": ("audio/ogg", "audio/opus"),
+    "pcm": ("audio/pcm", "audio/l16")
+}
+
+MODELS = ("eleven_multilingual_v2", "eleven_turbo_v2_5", "eleven_flash_v2_5")
+LATENCY_TIERS = range(0, 5)
+
+
+class AudioFormat(namedtuple("AudioFormat", "name codec sample_rate bitrate")):
+    @property
+    def content_type(self):
+        if self.codec == "pcm":
+            return f"audio/pcm;rate={self.sample_rate}"
+        if self.codec == "opus":
+            return "audio/ogg;codecs=opus"
+        return "audio/mpeg"
+
+    @property
+    def accept(self):
+        # What to ask ElevenLabs for; output_format decides the rest
+        return "audio/mpeg" if self.codec == "mp3" else "*/*"
+
+    def duration(self, size):
+        # Seconds of audio in size bytes; exact for PCM and CBR MP3, close
+        # enough for Opus
+        return size * 8 / (self.bitrate * 1000)
+
+
+def _format(name, bitrate=None):
+    codec, rate = name.split("_")[:2]
+    # PCM's bit rate follows from its sample rate
+    return AudioFormat(name, codec, int(rate), bitrate or int(rate) * 16 / 1000)
+
+
+FORMATS = {f.name: f for f in (
+    _format("mp3_22050_32", 32),
+    _format("mp3_44100_32", 32),
+    _format("mp3_44100_64", 64),
+    _format("mp3_44100_96", 96),
+    _format("mp3_44100_128", 128),
+    _format("mp3_44100_192", 192),
+    _format("opus_48000_32", 32),
+    _format("opus_48000_64", 64),
+    _format("opus_48000_96", 96),
+    _format("opus_48000_128", 128),
+    _format("opus_48000_192", 192),
+    _format("pcm_16000"),
+    _format("pcm_22050"),
+    _format("pcm_24000"),
+    _format("pcm_44100")
+)}
+
+# A codec asked for without a bitrate, when it isn't the default's
+CODEC_DEFAULTS = {"mp3": "mp3_44100_128", "opus": "opus_48000_64", "pcm": "pcm_24000"}
+
+
+class SpeechOptions(namedtuple("SpeechOptions", "format model_id latency")):
+    """Everything besides text and voice that goes into an ElevenLabs call."""
+
+
+def defaults(output_format, model_id, latency=0):
+    # Server defaults, checked once at startup
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown output format {output_format!r}")
+    return SpeechOptions(FORMATS[output_format], model_id, int(latency))
+
+
+def accepted_codec(accept, default_codec):
+    if not accept:
+        return default_codec
+    if not isinstance(accept, str):
+        accept = ", ".join(accept)
+    accepted = parse_accept_header(accept)
+
+    def quality(codec):
+        return max(accepted.quality(content_type) for content_type in CODEC_TYPES[codec])
+
+    if quality(default_codec) > 0:
+        return default_codec
+    best = max(CODEC_TYPES, key=quality)
+    # Nothing we can produce is acceptable: send the default anyway
+    return best if quality(best) > 0 else default_codec
+
+
+def pick_format(codec, bitrate, default):
+    if bitrate is None or codec == "pcm":
+        return default if default.codec == codec else FORMATS[CODEC_DEFAULTS[codec]]
+    candidates = [f for f in FORMATS.values() if f.codec == codec]
+    fitting = [f for f in candidates if f.bitrate <= bitrate]
+    if not fitting:
+        return min(candidates, key=lambda f: f.bitrate)
+    return max(fitting, key=lambda f: (f.bitrate, f.sample_rate))
+
+
+def _field(params, name, types):
+    # A request field, or None when it is missing or empty. A JSON body can
+    # hold any type, so values of other types are refused up front rather
+    # than failing a lookup or comparison later.
+    value = params.get(name)
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or not isinstance(value, types):
+        raise ValueError(f"Invalid {name} {value!r}")
+    return value
+
+
+def negotiate(server, params, accept_header=None):
+    # Request fields (and Accept header) -> SpeechOptions, starting from the
+    # server defaults. Raises ValueError for values we can't honour.
+    params = params or {}
+    requested = _field(params, "format", str)
+    bitrate = _field(params, "bitrate", (str, int, float))
+    if bitrate is not None:
+        try:
+            bitrate = float(bitrate)
+        except ValueError:
+            raise ValueError(f"Invalid bitrate {bitrate!r}")
+        if not math.isfinite(bitrate):
+            raise ValueError(f"Invalid bitrate {bitrate!r}")
+
+    accept = _field(params, "accept", (str, list))
+    if isinstance(accept, list) and not all(isinstance(item, str) for item in accept):
+        raise ValueError(f"Invalid accept {accept!r}")
+
+    if requested in FORMATS:
+        output_format = FORMATS[requested]
+    elif requested is None or requested in CODEC_TYPES:
+        codec = requested or accepted_codec(accept or accept_header, server.format.codec)
+        output_format = pick_format(codec, bitrate, server.format)
+    else:
+        raise ValueError(f"Unknown audio format {requested!r}")
+
+    model_id = _field(params, "model", str) or server.model_id
+    if model_id not in MODELS and model_id != server.model_id:
+        raise ValueError(f"Unknown model {model_id!r}")
+
+    latency = _field(params, "latency", (str, int))
+    if latency is None:
+        latency = server.latency
+    else:
+        try:
+            latency = int(latency)
+        except ValueError:
+            raise ValueError(f"Invalid latency {latency!r}")
+        if latency not in LATENCY_TIERS:
+            raise ValueError(f"Latency must be between 0 and {LATENCY_TIERS[-1]}")
+
+    return SpeechOptions(output_format, model_id, latency)
@@ -0,0 +1,139 @@
+"""Sentence-pipelined text-to-speech.
+
+The reply text arrives from Gemini in chunks. SentenceSplitter cuts it at
+Hindi/Devanagari sentence boundaries and SpeechPipeline sends each finished
+sentence to TTS right away, handing the audio back in sentence order.
+AsyncSpeechPipeline is the asyncio version used by the ASGI server.
+"""
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# Danda, double danda, ? and ! end a sentence straight away. A full stop only
+# counts when followed by whitespace so "3.5" or "e.g." mid-chunk stay intact.
+SENTENCE_END = re.compile(r'[।॥?!]+["\')\]]*\s*|\.+["\')\]]*\s+')
+
+
+class SentenceSplitter:
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        # Returns the sentences completed by this chunk
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self.buffer):
+            sentence = self.buffer[start:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        # Whatever is left once the reply is complete
+        sentence = self.buffer.strip()
+        self.buffer = ""
+        return [sentence] if sentence else []
+
+
+class SpeechPipeline:
+    def __init__(self, synthesize, max_concurrency=3, on_done=None):
+        # on_done() is called, on a worker thread, as each sentence finishes,
+        # so the caller knows when to look at ready() again
+        self.synthesize = synthesize
+        self.on_done = on_done
+        self.splitter = SentenceSplitter()
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.pending = []
+        self.next_index = 0
+
+    def feed(self, text):
+        for sentence in self.splitter.feed(text):
+            self._submit(sentence)
+
+    def _submit(self, sentence):
+        future = self.executor.submit(self.synthesize, sentence)
+        if self.on_done:
+            future.add_done_callback(lambda _: self.on_done())
+        self.pending.append((self.next_index, sentence, future))
+        self.next_index += 1
+
+    def _segment(self, index, sentence, future):
+        try:
+            return {"index": index, "text": sentence, "audio": future.result()}
+        except Exception as e:
+            return {"index": index, "text": sentence, "error": str(e)}
+
+    def ready(self):
+        # Segments that are finished, without waiting; stops at the first
+        # sentence still being synthesized so the order is kept
+        while self.pending and self.pending[0][2].done():
+            yield self._segment(*self.pending.pop(0))
+
+    def finish(self):
+        # Flush the last sentence and wait for everything still in flight
+        for sentence in self.splitter.flush():
+            self._submit(sentence)
+        while self.pending:
+            yield self._segment(*self.pending.pop(0))
+        self.close()
+
+    def close(self):
+        for _, _, future in self.pending:
+            future.cancel()
+        self.pending = []
+        self.executor.shutdown(wait=False)
+
+
+class AsyncSpeechPipeline:
+    def __init__(self, synthesize, max_concurrency=3, on_done=None):
+        # synthesize is a coroutine function; on_done as for SpeechPipeline,
+        # called on the event loop
+        self.synthesize = synthesize
+        self.on_done = on_done
+        self.splitter = SentenceSplitter()
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.pending = []
+        self.next_index = 0
+
+    def feed(self, text):
+        for sentence in self.splitter.feed(text):
+            self._submit(sentence)
+
+    def _submit(self, sentence):
+        task = asyncio.ensure_future(self._run(sentence))
+        if self.on_done:
+            task.add_done_callback(lambda _: self.on_done())
+        self.pending.append((self.next_index, sentence, task))
+        self.next_index += 1
+
+    async def _run(self, sentence):
+        async with self.slots:
+            return await self.synthesize(sentence)
+
+    def _segment(self, index, sentence, task):
+        try:
+            return {"index": index, "text": sentence, "audio": task.result()}
+        except Exception as e:
+            return {"index": index, "text": sentence, "error": str(e)}
+
+    def ready(self):
+        while self.pending and self.pending[0][2].done():
+            yield self._segment(*self.pending.pop(0))
+
+    async def finish(self):
+        for sentence in self.splitter.flush():
+            self._submit(sentence)
+        while self.pending:
+            # Left in pending while awaited so close() can still cancel it
+            index, sentence, task = self.pending[0]
+            await asyncio.wait([task])
+            self.pending.pop(0)
+            yield self._segment(index, sentence, task)
+
+    def close(self):
+        for _, _, task in self.pending:
+            task.cancel()
+        self.pending = []
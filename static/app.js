@@ -0,0 +1,1173 @@
+// Add this global variable at the start of your script (before any functions)
+let isSpeaking = false;
+let facialAnimations;
+
+// Scene setup
+const scene = new THREE.Scene();
+scene.background = new THREE.Color(0xffffff); // Set to white
+
+// Get the character container dimensions
+const container = document.getElementById('character-container');
+const containerWidth = container.clientWidth;
+const containerHeight = container.clientHeight;
+
+// Camera setup specifically for half-body framing
+const camera = new THREE.PerspectiveCamera(35, containerWidth / containerHeight, 0.1, 1000);
+camera.position.set(0, 1.6, 2.5);
+
+// Pixel ratio: starts at the screen's, capped at 2, and drops towards 1
+// when frames run slow (see adaptPixelRatio)
+const MAX_PIXEL_RATIO = Math.min(window.devicePixelRatio || 1, 2);
+const MIN_PIXEL_RATIO = 1;
+let pixelRatio = MAX_PIXEL_RATIO;
+
+// Renderer setup - match container size exactly. Nothing casts shadows, and
+// on high-density screens multisampling costs more than it shows.
+const renderer = new THREE.WebGLRenderer({ antialias: MAX_PIXEL_RATIO < 2 });
+renderer.setPixelRatio(pixelRatio);
+renderer.setSize(containerWidth, containerHeight);
+renderer.outputEncoding = THREE.sRGBEncoding;
+document.getElementById('character-container').appendChild(renderer.domElement);
+
+// Add resize handler to keep canvas matched to container
+window.addEventListener('resize', () => {
+    const newWidth = container.clientWidth;
+    const newHeight = container.clientHeight;
+    camera.aspect = newWidth / newHeight;
+    camera.updateProjectionMatrix();
+    renderer.setSize(newWidth, newHeight);
+    requestRender();
+});
+
+// Restricted controls for better framing
+const controls = new THREE.OrbitControls(camera, renderer.domElement);
+controls.enablePan = false;
+controls.enableZoom = false;
+controls.minPolarAngle = Math.PI/2.2; // Restrict vertical rotation
+controls.maxPolarAngle = Math.PI/1.8;
+controls.minAzimuthAngle = -Math.PI/4; // Restrict horizontal rotation
+controls.maxAzimuthAngle = Math.PI/4;
+controls.target.set(0, 1.5, 0);
+controls.update();
+
+// Render at the full frame rate while the camera is being dragged
+let interacting = false;
+controls.addEventListener('start', () => { interacting = true; });
+controls.addEventListener('end', () => { interacting = false; });
+controls.addEventListener('change', () => requestRender());
+
+// Enhanced lighting for better visuals
+const ambientLight = new THREE.AmbientLight(0xffffff, 0.5);
+scene.add(ambientLight);
+
+const mainLight = new THREE.DirectionalLight(0xffffff, 1);
+mainLight.position.set(5, 5, 5);
+scene.add(mainLight);
+
+const fillLight = new THREE.DirectionalLight(0xffffff, 0.3);
+fillLight.position.set(-5, 0, 5);
+scene.add(fillLight);
+
+// Animation system: one clock and one requestAnimationFrame loop drive
+// every animator. Each animator is called as animator(delta, elapsed),
+// in seconds, once per rendered frame.
+const clock = new THREE.Clock();
+const animators = [];
+let character;
+
+// Frame pacing: every frame while speaking or dragging, IDLE_FPS for the
+// idle motion otherwise, and no frames at all while the tab is hidden
+const IDLE_FPS = 15;
+let frameRequest = null;
+let lastFrameTime = 0;
+let renderRequested = false;
+
+// Lerp factor that moves `rate` of the way per 60 fps frame, at any frame rate
+function smoothing(rate, delta) {
+    return 1 - Math.pow(1 - rate, delta * 60);
+}
+
+// Mouth shape for each viseme code in the server's lip-sync timeline, as
+// [mouthSmile, mouthRound]; how far the mouth opens comes from the
+// timeline's amplitude
+const VISEME_SHAPES = {
+    X: [0.1, 0.1],   // rest
+    A: [0.2, 0.1],   // open
+    E: [0.5, 0.0],   // spread
+    O: [0.05, 0.8],  // rounded
+    M: [0.15, 0.1],  // lips closed
+    F: [0.3, 0.05],  // lip to teeth
+    C: [0.2, 0.2]    // other consonants
+};
+const MAX_MOUTH_OPEN = 0.8;
+
+const FACE_KEYS = ['mouthOpen', 'mouthSmile', 'mouthRound', 'eyebrowRaise', 'eyesClosed'];
+const NEUTRAL_FACE = [0.1, 0.1, 0.1, 0, 0];
+
+// Decode a lip-sync timeline once, into typed arrays the render loop reads
+function decodeLipsync(lipsync) {
+    if (!lipsync || !lipsync.amplitude) return null;
+    const bytes = atob(lipsync.amplitude);
+    const amplitude = new Float32Array(bytes.length);
+    for (let i = 0; i < bytes.length; i++) {
+        amplitude[i] = bytes.charCodeAt(i) / 255;
+    }
+    return { frameSeconds: lipsync.frame_ms / 1000, amplitude: amplitude, visemes: lipsync.visemes };
+}
+
+// Drives the face morph targets. While audio with a timeline plays, the
+// mouth follows the timeline's keyframes at audio.currentTime; the work
+// per frame is a lookup and a lerp over fixed arrays.
+function setupFacialAnimations(character) {
+    // Morph target indices of every face mesh, looked up once
+    const faceMeshes = [];
+    character.traverse((node) => {
+        if (node.morphTargetDictionary) {
+            faceMeshes.push({
+                mesh: node,
+                indices: FACE_KEYS.map(key => node.morphTargetDictionary[key])
+            });
+        }
+    });
+
+    const current = Float32Array.from(NEUTRAL_FACE);
+    const target = Float32Array.from(NEUTRAL_FACE);
+    let audio = null;
+    let timeline = null;
+
+    function followTimeline() {
+        const amplitude = timeline.amplitude;
+        const position = audio.currentTime / timeline.frameSeconds;
+        const frame = Math.floor(position);
+        if (frame >= amplitude.length) {
+            target.set(NEUTRAL_FACE);
+            return;
+        }
+        const next = Math.min(frame + 1, amplitude.length - 1);
+        const open = amplitude[frame] + (amplitude[next] - amplitude[frame]) * (position - frame);
+        const shape = VISEME_SHAPES[timeline.visemes[frame]] || VISEME_SHAPES.X;
+        target[0] = open * MAX_MOUTH_OPEN;
+        target[1] = shape[0];
+        target[2] = shape[1];
+        target[3] = open * 0.2;
+        target[4] = 0;
+    }
+
+    function updateFacialExpression(delta) {
+        if (isSpeaking && audio && timeline) {
+            followTimeline();
+        } else if (isSpeaking) {
+            // No timeline for this audio: a steady talking rhythm
+            const open = 0.25 + 0.2 * Math.sin(performance.now() * 0.012);
+            target[0] = open;
+            target[1] = 0.2;
+            target[2] = 0.2;
+            target[3] = 0.05;
+            target[4] = 0;
+        } else {
+            target.set(NEUTRAL_FACE);
+        }
+
+        const factor = Math.min(1, delta * 20);
+        for (let k = 0; k < current.length; k++) {
+            current[k] += (target[k] - current[k]) * factor;
+        }
+
+        for (let m = 0; m < faceMeshes.length; m++) {
+            const influences = faceMeshes[m].mesh.morphTargetInfluences;
+            const indices = faceMeshes[m].indices;
+            for (let k = 0; k < indices.length; k++) {
+                if (indices[k] !== undefined) {
+                    influences[indices[k]] = current[k];
+                }
+            }
+        }
+    }
+
+    return {
+        update: updateFacialExpression,
+        // playingAudio and its decoded timeline, when there is one
+        startSpeaking: (playingAudio, lipsync) => {
+            isSpeaking = true;
+            audio = playingAudio || null;
+            timeline = lipsync || null;
+        },
+        stopSpeaking: () => {
+            isSpeaking = false;
+            audio = null;
+            timeline = null;
+        }
+    };
+}
+
+// Simple blink animation: eyes close for BLINK_SECONDS every 3-5 seconds
+const BLINK_SECONDS = 0.15;
+
+function setupBlinking() {
+    let leftEye, rightEye;
+    
+    // Find the eye meshes
+    character.traverse((node) => {
+        if (node.name === 'EyeLeft') leftEye = node;
+        if (node.name === 'EyeRight') rightEye = node;
+    });
+
+    if (!leftEye || !rightEye) {
+        console.log('Could not find eye meshes');
+        return;
+    }
+
+    // Store original scales separately for each eye
+    const leftOriginalScale = leftEye.scale.y;
+    const rightOriginalScale = rightEye.scale.y;
+    let nextBlink = 3 + Math.random() * 2;
+
+    function updateBlink(delta, elapsed) {
+        if (elapsed >= nextBlink + BLINK_SECONDS) {
+            nextBlink = elapsed + 3 + Math.random() * 2;
+        }
+        const closed = elapsed >= nextBlink;
+        leftEye.scale.y = closed ? 0.1 : leftOriginalScale;
+        rightEye.scale.y = closed ? 0.1 : rightOriginalScale;
+    }
+
+    animators.push(updateBlink);
+}
+
+// Load character
+const loader = new THREE.GLTFLoader();
+loader.load(
+    // Self-hosted, optimized copy when the server has one
+    container.dataset.avatarUrl,
+    function (gltf) {
+        character = gltf.scene;
+        scene.add(character);
+
+        // Set initial background color to white
+        renderer.setClearColor(0xffffff);
+
+        // Debug: Log initial bone rotations
+        character.traverse((node) => {
+            if (node.type === 'Bone' && (node.name === 'Head' || node.name === 'Neck')) {
+                console.log(`${node.name} initial rotation:`, {
+                    x: node.rotation.x,
+                    y: node.rotation.y,
+                    z: node.rotation.z
+                });
+            }
+        });
+
+        // Initialize facial animations
+        facialAnimations = setupFacialAnimations(character);
+        animators.push(facialAnimations.update);
+        
+        // Start blinking
+        setupBlinking();
+        
+        // Add head movements
+        setupHeadMovements();
+        
+        // Add arm movements
+        setupArmMovements();
+        
+        // Center camera on face
+        const box = new THREE.Box3().setFromObject(character);
+        const center = box.getCenter(new THREE.Vector3());
+        controls.target.set(center.x, center.y + 0.5, center.z);
+        camera.position.set(center.x, center.y + 0.5, center.z + 2);
+        controls.update();
+
+        // Start animation loop only after character is loaded
+        startAnimationLoop();
+    },
+    // Add loading progress callback
+    function (xhr) {
+        console.log((xhr.loaded / xhr.total * 100) + '% loaded');
+    },
+    // Add error callback
+    function (error) {
+        console.error('An error occurred loading the character:', error);
+    }
+);
+
+// Wait for a SourceBuffer to finish appending
+function appendBuffer(sourceBuffer, chunk) {
+    return new Promise((resolve, reject) => {
+        sourceBuffer.addEventListener('updateend', resolve, { once: true });
+        sourceBuffer.addEventListener('error', reject, { once: true });
+        sourceBuffer.appendBuffer(chunk);
+    });
+}
+
+// What the server should synthesize for this browser: the audio types it
+// can play, and a lower bitrate on slow connections or with data saver on.
+// The server picks the format from these and its own defaults.
+function speechPreferences() {
+    const probe = document.createElement('audio');
+    const accept = ['audio/mpeg'];
+    if (probe.canPlayType && probe.canPlayType('audio/ogg; codecs=opus')) {
+        accept.push('audio/ogg;q=0.9');
+    }
+    const preferences = { accept: accept.join(', ') };
+
+    const connection = window.navigator && navigator.connection;
+    if (connection && (connection.saveData || /2g/.test(connection.effectiveType))) {
+        preferences.bitrate = 32;
+    } else if (connection && connection.effectiveType === '3g') {
+        preferences.bitrate = 64;
+    }
+    return preferences;
+}
+
+const SPEECH_PREFERENCES = speechPreferences();
+
+// Build an Audio element that plays a chunked audio response.
+// With MediaSource the audio starts as soon as the first chunks are
+// appended; otherwise the whole body is collected into a Blob.
+async function audioFromStream(response) {
+    const audio = new Audio();
+    const type = response.headers.get('Content-Type') || 'audio/mpeg';
+
+    if (window.MediaSource && MediaSource.isTypeSupported(type)) {
+        const mediaSource = new MediaSource();
+        audio.src = URL.createObjectURL(mediaSource);
+
+        mediaSource.addEventListener('sourceopen', async () => {
+            try {
+                const sourceBuffer = mediaSource.addSourceBuffer(type);
+                const reader = response.body.getReader();
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    await appendBuffer(sourceBuffer, value);
+                }
+                mediaSource.endOfStream();
+            } catch (error) {
+                console.error('Error streaming audio:', error);
+                if (mediaSource.readyState === 'open') {
+                    mediaSource.endOfStream('network');
+                }
+            }
+        }, { once: true });
+    } else {
+        audio.src = URL.createObjectURL(await response.blob());
+    }
+
+    audio.addEventListener('ended', () => URL.revokeObjectURL(audio.src), { once: true });
+    return audio;
+}
+
+// Updated speak function using state machine
+async function speak(text) {
+    try {
+        const response = await fetch('/text-to-speech/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(Object.assign({ text: text }, SPEECH_PREFERENCES))
+        });
+
+        if (!response.ok) {
+            const data = await response.json();
+            console.error('Text-to-speech error:', data.error);
+            return;
+        }
+
+        // Cached clips come with their lip-sync timeline in a header
+        const lipsyncHeader = response.headers.get('X-Lipsync');
+        const lipsync = lipsyncHeader ? decodeLipsync(JSON.parse(lipsyncHeader)) : null;
+        const audio = await audioFromStream(response);
+        
+        if (facialAnimations) {
+            audio.onplay = () => {
+                isSpeaking = true;
+                if (facialAnimations.startSpeaking) {
+                    facialAnimations.startSpeaking(audio, lipsync);
+                }
+            };
+
+            audio.onended = () => {
+                isSpeaking = false;
+                if (facialAnimations.stopSpeaking) {
+                    facialAnimations.stopSpeaking();
+                }
+            };
+        }
+        
+        await audio.play();
+    } catch (error) {
+        console.error('Error playing audio:', error);
+    }
+}
+
+// Frames slower than this while animating at full rate lower the pixel
+// ratio; a long run of frames faster than RAISE lets it climb back
+const SLOW_FRAME_SECONDS = 1 / 40;
+const FAST_FRAME_SECONDS = 1 / 55;
+let slowFrames = 0;
+let fastFrames = 0;
+
+function adaptPixelRatio(delta) {
+    if (delta > 0.25) return;  // a stall, not a trend
+    slowFrames = delta > SLOW_FRAME_SECONDS ? slowFrames + 1 : 0;
+    fastFrames = delta < FAST_FRAME_SECONDS ? fastFrames + 1 : 0;
+    let next = pixelRatio;
+    if (slowFrames >= 30) {
+        next = Math.max(MIN_PIXEL_RATIO, pixelRatio - 0.25);
+    } else if (fastFrames >= 600) {
+        next = Math.min(MAX_PIXEL_RATIO, pixelRatio + 0.25);
+    }
+    if (next !== pixelRatio) {
+        pixelRatio = next;
+        renderer.setPixelRatio(pixelRatio);
+        slowFrames = 0;
+        fastFrames = 0;
+    }
+}
+
+// Main animation loop
+function animate(now) {
+    frameRequest = requestAnimationFrame(animate);
+    const active = isSpeaking || interacting;
+    if (!active && !renderRequested && now - lastFrameTime < 1000 / IDLE_FPS) {
+        return;
+    }
+    lastFrameTime = now;
+    renderRequested = false;
+
+    const delta = Math.min(clock.getDelta(), 0.25);
+    const elapsed = clock.elapsedTime;
+    for (let i = 0; i < animators.length; i++) {
+        animators[i](delta, elapsed);
+    }
+    renderer.render(scene, camera);
+
+    if (active) {
+        adaptPixelRatio(delta);
+    }
+}
+
+function startAnimationLoop() {
+    if (frameRequest !== null || document.hidden || !character) return;
+    clock.getDelta();  // skip the time spent hidden
+    frameRequest = requestAnimationFrame(animate);
+}
+
+function stopAnimationLoop() {
+    if (frameRequest === null) return;
+    cancelAnimationFrame(frameRequest);
+    frameRequest = null;
+}
+
+// Draw on the next frame even if the idle frame rate would skip it
+function requestRender() {
+    renderRequested = true;
+}
+
+document.addEventListener('visibilitychange', () => {
+    if (document.hidden) {
+        stopAnimationLoop();
+    } else {
+        startAnimationLoop();
+    }
+});
+
+// Chat interface
+const input = document.getElementById('user-input');
+const sendButton = document.getElementById('send-button');
+const messagesContainer = document.getElementById('chat-messages');
+
+function addMessage(text, isUser) {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${isUser ? 'user-message' : 'ai-message'}`;
+    messageDiv.textContent = text;
+    messagesContainer.appendChild(messageDiv);
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    return messageDiv;
+}
+
+// Plays the per-sentence audio segments back to back, in order
+const audioQueue = {
+    segments: [],
+    playing: false,
+    current: null,
+
+    push(src, lipsync) {
+        this.segments.push({ src: src, lipsync: decodeLipsync(lipsync) });
+        if (!this.playing) this.playNext();
+    },
+
+    // Stops the reply being spoken and drops the rest of it
+    clear() {
+        this.segments.forEach(segment => releaseAudio(segment.src));
+        this.segments = [];
+        if (this.current) {
+            const audio = this.current;
+            this.current = null;
+            audio.onended = audio.onerror = null;
+            audio.pause();
+            releaseAudio(audio.src);
+        }
+        this.playNext();
+    },
+
+    playNext() {
+        if (this.current) {
+            releaseAudio(this.current.src);
+            this.current = null;
+        }
+        if (this.segments.length === 0) {
+            this.playing = false;
+            isSpeaking = false;
+            if (facialAnimations && facialAnimations.stopSpeaking) {
+                facialAnimations.stopSpeaking();
+            }
+            return;
+        }
+
+        this.playing = true;
+        const segment = this.segments.shift();
+        const audio = new Audio(segment.src);
+        this.current = audio;
+        audio.onplay = () => {
+            isSpeaking = true;
+            if (facialAnimations && facialAnimations.startSpeaking) {
+                facialAnimations.startSpeaking(audio, segment.lipsync);
+            }
+        };
+        audio.onended = () => this.playNext();
+        audio.onerror = () => this.playNext();
+        audio.play().catch(error => {
+            if (this.current !== audio) return;  // cleared before it started
+            console.error('Error playing audio segment:', error);
+            this.playNext();
+        });
+    }
+};
+
+function releaseAudio(src) {
+    if (src && src.startsWith('blob:')) URL.revokeObjectURL(src);
+}
+
+// A /ws/session socket carries the whole conversation when the server has
+// one (the ASGI server does): transcripts and barge-in go up, reply text,
+// audio and lip sync come down, and a reply can be cut off mid-sentence.
+// Without it every turn is a /converse request.
+const voiceSession = {
+    socket: null,
+    connected: false,   // the server accepted a socket at least once
+    turns: 0,           // final transcripts sent; the server numbers turns the same way
+    interrupted: 0,     // events for this turn and earlier are dropped
+    audioHeader: null,  // the audio event whose clip is the next binary frame
+    reply: null,        // { turn, div, text } for the reply being shown
+
+    get open() {
+        return this.socket !== null && this.socket.readyState === WebSocket.OPEN;
+    },
+
+    connect() {
+        if (!('WebSocket' in window)) return;
+        const scheme = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const socket = new WebSocket(scheme + '//' + location.host + '/ws/session?' +
+                                     new URLSearchParams(SPEECH_PREFERENCES));
+        socket.binaryType = 'arraybuffer';
+        socket.onopen = () => {
+            this.connected = true;
+            this.turns = this.interrupted = 0;
+            this.audioHeader = null;
+        };
+        socket.onmessage = (event) => this.receive(event.data);
+        socket.onclose = () => {
+            if (this.socket !== socket) return;
+            this.socket = null;
+            // Reconnect after a restart; a server without the endpoint
+            // never accepted one, so keep using /converse
+            if (this.connected) setTimeout(() => this.connect(), 1000);
+        };
+        this.socket = socket;
+    },
+
+    send(message) {
+        this.socket.send(JSON.stringify(message));
+    },
+
+    transcript(text, final) {
+        if (final) {
+            // The server cuts off the reply in progress for a new turn
+            this.interrupted = this.turns;
+            this.turns++;
+        }
+        this.send({ type: 'transcript', text: text, final: final });
+    },
+
+    bargeIn() {
+        this.interrupted = this.turns;
+        this.audioHeader = null;
+        if (this.open) this.send({ type: 'barge_in' });
+    },
+
+    show(turn, text) {
+        if (!this.reply || this.reply.turn !== turn) {
+            this.reply = { turn: turn, div: addMessage('', false), text: '' };
+        }
+        this.reply.text = text;
+        this.reply.div.textContent = text;
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    },
+
+    receive(data) {
+        if (typeof data !== 'string') {
+            const header = this.audioHeader;
+            this.audioHeader = null;
+            if (header && header.turn > this.interrupted) {
+                const blob = new Blob([data], { type: header.content_type || 'audio/mpeg' });
+                audioQueue.push(URL.createObjectURL(blob), header.lipsync);
+            }
+            return;
+        }
+
+        const payload = JSON.parse(data);
+        if (payload.type === 'audio' && 'bytes' in payload) {
+            this.audioHeader = payload;
+            return;
+        }
+        if (payload.turn <= this.interrupted) return;
+
+        if (payload.type === 'text') {
+            const shown = this.reply && this.reply.turn === payload.turn ? this.reply.text : '';
+            this.show(payload.turn, shown + payload.text);
+        } else if (payload.type === 'done') {
+            this.show(payload.turn, payload.response);
+        } else if (payload.type === 'error') {
+            if (payload.turn) {
+                this.show(payload.turn, payload.error);
+            } else {
+                console.error('Voice session error:', payload.error);
+            }
+        } else if (payload.type === 'audio') {
+            console.error('Sentence synthesis failed:', payload.error);
+        }
+    }
+};
+
+// The user started talking over the reply
+function interruptReply() {
+    audioQueue.clear();
+    voiceSession.bargeIn();
+}
+
+// One round trip per turn: /converse streams newline-delimited JSON with
+// the reply text as it is generated and the audio for each finished
+// sentence, which is queued for playback while the rest arrives.
+// Returns the full reply text and whether the server spoke it.
+async function converse(message) {
+    const response = await fetch('/converse', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/x-www-form-urlencoded',
+        },
+        body: new URLSearchParams(Object.assign({ user_input: message }, SPEECH_PREFERENCES))
+    });
+
+    if (response.status === 429 || response.status === 503) {
+        throw busyError(response);
+    }
+    if (!response.ok || !response.body) {
+        throw new Error('Streaming not available');
+    }
+
+    const messageDiv = addMessage('', false);
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let fullText = '';
+    let spoken = false;
+
+    function handleLine(line) {
+        if (!line.trim()) return;
+        const payload = JSON.parse(line);
+
+        if (payload.type === 'text') {
+            fullText += payload.text;
+            messageDiv.textContent = fullText;
+        } else if (payload.type === 'audio') {
+            if (payload.audio) {
+                spoken = true;
+                audioQueue.push('data:' + (payload.content_type || 'audio/mpeg') + ';base64,' + payload.audio,
+                                payload.lipsync);
+            } else {
+                console.error('Sentence synthesis failed:', payload.error);
+            }
+        } else if (payload.type === 'done') {
+            fullText = payload.response;
+            messageDiv.textContent = fullText;
+        } else if (payload.type === 'error') {
+            fullText = payload.error;
+            messageDiv.textContent = fullText;
+        }
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    }
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let newline;
+        while ((newline = buffer.indexOf('\n')) !== -1) {
+            handleLine(buffer.slice(0, newline));
+            buffer = buffer.slice(newline + 1);
+        }
+    }
+    handleLine(buffer + decoder.decode());
+
+    return { text: fullText, spoken: spoken };
+}
+
+// Rate limited (429) or the server is overloaded (503): falling back to
+// another route won't help, so the user is asked to wait instead
+function busyError(response) {
+    const error = new Error('Server busy');
+    error.retryAfter = Number(response.headers.get('Retry-After')) || 1;
+    return error;
+}
+
+// Update your sendMessage function to use the new addMessage function
+async function sendMessage() {
+    const message = input.value.trim();
+    if (message) {
+        // Add user message
+        addMessage(message, true);
+
+        if (voiceSession.open) {
+            // The reply arrives on the socket; a new message cuts off the
+            // one still playing
+            audioQueue.clear();
+            voiceSession.transcript(message, true);
+            input.value = '';
+            return;
+        }
+        
+        // Disable input while processing
+        input.disabled = true;
+        sendButton.disabled = true;
+
+        try {
+            let aiResponse;
+            let spoken = false;
+            try {
+                // Show and speak the reply as it is generated
+                const result = await converse(message);
+                aiResponse = result.text;
+                spoken = result.spoken;
+            } catch (streamError) {
+                if (streamError.retryAfter) throw streamError;
+                console.warn('Streaming failed, falling back:', streamError);
+                const response = await fetch('/get_response', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/x-www-form-urlencoded',
+                    },
+                    body: 'user_input=' + encodeURIComponent(message)
+                });
+                if (response.status === 429 || response.status === 503) {
+                    throw busyError(response);
+                }
+                
+                const data = await response.json();
+                aiResponse = data.response;
+                
+                // Add AI message
+                addMessage(aiResponse, false);
+            }
+            
+            // Sentences were already queued for playback while streaming
+            if (!spoken) {
+                await speak(aiResponse);
+            }
+        } catch (error) {
+            console.error('Error:', error);
+            if (error.retryAfter) {
+                addMessage(`Server is busy, please try again in ${error.retryAfter} s`, false);
+            } else {
+                addMessage('Error: Failed to get response', false);
+            }
+        }
+
+        // Re-enable input
+        input.disabled = false;
+        sendButton.disabled = false;
+        
+        input.value = '';
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    }
+}
+
+sendButton.addEventListener('click', sendMessage);
+input.addEventListener('keypress', (e) => {
+    if (e.key === 'Enter') {
+        sendMessage();
+    }
+});
+
+function setupHeadMovements() {
+    let headBone, neckBone;
+    
+    // Find the head and neck bones
+    character.traverse((node) => {
+        if (node.type === 'Bone') {
+            if (node.name === 'Head') headBone = node;
+            if (node.name === 'Neck') neckBone = node;
+        }
+    });
+
+    if (!headBone || !neckBone) {
+        console.log('Could not find head or neck bones');
+        return;
+    }
+
+    // Store original rotations
+    const originalRotation = {
+        x: neckBone.rotation.x - 0.1,  // Lift head up slightly
+        y: neckBone.rotation.y,
+        z: neckBone.rotation.z
+    };
+
+    function updateHeadMovement(delta, time) {
+
+        // Base position - slightly lifted, looking forward
+        const baseX = -0.1; // Lift head up
+        const baseY = 0;
+        const baseZ = 0;
+        
+        // Engagement movements (like nodding while explaining)
+        const engagementX = Math.sin(time * 0.7) * 0.05;  // Occasional nods
+        const engagementY = Math.sin(time * 0.4) * 0.08;  // Looking side to side while explaining
+        
+        // Micro movements for naturalness
+        const microX = Math.sin(time * 2.5) * 0.02;
+        const microY = Math.cos(time * 2.1) * 0.02;
+        const microZ = Math.sin(time * 1.8) * 0.01;
+        
+        // Very slow drift
+        const driftX = Math.sin(time * 0.1) * 0.02;
+        const driftY = Math.cos(time * 0.15) * 0.02;
+        
+        // Combine all movements
+        neckBone.rotation.x = originalRotation.x + baseX + engagementX + microX + driftX;
+        neckBone.rotation.y = originalRotation.y + baseY + engagementY + microY + driftY;
+        neckBone.rotation.z = originalRotation.z + baseZ + microZ;
+
+        // Head follows neck but with slightly reduced movement
+        headBone.rotation.x = neckBone.rotation.x * 0.3;
+        headBone.rotation.y = neckBone.rotation.y * 0.3;
+        headBone.rotation.z = neckBone.rotation.z * 0.3;
+    }
+
+    // Add to main animation loop; the renderer updates the bone matrices
+    animators.push(updateHeadMovement);
+}
+
+function setupArmMovements() {
+    let leftArm, rightArm, leftForeArm, rightForeArm, leftHand, rightHand;
+    
+    // Find arm bones
+    character.traverse((node) => {
+        if (node.type === 'Bone') {
+            switch(node.name) {
+                case 'LeftArm': leftArm = node; break;
+                case 'RightArm': rightArm = node; break;
+                case 'LeftForeArm': leftForeArm = node; break;
+                case 'RightForeArm': rightForeArm = node; break;
+                case 'LeftHand': leftHand = node; break;
+                case 'RightHand': rightHand = node; break;
+            }
+        }
+    });
+
+    // Neutral position (keep this as reference) hands are staright down
+    const neutralPosition = {
+        leftArm: { x: 1.3, y: 0.1, z: 0.1 },
+        rightArm: { x: 1.3, y: 0.1, z: -0.1 },
+        leftForeArm: { x: 0.1, y: 0, z: 0 },
+        rightForeArm: { x: 0.1, y: 0, z: 0 },
+        leftHand: { x: 0, y: 0, z: 0 },
+        rightHand: { x: 0, y: 0, z: 0 },
+        duration: 1200
+    };
+
+    // Predefined empty gesture arrays for different animations
+    const gestureArrays = {
+        explaining: [{
+leftArm: { x: 1.2, y: 0.2, z: 0.3 },
+rightArm: { x: 1.2, y: -0.2, z: -0.3 },
+leftForeArm: { x: 0.1, y: 0, z: 0.1 },
+rightForeArm: { x: 0.1, y: 0, z: -0.1 },
+leftHand: { x: 0, y: 0.1, z: 0 },
+rightHand: { x: 0, y: 0.1, z: 0 },
+duration: 1500
+}],
+
+presenting: [{
+leftArm: { x: 0.9, y: 0.4, z: 0.4 },
+rightArm: { x: 0.9, y: 0.4, z: -0.4 },
+leftForeArm: { x: 0.3, y: 0.3, z: 0.2 },
+rightForeArm: { x: 0.3, y: 0.3, z: -0.2 },
+leftHand: { x: 0.2, y: 0.4, z: 0.1 },
+rightHand: { x: 0.2, y: 0.4, z: -0.1 },
+duration: 1400
+}],
+
+explainRight: [{
+leftArm: { x: 1.4, y: 0, z: 0 },
+rightArm: { x: 1.1, y: 0.3, z: -0.4 },
+leftForeArm: { x: 0, y: 0, z: 0 },
+rightForeArm: { x: 0.2, y: 0.2, z: -0.1 },
+leftHand: { x: 0, y: 0, z: 0 },
+rightHand: { x: 0.1, y: 0.2, z: 0 },
+duration: 1300
+}],
+
+explainLeft: [{
+leftArm: { x: 1.1, y: 0.3, z: 0.4 },
+rightArm: { x: 1.4, y: 0, z: 0 },
+leftForeArm: { x: 0.2, y: 0.2, z: 0.1 },
+rightForeArm: { x: 0, y: 0, z: 0 },
+leftHand: { x: 0.1, y: 0.2, z: 0 },
+rightHand: { x: 0, y: 0, z: 0 },
+duration: 1300
+}],
+
+presentLow: [{
+leftArm: { x: 0.8, y: 0.3, z: 0.3 },
+rightArm: { x: 0.8, y: 0.3, z: -0.3 },
+leftForeArm: { x: 0.2, y: 0.2, z: 0.1 },
+rightForeArm: { x: 0.2, y: 0.2, z: -0.1 },
+leftHand: { x: 0.1, y: 0.3, z: 0.1 },
+rightHand: { x: 0.1, y: 0.3, z: -0.1 },
+duration: 1400
+}],
+
+presentHigh: [{
+leftArm: { x: 1.0, y: 0.5, z: 0.4 },
+rightArm: { x: 1.0, y: 0.5, z: -0.4 },
+leftForeArm: { x: 0.4, y: 0.4, z: 0.2 },
+rightForeArm: { x: 0.4, y: 0.4, z: -0.2 },
+leftHand: { x: 0.3, y: 0.5, z: 0.1 },
+rightHand: { x: 0.3, y: 0.5, z: -0.1 },
+duration: 1400
+}]
+
+    };
+
+    const bones = [leftArm, rightArm, leftForeArm, rightForeArm, leftHand, rightHand];
+    if (bones.some(bone => !bone)) {
+        console.log('Could not find arm bones');
+        return;
+    }
+
+    // Poses as flat [x, y, z] rotations per bone, in `bones` order
+    const BONE_KEYS = ['leftArm', 'rightArm', 'leftForeArm', 'rightForeArm', 'leftHand', 'rightHand'];
+    function toPose(gesture) {
+        const pose = new Float32Array(BONE_KEYS.length * 3);
+        BONE_KEYS.forEach((key, i) => {
+            pose[i * 3] = gesture[key].x;
+            pose[i * 3 + 1] = gesture[key].y;
+            pose[i * 3 + 2] = gesture[key].z;
+        });
+        return pose;
+    }
+    const neutralPose = toPose(neutralPosition);
+    const gestureNames = Object.keys(gestureArrays);
+    const gesturePoses = {};
+    gestureNames.forEach(name => { gesturePoses[name] = toPose(gestureArrays[name][0]); });
+
+    let lastGestureTime = 0;
+    let currentGestureCategory = 'explaining';
+    let usedGestures = new Set();
+
+    function pickGesture(elapsed) {
+        const availableGestures = gestureNames.filter(gesture => !usedGestures.has(gesture));
+        
+        // If all gestures have been used, reset the used gestures set
+        if (availableGestures.length === 0) {
+            usedGestures.clear();
+            currentGestureCategory = gestureNames[Math.floor(Math.random() * gestureNames.length)];
+        } else {
+            // Select a random unused gesture
+            currentGestureCategory = availableGestures[Math.floor(Math.random() * availableGestures.length)];
+        }
+        
+        usedGestures.add(currentGestureCategory);
+        lastGestureTime = elapsed;
+        
+        // Update the animation display
+        const animationDisplay = document.getElementById('current-animation');
+        if (animationDisplay) {
+            animationDisplay.textContent = `Current Animation: ${currentGestureCategory}`;
+        }
+    }
+
+    function updateArmMovements(delta, elapsed) {
+        let pose = neutralPose;
+        if (isSpeaking) {
+            if (elapsed - lastGestureTime > 2) { // Change gesture every 2 seconds
+                pickGesture(elapsed);
+            }
+            pose = gesturePoses[currentGestureCategory];
+        }
+
+        const factor = smoothing(0.1, delta);
+        for (let i = 0; i < bones.length; i++) {
+            const rotation = bones[i].rotation;
+            rotation.x += (pose[i * 3] - rotation.x) * factor;
+            rotation.y += (pose[i * 3 + 1] - rotation.y) * factor;
+            rotation.z += (pose[i * 3 + 2] - rotation.z) * factor;
+        }
+    }
+
+    // Add to animation loop
+    animators.push(updateArmMovements);
+}
+
+// Update the voice input setup function
+function setupVoiceInput() {
+    const micButton = document.getElementById('mic-button');
+
+    // Speech recognition setup with error handling and logging
+    let recognition;
+    try {
+        const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
+        if (!SpeechRecognition) {
+            console.error('Speech Recognition API not supported in this browser');
+            micButton.innerHTML = 'Voice input not supported';
+            micButton.disabled = true;
+            return;
+        }
+        recognition = new SpeechRecognition();
+    } catch (e) {
+        console.error('Speech recognition error:', e);
+        micButton.innerHTML = 'Voice input error';
+        micButton.disabled = true;
+        return;
+    }
+
+    // Configure recognition settings: listen for as long as the button is
+    // held, with interim results so the session socket hears the user as
+    // they speak
+    recognition.continuous = true;
+    recognition.interimResults = true;
+    recognition.lang = 'hi-IN'; // Set to Hindi for Hindi recognition
+    
+    let isListening = false;
+    let currentTranscript = '';
+
+    recognition.onstart = () => {
+        console.log('Speech recognition started');
+        isListening = true;
+        micButton.style.backgroundColor = '#ff4444';
+        micButton.innerHTML = '🎤 Release to Send';
+    };
+
+    recognition.onend = () => {
+        console.log('Speech recognition ended');
+        isListening = false;
+        micButton.style.background = 'linear-gradient(135deg, #2563eb 0%, #3b82f6 100%)';
+        micButton.innerHTML = '🎤 Hold to Speak';
+    };
+
+    recognition.onresult = (event) => {
+        console.log('Speech recognition result received');
+        // Final results so far, then whatever is still being recognized
+        let finalText = '';
+        let interimText = '';
+        for (const result of event.results) {
+            if (result.isFinal) {
+                finalText += result[0].transcript;
+            } else {
+                interimText += result[0].transcript;
+            }
+        }
+        currentTranscript = finalText + interimText;
+
+        document.getElementById('user-input').value = currentTranscript;
+        if (voiceSession.open) {
+            voiceSession.transcript(currentTranscript, false);
+        }
+    };
+
+    recognition.onerror = (event) => {
+        console.error('Speech recognition error:', event.error);
+        stopListening();
+        micButton.style.background = 'linear-gradient(135deg, #2563eb 0%, #3b82f6 100%)';
+        micButton.innerHTML = '🎤 Hold to Speak';
+    };
+
+    function startListening() {
+        try {
+            if (!isListening) {
+                console.log('Starting speech recognition...');
+                if (audioQueue.playing) {
+                    interruptReply();
+                }
+                currentTranscript = '';
+                recognition.start();
+            }
+        } catch (e) {
+            console.error('Error starting speech recognition:', e);
+        }
+    }
+
+    function stopListening() {
+        try {
+            if (isListening) {
+                console.log('Stopping speech recognition...');
+                recognition.stop();
+                
+                if (currentTranscript.trim()) {
+                    console.log('Sending message:', currentTranscript);
+                    document.getElementById('user-input').value = currentTranscript;
+                    sendMessage();
+                    currentTranscript = '';
+                }
+            }
+        } catch (e) {
+            console.error('Error stopping speech recognition:', e);
+        }
+    }
+
+    // Mouse events
+    micButton.addEventListener('mousedown', (e) => {
+        e.preventDefault();
+        startListening();
+    });
+
+    micButton.addEventListener('mouseup', (e) => {
+        e.preventDefault();
+        stopListening();
+    });
+
+    micButton.addEventListener('mouseleave', (e) => {
+        e.preventDefault();
+        if (isListening) stopListening();
+    });
+
+    // Touch events for mobile
+    micButton.addEventListener('touchstart', (e) => {
+        e.preventDefault();
+        startListening();
+    });
+
+    micButton.addEventListener('touchend', (e) => {
+        e.preventDefault();
+        stopListening();
+    });
+}
+
+// Make sure to call setupVoiceInput after DOM is loaded
+document.addEventListener('DOMContentLoaded', () => {
+    setupVoiceInput();
+    voiceSession.connect();
+    console.log('Voice input setup completed');
+});
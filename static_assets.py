@@ -0,0 +1,133 @@
+"""Precompressed, fingerprinted static assets.
+
+Everything is read (or rendered) once at startup. Each asset keeps its raw
+bytes plus gzip and, when the brotli module is installed, brotli variants,
+together with a strong ETag per variant, so serving a hit is a dictionary
+lookup.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, request
+from werkzeug.http import parse_accept_header, parse_etags
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Don't bother compressing tiny bodies
+MIN_COMPRESS_SIZE = 512
+# Brotli's top quality takes seconds on a multi-megabyte model
+LARGE_BODY_SIZE = 1024 * 1024
+
+mimetypes.add_type('model/gltf-binary', '.glb')
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+class Asset:
+    def __init__(self, body, content_type, cache_control):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()
+
+        # encoding -> (body, etag)
+        self.variants = {"identity": (body, f'"{self.digest[:32]}"')}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.variants["gzip"] = (compressed, f'"{self.digest[:32]}-gz"')
+            if brotli is not None:
+                quality = 11 if len(body) < LARGE_BODY_SIZE else 9
+                compressed = brotli.compress(body, quality=quality)
+                if len(compressed) < len(body):
+                    self.variants["br"] = (compressed, f'"{self.digest[:32]}-br"')
+
+    def pick_encoding(self, accepted):
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accepted[encoding]:
+                return encoding
+        return "identity"
+
+    def negotiate(self, accept_encoding, if_none_match):
+        # Returns (status, body, headers) for the raw request header values,
+        # so any web framework can serve the asset
+        encoding = self.pick_encoding(parse_accept_header(accept_encoding))
+        body, etag = self.variants[encoding]
+
+        headers = {
+            "Cache-Control": self.cache_control,
+            "ETag": etag,
+            "Vary": "Accept-Encoding"
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        # If-None-Match compares weakly (RFC 9110 13.1.2): W/"..." from a
+        # proxy that re-encoded the body still matches
+        if parse_etags(if_none_match).contains_weak(etag.strip('"')):
+            return 304, b"", headers
+
+        headers["Content-Type"] = self.content_type
+        return 200, body, headers
+
+    def response(self):
+        status, body, headers = self.negotiate(
+            request.headers.get("Accept-Encoding"),
+            request.headers.get("If-None-Match")
+        )
+        return Response(body, status=status, headers=headers)
+
+
+class AssetRegistry:
+    def __init__(self, directory, url_prefix='/assets'):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self.urls = {}    # source name -> fingerprinted URL
+        self.assets = {}  # fingerprinted name -> Asset
+
+    def load(self, name, directory=None, prefix=''):
+        # Read static/<name> (or directory/<name>) and register it as
+        # prefix + name, under a content-hashed URL
+        with open(os.path.join(directory or self.directory, name), 'rb') as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type.endswith('javascript'):
+            content_type += '; charset=utf-8'
+        return self.add(prefix + name, body, content_type)
+
+    def add(self, name, body, content_type):
+        asset = Asset(body, content_type, IMMUTABLE)
+        stem, ext = os.path.splitext(name)
+        fingerprinted = f"{stem}.{asset.digest[:12]}{ext}"
+        self.assets[fingerprinted] = asset
+        self.urls[name] = f"{self.url_prefix}/{fingerprinted}"
+        return self.urls[name]
+
+    def load_all(self, directory=None, prefix=''):
+        directory = directory or self.directory
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                # Temp files of a writer still running, or one interrupted
+                if name.startswith('.') or name.endswith('.tmp'):
+                    continue
+                path = os.path.relpath(os.path.join(root, name), directory)
+                self.load(path.replace(os.sep, '/'), directory, prefix)
+
+    def url(self, name, fallback=None):
+        # fallback is returned for names that weren't loaded, if given
+        if fallback is not None:
+            return self.urls.get(name, fallback)
+        return self.urls[name]
+
+    def get(self, fingerprinted):
+        return self.assets.get(fingerprinted)
+
+
+def page(html):
+    # Rendered pages keep their URL, so they revalidate with the ETag instead
+    return Asset(html.encode('utf-8'), 'text/html; charset=utf-8', REVALIDATE)
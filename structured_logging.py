@@ -0,0 +1,131 @@
+"""Logging setup: JSON records, request IDs and sampling, off the request path.
+
+setup_logging() gives the root logger a QueueHandler. Request threads only
+put records on an in-memory queue; a QueueListener thread formats them and
+writes them to stdout. Tracebacks are formatted on that thread too. A
+process forked after setup (a gunicorn worker under preload_app) starts its
+own listener on the same queue, since the parent's thread isn't copied.
+
+Each record carries the ID of the request it was logged from (see
+request_id). Records logged with extra={"sampled": True} are the noisy
+per-request lines: only a LOG_SAMPLE_RATE fraction of those is kept, and
+only below WARNING.
+
+Environment:
+    LOG_LEVEL        DEBUG, INFO (default), WARNING, ...
+    LOG_FORMAT       json (default) or text
+    LOG_SAMPLE_RATE  fraction of sampled records kept, default 0.1
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+# ID of the request being handled, set by the app for every request
+request_id = contextvars.ContextVar("request_id", default=None)
+
+# LogRecord attributes that aren't extras passed by the caller
+STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "request_id", "sampled"
+}
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    # Runs on the thread that logs, before the record is queued, so the
+    # context variable is still the request's
+    def filter(self, record):
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False) or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) +
+                  f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for name, value in vars(record).items():
+            if name not in STANDARD_ATTRS and not name.startswith("_"):
+                entry[name] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler.prepare() formats the whole record, traceback included,
+    # on the calling thread. This only merges the message arguments and
+    # leaves the rest to the listener's formatter.
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(level=None):
+    # Idempotent: the first call configures the root logger
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    if os.getenv("LOG_FORMAT", "json") == "text":
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+    else:
+        formatter = JSONFormatter()
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(SamplingFilter(float(os.getenv("LOG_SAMPLE_RATE", 0.1))))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(_stop_listener)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_restart_listener)
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def _restart_listener():
+    # Runs in a forked child, where only the forking thread survives
+    global _listener
+    _listener = logging.handlers.QueueListener(
+        _listener.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
@@ -0,0 +1,52 @@
+from admission import ClientRateLimit, RateLimiter
+
+
+def test_bucket_allows_burst_then_limits():
+    limiter = RateLimiter(rate=1, burst=3)
+    assert [limiter.take("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.take("a") == 1
+    # Another client has its own bucket
+    assert limiter.take("b") == 0
+
+
+def test_zero_rate_turns_the_limit_off():
+    limiter = RateLimiter(rate=0, burst=0)
+    assert not limiter.enabled
+    assert all(limiter.take("a") == 0 for _ in range(100))
+
+
+def test_forgotten_clients_come_back_full():
+    limiter = RateLimiter(rate=0.001, burst=1, max_clients=2)
+    limiter.take("a")
+    limiter.take("b")
+    limiter.take("c")
+    assert limiter.stats()["clients"] == 2
+    assert limiter.take("a") == 0
+
+
+def test_new_session_ids_do_not_reset_the_address_bucket():
+    limit = ClientRateLimit(rate=20 / 60, burst=5)
+    # A client dropping its cookie shows up with a fresh id every time
+    waits = [limit.take(f"sid-{i}", "10.0.0.1") for i in range(30)]
+    assert waits[:5] == [0] * 5
+    assert all(wait > 0 for wait in waits[5:])
+    stats = limit.stats()
+    assert stats["allowed"] == 5
+    assert stats["limited"] == 25
+
+
+def test_requests_without_a_session_are_charged_to_the_address():
+    limit = ClientRateLimit(rate=1 / 60, burst=2)
+    assert [limit.take(None, "10.0.0.1") for _ in range(3)][-1] > 0
+    assert limit.take(None, "10.0.0.2") == 0
+
+
+def test_session_bucket_applies_on_top_of_a_shared_address():
+    limit = ClientRateLimit(rate=1 / 60, burst=2, address_share=10)
+    # Behind one NAT: each conversation gets its own burst...
+    assert [limit.take("a", "nat") for _ in range(3)] == [0, 0, 60]
+    assert [limit.take("b", "nat") for _ in range(2)] == [0, 0]
+    # ...until the address's larger allowance runs out
+    for i in range(20):
+        limit.take(f"other-{i}", "nat")
+    assert limit.take("c", "nat") > 0
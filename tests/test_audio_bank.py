@@ -0,0 +1,87 @@
+import os
+import threading
+
+from audio_bank import AudioBank, write_file
+
+
+def test_concurrent_writers_of_one_file_never_collide(tmp_path):
+    path = str(tmp_path / "clip.audio")
+    payloads = [bytes([i]) * 100000 for i in range(16)]
+    errors = []
+
+    def writer(data):
+        try:
+            for _ in range(20):
+                write_file(path, data)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(data,)) for data in payloads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with open(path, "rb") as f:
+        assert f.read() in payloads
+    # No temp files left behind
+    assert os.listdir(tmp_path) == ["clip.audio"]
+
+
+def test_concurrent_writer_processes(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    children = []
+    for i in range(8):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for _ in range(50):
+                    write_file(path, str(i).encode() * 1000)
+            finally:
+                os._exit(0 if os.path.exists(path) else 1)
+        children.append(pid)
+    for pid in children:
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+    assert os.listdir(tmp_path) == ["manifest.json"]
+
+
+def test_banks_sharing_a_directory_keep_each_others_entries(tmp_path):
+    first = AudioBank(str(tmp_path))
+    second = AudioBank(str(tmp_path))
+    first.add("a", "filler", "हम्म…", b"AAA")
+    second.add("b", "greeting", "नमस्ते", b"BBB")
+
+    reloaded = AudioBank(str(tmp_path))
+    assert set(reloaded.clips) == {"a", "b"}
+    assert reloaded.get("a").audio == b"AAA"
+    assert reloaded.get("b").text == "नमस्ते"
+    assert reloaded.stats()["hits"] == 2
+
+
+def test_build_lock_lets_one_of_several_processes_build(tmp_path):
+    # What app.build_audio_bank does in each worker after the fork
+    directory = str(tmp_path / "bank")
+    built = tmp_path / "built"
+    children = []
+    for i in range(8):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                bank = AudioBank(directory)
+                with bank.build_lock():
+                    bank.load()
+                    if "hello" not in bank:
+                        with open(built, "a") as f:
+                            f.write(f"{i}\n")
+                        bank.add("hello", "greeting", "नमस्ते", b"clip")
+                code = 0 if bank.get("hello") is not None else 1
+            finally:
+                os._exit(code)
+        children.append(pid)
+    for pid in children:
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+    assert len(built.read_text().splitlines()) == 1
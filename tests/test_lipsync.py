@@ -0,0 +1,46 @@
+import base64
+
+import pytest
+
+import lipsync
+
+pytest.importorskip("numpy")
+
+
+def amplitude(timeline):
+    return list(base64.b64decode(timeline["amplitude"]))
+
+
+def test_alignment_places_visemes_on_their_frames():
+    timeline = lipsync.from_alignment({
+        "characters": ["m", "a", " "],
+        "character_start_times_seconds": [0.0, 0.04, 0.08],
+        "character_end_times_seconds": [0.04, 0.08, 0.12]
+    }, duration=0.2)
+    assert timeline["frame_ms"] == lipsync.FRAME_MS
+    assert timeline["visemes"] == "MAXXX"
+    levels = amplitude(timeline)
+    assert len(levels) == 5
+    # The open vowel is the widest frame; smoothing spreads it to its neighbours
+    assert levels[1] == max(levels) and levels[0] > 0 and levels[4] == 0
+
+
+def test_estimate_spreads_the_text_over_the_clip():
+    timeline = lipsync.estimate("नमस्ते", 0.5)
+    assert len(timeline["visemes"]) == len(amplitude(timeline)) == 13
+    assert set(timeline["visemes"]) <= set(lipsync.VISEMES)
+    assert "M" in timeline["visemes"] and "E" in timeline["visemes"]
+
+
+def test_viseme_classes():
+    assert [lipsync.viseme(ch) for ch in "आपवक ,"] == ["A", "M", "F", "C", "X", "X"]
+
+
+@pytest.mark.parametrize("call", [
+    lambda: lipsync.from_alignment(None),
+    lambda: lipsync.from_alignment({"characters": []}),
+    lambda: lipsync.estimate("", 1.0),
+    lambda: lipsync.estimate("text", 0),
+])
+def test_nothing_to_build_is_none(call):
+    assert call() is None
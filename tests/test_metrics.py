@@ -0,0 +1,12 @@
+from metrics import Registry, stats_metrics
+
+
+def test_running_totals_are_counters_and_the_rest_gauges():
+    registry = Registry()
+    registry.add_collector(lambda: stats_metrics(
+        "cache", {"entries": 3, "hits": 7, "misses": 2, "ready": True}, ("hits", "misses")))
+    text = registry.render()
+    assert "# TYPE cache_entries gauge\ncache_entries 3\n" in text
+    assert "# TYPE cache_hits_total counter\ncache_hits_total 7\n" in text
+    assert "# TYPE cache_misses_total counter\ncache_misses_total 2\n" in text
+    assert "ready" not in text
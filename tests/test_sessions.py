@@ -0,0 +1,36 @@
+import threading
+
+from sessions import SessionStore
+
+
+def test_reads_alone_keep_the_store_within_max_sessions():
+    store = SessionStore(max_sessions=3)
+    for number in range(10):
+        assert store.history(f"sid-{number}", 1000) == ""
+    assert store.stats()["sessions"] == 3
+    assert list(store.sessions) == ["sid-7", "sid-8", "sid-9"]
+    assert store.stats()["evictions"] == 7
+
+
+def test_summary_of_an_evicted_session_leaves_its_successor_alone():
+    started = threading.Event()
+    release = threading.Event()
+
+    def summarize(summary, text):
+        started.set()
+        release.wait(5)
+        return "a long summary " * 20
+
+    store = SessionStore(summarize=summarize, max_turns=1, max_sessions=1)
+    store.add_turn("sid", "first question", "first answer")
+    store.add_turn("sid", "second question", "second answer")
+    started.wait(5)
+    # Evicted while its summary is being written, then a new session under
+    # the same id
+    store.history("other", 1000)
+    store.add_turn("sid", "new question", "new answer")
+    release.set()
+    store.executor.shutdown(wait=True)
+
+    assert store.sessions["sid"].summary == ""
+    assert store.total_bytes == sum(session.size for session in store.sessions.values())
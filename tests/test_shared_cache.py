@@ -0,0 +1,87 @@
+import os
+import socket
+import time
+
+import pytest
+
+import shared_cache
+from bench import fake_redis
+from shared_cache import RedisBackend, SQLiteBackend, open_backend
+
+
+@pytest.fixture
+def redis_server():
+    server = fake_redis.serve()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_sqlite_round_trip_and_ttl(tmp_path):
+    cache = SQLiteBackend(str(tmp_path / "shared.db"))
+    assert cache.get("missing") is None
+    cache.set("clip", b"\x00audio")
+    cache.set("reply", b"short lived", ttl=0.05)
+    assert cache.get("clip") == b"\x00audio"
+    assert cache.get("reply") == b"short lived"
+    time.sleep(0.1)
+    assert cache.get("reply") is None
+    assert cache.stats() == {"hits": 2, "misses": 2, "writes": 2, "errors": 0}
+
+
+def test_sqlite_is_shared_with_a_forked_worker(tmp_path):
+    cache = SQLiteBackend(str(tmp_path / "shared.db"))
+    cache.get("warm")  # a connection the child must not reuse
+    pid = os.fork()
+    if pid == 0:
+        try:
+            cache.set("from-child", b"hello")
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert cache.get("from-child") == b"hello"
+
+
+def test_sqlite_trims_the_least_recently_used(tmp_path, monkeypatch):
+    # Trims on the first put and every second one after it
+    monkeypatch.setattr(shared_cache, "TRIM_EVERY", 2)
+    cache = SQLiteBackend(str(tmp_path / "shared.db"), max_bytes=250)
+    for name in ("a", "b", "c"):
+        cache.set(name, b"x" * 100)
+        time.sleep(0.01)
+    assert cache.get("a") is None
+    assert cache.get("b") == cache.get("c") == b"x" * 100
+
+
+def test_redis_round_trip_with_password_and_db(redis_server):
+    port = redis_server.server_address[1]
+    protected = fake_redis.serve(password="secret")
+    try:
+        cache = open_backend(f"redis://:secret@127.0.0.1:{protected.server_address[1]}/2")
+        cache.set("clip", b"\r\nbinary\x00")
+        cache.set("reply", b"soon gone", ttl=0.05)
+        assert cache.get("clip") == b"\r\nbinary\x00"
+        time.sleep(0.1)
+        assert cache.get("reply") is None
+        # Another database on the same server doesn't see it
+        assert open_backend(f"redis://:secret@127.0.0.1:{protected.server_address[1]}/0").get("clip") is None
+    finally:
+        protected.shutdown()
+        protected.server_close()
+    assert RedisBackend(port=port).get("clip") is None
+
+
+def test_a_backend_that_is_down_is_a_miss():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    cache = RedisBackend(port=port, timeout=0.2)
+    cache.set("clip", b"audio")
+    assert cache.get("clip") is None
+    assert cache.stats()["errors"] == 2
+
+
+def test_unknown_urls_are_refused():
+    assert open_backend("") is None
+    with pytest.raises(ValueError):
+        open_backend("memcached://127.0.0.1")
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test")
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(True)
+        release.wait(5)
+        return "reply"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", fetch)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flight.stats()["coalesced"] < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ["reply"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"leaders": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_followers_get_the_leaders_error_and_the_key_is_freed():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("upstream down")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", fail)
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while flight.stats()["coalesced"] < 1:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert errors == ["upstream down"] * 2
+    assert flight.do("key", lambda: "again") == "again"
+
+
+def test_a_late_reader_replays_the_stream_from_the_start():
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def produce():
+        yield "one "
+        release.wait(5)
+        yield "two"
+
+    first = flight.stream("key", produce)
+    assert first.wait_started() is None
+    second = flight.stream("key", produce)
+    release.set()
+    assert "".join(first) == "one two"
+    assert "".join(second) == "one two"
+    assert flight.stats()["leaders"] == 1
+
+
+def test_async_callers_share_one_task_that_outlives_a_cancelled_leader():
+    async def run():
+        flight = SingleFlight("test")
+        calls = []
+
+        async def fetch():
+            calls.append(True)
+            await asyncio.sleep(0.05)
+            return "reply"
+
+        leader = asyncio.ensure_future(flight.do_async("key", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do_async("key", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == "reply"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert len(calls) == 1
+
+    asyncio.run(run())
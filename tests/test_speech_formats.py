@@ -0,0 +1,50 @@
+import pytest
+
+import speech_formats
+from speech_formats import FORMATS, negotiate
+
+SERVER = speech_formats.defaults("mp3_44100_128", "eleven_multilingual_v2", 0)
+
+
+def test_defaults_when_nothing_is_asked_for():
+    assert negotiate(SERVER, {}) == SERVER
+    assert negotiate(SERVER, {"format": "", "bitrate": "", "model": "", "latency": ""}) == SERVER
+
+
+def test_codec_bitrate_and_latency():
+    options = negotiate(SERVER, {"format": "opus", "bitrate": 70, "latency": "3"})
+    assert options.format == FORMATS["opus_48000_64"]
+    assert options.latency == 3
+    assert negotiate(SERVER, {"format": "mp3_22050_32"}).format == FORMATS["mp3_22050_32"]
+
+
+def test_accept_picks_a_codec_the_client_can_play():
+    assert negotiate(SERVER, {"accept": "audio/ogg"}).format.codec == "opus"
+    assert negotiate(SERVER, {"accept": ["audio/pcm"]}).format.codec == "pcm"
+    assert negotiate(SERVER, {}, "audio/ogg").format.codec == "opus"
+
+
+@pytest.mark.parametrize("params", [
+    {"format": ["mp3"]},
+    {"format": {"codec": "mp3"}},
+    {"format": 128},
+    {"format": True},
+    {"format": "wav"},
+    {"bitrate": ["64"]},
+    {"bitrate": {"kbps": 64}},
+    {"bitrate": True},
+    {"bitrate": "fast"},
+    {"bitrate": "nan"},
+    {"bitrate": "inf"},
+    {"accept": {"audio/ogg": 1}},
+    {"accept": [["audio/ogg"]]},
+    {"model": ["eleven_turbo_v2_5"]},
+    {"model": "gpt"},
+    {"latency": [1]},
+    {"latency": 1.5},
+    {"latency": "high"},
+    {"latency": 9},
+])
+def test_bad_values_are_value_errors(params):
+    with pytest.raises(ValueError):
+        negotiate(SERVER, params)
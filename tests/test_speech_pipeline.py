@@ -0,0 +1,67 @@
+import asyncio
+import queue
+import threading
+
+from speech_pipeline import AsyncSpeechPipeline, SentenceSplitter, SpeechPipeline
+
+
+def test_splitter_keeps_decimals_and_flushes_the_rest():
+    splitter = SentenceSplitter()
+    assert splitter.feed("पहला वाक्य। दाम 3.5 रुपये") == ["पहला वाक्य।"]
+    assert splitter.feed(" है? और") == ["दाम 3.5 रुपये है?"]
+    assert splitter.flush() == ["और"]
+
+
+def test_on_done_reports_each_sentence_as_it_finishes():
+    release = threading.Event()
+    done = queue.Queue()
+
+    def synthesize(sentence):
+        if sentence == "दूसरा।":
+            release.wait(5)
+        return sentence.encode("utf-8")
+
+    pipeline = SpeechPipeline(synthesize, on_done=lambda: done.put(True))
+    pipeline.feed("पहला। दूसरा। ")
+    # The first sentence is ready while the second is still being synthesized
+    done.get(timeout=5)
+    assert [segment["text"] for segment in pipeline.ready()] == ["पहला।"]
+    release.set()
+    done.get(timeout=5)
+    assert [segment["text"] for segment in pipeline.ready()] == ["दूसरा।"]
+    assert list(pipeline.finish()) == []
+
+
+def test_segments_stay_in_order_and_carry_errors():
+    def synthesize(sentence):
+        if sentence == "दो।":
+            raise ValueError("bad")
+        return b"x"
+
+    pipeline = SpeechPipeline(synthesize)
+    pipeline.feed("एक। दो। तीन")
+    segments = list(pipeline.finish())
+    assert [segment["index"] for segment in segments] == [0, 1, 2]
+    assert segments[1]["error"] == "bad"
+    assert segments[2]["audio"] == b"x"
+
+
+def test_async_on_done_reports_each_sentence_as_it_finishes():
+    async def run():
+        release = asyncio.Event()
+        done = asyncio.Queue()
+
+        async def synthesize(sentence):
+            if sentence == "दूसरा।":
+                await release.wait()
+            return sentence.encode("utf-8")
+
+        pipeline = AsyncSpeechPipeline(synthesize, on_done=lambda: done.put_nowait(True))
+        pipeline.feed("पहला। दूसरा। ")
+        await asyncio.wait_for(done.get(), 5)
+        assert [segment["text"] for segment in pipeline.ready()] == ["पहला।"]
+        release.set()
+        await asyncio.wait_for(done.get(), 5)
+        assert [segment["text"] for segment in pipeline.ready()] == ["दूसरा।"]
+
+    asyncio.run(run())
@@ -0,0 +1,35 @@
+import pytest
+
+from static_assets import REVALIDATE, Asset, AssetRegistry
+
+
+@pytest.fixture
+def asset():
+    return Asset(b"body { color: red; }\n" * 100, "text/css", REVALIDATE)
+
+
+def test_matching_etags_get_a_304(asset):
+    status, body, headers = asset.negotiate("gzip", None)
+    assert status == 200 and headers["Content-Encoding"] == "gzip"
+    etag = headers["ETag"]
+    for if_none_match in (etag, f"W/{etag}", f'"other", W/{etag}', "*"):
+        status, body, _ = asset.negotiate("gzip", if_none_match)
+        assert (status, body) == (304, b"")
+
+
+def test_other_etags_get_the_body(asset):
+    _, _, headers = asset.negotiate(None, None)
+    status, body, _ = asset.negotiate("gzip", headers["ETag"])
+    # The identity variant's ETag doesn't match the gzip variant
+    assert status == 200 and body
+    status, _, _ = asset.negotiate("gzip", 'W/"other"')
+    assert status == 200
+
+
+def test_load_all_skips_temp_files(tmp_path):
+    (tmp_path / "avatar.glb").write_bytes(b"glTF")
+    (tmp_path / "avatar.glb.tmp").write_bytes(b"half")
+    (tmp_path / ".tmp-x1y2z3").write_bytes(b"half")
+    registry = AssetRegistry(str(tmp_path))
+    registry.load_all(prefix="vendor/")
+    assert list(registry.urls) == ["vendor/avatar.glb"]
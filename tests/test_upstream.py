@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from upstream import AsyncConcurrencyLimit, ConcurrencyLimit, UpstreamBusyError, UpstreamClient
+
+
+def test_full_queue_turns_callers_away_at_once():
+    limit = ConcurrencyLimit("test", 1, max_queue=0, max_wait=5)
+    token = limit.acquire()
+    start = time.perf_counter()
+    with pytest.raises(UpstreamBusyError) as error:
+        limit.acquire()
+    assert time.perf_counter() - start < 1
+    assert error.value.retry_after >= 1
+    assert limit.stats()["rejected"]["queue_full"] == 1
+    limit.release(token)
+    limit.release(limit.acquire())
+
+
+def test_waiter_gets_the_slot_when_it_is_released():
+    limit = ConcurrencyLimit("test", 1, max_queue=1, max_wait=5)
+    token = limit.acquire()
+    got = []
+
+    def waiter():
+        with limit.slot():
+            got.append(True)
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.05)
+    assert limit.stats()["waiting"] == 1
+    limit.release(token)
+    thread.join(5)
+    assert got == [True]
+    assert limit.stats()["in_flight"] == 0
+
+
+def test_wait_longer_than_max_wait_times_out():
+    limit = ConcurrencyLimit("test", 1, max_queue=1, max_wait=0.1)
+    token = limit.acquire()
+    with pytest.raises(UpstreamBusyError):
+        limit.acquire()
+    assert limit.stats()["rejected"]["timeout"] == 1
+    limit.release(token)
+
+
+def test_expected_wait_past_the_deadline_is_rejected_without_waiting():
+    limit = ConcurrencyLimit("test", 1, max_queue=5, max_wait=0.5)
+    limit.hold_time = 10
+    token = limit.acquire()
+    with pytest.raises(UpstreamBusyError) as error:
+        limit.acquire()
+    assert error.value.retry_after >= 10
+    assert limit.stats()["rejected"]["deadline"] == 1
+    limit.release(token)
+
+
+def test_check_raises_only_when_acquire_would_be_refused():
+    limit = ConcurrencyLimit("test", 1, max_queue=0)
+    limit.check()
+    token = limit.acquire()
+    with pytest.raises(UpstreamBusyError):
+        limit.check()
+    limit.release(token)
+
+
+def test_async_limit_hands_the_slot_to_a_waiter():
+    async def run():
+        limit = AsyncConcurrencyLimit("test", 1, max_queue=1, max_wait=5)
+        token = await limit.acquire()
+
+        async def waiter():
+            async with limit.slot():
+                return "got"
+
+        task = asyncio.ensure_future(waiter())
+        await asyncio.sleep(0.05)
+        with pytest.raises(UpstreamBusyError):
+            # The one place in line is taken
+            await limit.acquire()
+        limit.release(token)
+        return await task
+
+    assert asyncio.run(run()) == "got"
+
+
+def test_client_over_its_cap_raises_busy_without_calling_upstream():
+    # Nothing listens on the discard port; a real call would fail to connect
+    client = UpstreamClient("http://127.0.0.1:9", max_in_flight=1, max_queue=0, name="test")
+    token = client.slots.acquire()
+    with pytest.raises(UpstreamBusyError):
+        client.post("/anything")
+    client.slots.release(token)
+    assert client.stats()["rejected"]["queue_full"] == 1
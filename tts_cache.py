@@ -0,0 +1,226 @@
+"""Content-addressed cache for synthesized speech.
+
+Entries are keyed by a hash of everything that changes the audio (normalized
+text, voice, model, voice settings, output format and latency tier). Recently
+used clips stay in a size-bounded in-memory LRU; every clip is also written to
+a disk directory that is trimmed to a byte budget, oldest first.
+
+With a shared backend (see shared_cache), clips missing from this process
+are looked up there too, under "<namespace>:<key>", and every clip stored
+here is stored there, so worker processes on one host share their clips.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    # Same words, same audio: fold Unicode forms and whitespace
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def cache_key(text, voice_id, model_id, voice_settings, output_format, latency=0):
+    fields = {
+        "text": normalize_text(text),
+        "voice_id": voice_id,
+        "model_id": model_id,
+        "voice_settings": voice_settings,
+        "output_format": output_format
+    }
+    if latency:
+        # The top tiers skip text normalization, so the audio can differ.
+        # Tier 0 leaves the key as it was before tiers existed.
+        fields["latency"] = latency
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    def __init__(self, directory, memory_max_bytes=32 * 1024 * 1024,
+                 disk_max_bytes=512 * 1024 * 1024, shared=None, namespace="tts"):
+        self.directory = directory
+        self.shared = shared
+        self.namespace = namespace
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.lock = threading.Lock()
+
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+
+        # key -> size on disk, least recently used first
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_disk_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_disk_index(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith('.'):
+                    # Leftover temp file from an interrupted write
+                    try:
+                        os.remove(os.path.join(root, name))
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_bytes += size
+        self._remove_files(self._evict_disk())
+
+    def get(self, key):
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+
+            if key in self.disk:
+                self.disk.move_to_end(key)
+        if not self.directory:
+            return self._get_shared(key)
+
+        # A key missing from the index may still have a file, written since
+        # startup by another process (a sibling worker, python -m prerender)
+        try:
+            path = self._path(key)
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Keep the file's age in step with its use across restarts
+            now = time.time()
+            os.utime(path, (now, now))
+        except OSError:
+            with self.lock:
+                self.disk_bytes -= self.disk.pop(key, 0)
+            return self._get_shared(key)
+
+        evicted = []
+        with self.lock:
+            if key not in self.disk:
+                self.disk[key] = len(data)
+                self.disk_bytes += len(data)
+                evicted = self._evict_disk()
+            self.disk_hits += 1
+            self._remember(key, data)
+        self._remove_files(evicted)
+        return data
+
+    def _get_shared(self, key):
+        # Called without the lock held: the backend may be across a socket
+        data = self.shared.get(f"{self.namespace}:{key}") if self.shared is not None else None
+        with self.lock:
+            if not data:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        if not data:
+            return
+        with self.lock:
+            self._remember(key, data)
+        if self.shared is not None:
+            self.shared.set(f"{self.namespace}:{key}", data)
+
+        if not self.directory:
+            return
+        try:
+            self._write_file(key, data)
+        except OSError as e:
+            logger.warning("Could not write TTS cache entry %s: %s", key, e)
+            return
+
+        with self.lock:
+            self.disk_bytes -= self.disk.pop(key, 0)
+            self.disk[key] = len(data)
+            self.disk_bytes += len(data)
+            evicted = self._evict_disk()
+        self._remove_files(evicted)
+
+    def _write_file(self, key, data):
+        # Write to a temp file in the same directory and rename it into
+        # place, so readers never see a half-written clip
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _remember(self, key, data):
+        # Caller holds the lock
+        if len(data) > self.memory_max_bytes:
+            return
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.memory_max_bytes:
+            _, old = self.memory.popitem(last=False)
+            self.memory_bytes -= len(old)
+
+    def _evict_disk(self):
+        # Caller holds the lock; returns the keys whose files should go
+        evicted = []
+        while self.disk_bytes > self.disk_max_bytes and self.disk:
+            key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            evicted.append(key)
+        return evicted
+
+    def _remove_files(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,426 @@
+"""Shared HTTP client for upstream APIs.
+
+One UpstreamClient per upstream host keeps a pool of keep-alive connections,
+applies connect/read timeouts, retries 429/5xx answers with jittered
+backoff, caps the number of calls in flight and records per-call latency.
+AsyncUpstreamClient does the same on httpx for the ASGI server.
+
+The cap is a ConcurrencyLimit, which can also guard upstreams called
+through their own SDK (Gemini): callers over the limit wait in a bounded
+line and are turned away at once, with a Retry-After estimate, when the
+line is full or the wait would outlast its deadline.
+"""
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # only needed by AsyncUpstreamClient
+    httpx = None
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamBusyError(requests.RequestException):
+    """Raised when a call can't get an in-flight slot: the wait line is full,
+    the expected wait is longer than allowed, or no slot freed up in time.
+    retry_after is a whole number of seconds to wait before trying again."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimit:
+    # At most limit slots held at once. A caller that can't have one right
+    # away waits in line for up to max_wait seconds, unless max_queue
+    # callers are already waiting or the wait it can expect (from how long
+    # slots have recently been held) is longer than max_wait.
+    def __init__(self, name, limit, max_queue=None, max_wait=5.0):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue if max_queue is not None else 2 * limit
+        self.max_wait = max_wait
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.hold_time = None  # moving average, seconds
+        self.rejected = {"queue_full": 0, "deadline": 0, "timeout": 0}
+
+    def _expected_wait(self, position):
+        # Until the position-th caller in line gets a slot
+        return (self.hold_time or 0) * position / self.limit
+
+    def _reject(self, reason, wait):
+        self.rejected[reason] += 1
+        retry_after = max(1, math.ceil(wait))
+        return UpstreamBusyError(f"Too many requests in flight to {self.name} ({reason})", retry_after)
+
+    def _admit(self):
+        # None if a slot is free now, otherwise how long to wait for one;
+        # raises UpstreamBusyError if the caller shouldn't wait at all
+        if self.in_flight < self.limit and not self.waiting:
+            return None
+        if self.waiting >= self.max_queue:
+            raise self._reject("queue_full", self._expected_wait(self.waiting + 1))
+        expected = self._expected_wait(self.waiting + 1)
+        if expected > self.max_wait:
+            raise self._reject("deadline", expected)
+        return self.max_wait
+
+    def _released(self, start):
+        held = time.perf_counter() - start
+        self.hold_time = held if self.hold_time is None else 0.8 * self.hold_time + 0.2 * held
+        self.in_flight -= 1
+
+    def check(self):
+        # Raises UpstreamBusyError now if acquire() would turn the caller
+        # away without waiting
+        with self.cond:
+            self._admit()
+
+    def acquire(self):
+        # Returns a token for release()
+        with self.cond:
+            wait = self._admit()
+            if wait is not None:
+                self.waiting += 1
+                try:
+                    free = self.cond.wait_for(lambda: self.in_flight < self.limit, wait)
+                finally:
+                    self.waiting -= 1
+                if not free:
+                    raise self._reject("timeout", self._expected_wait(self.waiting + 1))
+            self.in_flight += 1
+        return time.perf_counter()
+
+    def release(self, token):
+        with self.cond:
+            self._released(token)
+            self.cond.notify()
+
+    @contextmanager
+    def slot(self):
+        token = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "rejected": dict(self.rejected)
+            }
+
+
+class AsyncConcurrencyLimit(ConcurrencyLimit):
+    # The same limit for one event loop; only the waiting differs
+    def __init__(self, name, limit, max_queue=None, max_wait=5.0):
+        super().__init__(name, limit, max_queue, max_wait)
+        self.freed = asyncio.Event()
+
+    async def acquire(self):
+        wait = self._admit()
+        if wait is not None:
+            deadline = time.perf_counter() + wait
+            self.waiting += 1
+            try:
+                while self.in_flight >= self.limit:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise self._reject("timeout", self._expected_wait(self.waiting))
+                    freed = self.freed
+                    try:
+                        await asyncio.wait_for(freed.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting -= 1
+        self.in_flight += 1
+        return time.perf_counter()
+
+    def release(self, token):
+        self._released(token)
+        # Wake the waiters; later ones wait on a fresh event
+        self.freed.set()
+        self.freed = asyncio.Event()
+
+    @asynccontextmanager
+    async def slot(self):
+        token = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(token)
+
+
+def backoff_delay(backoff, attempt, retry_after=None):
+    if retry_after:
+        try:
+            return min(float(retry_after), 10.0)
+        except ValueError:
+            pass
+    # Exponential backoff with jitter around the nominal delay
+    return backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+class LatencyStats:
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        with self.lock:
+            self.recent.append(seconds)
+            self.count += 1
+            self.total += seconds
+
+    def snapshot(self):
+        with self.lock:
+            recent = sorted(self.recent)
+            count, total = self.count, self.total
+
+        def percentile(p):
+            if not recent:
+                return None
+            return recent[min(len(recent) - 1, int(p * len(recent)))]
+
+        return {
+            "count": count,
+            "mean": total / count if count else None,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99)
+        }
+
+
+class UpstreamClient:
+    def __init__(self, base_url, pool_size=10, max_in_flight=10,
+                 connect_timeout=3.05, read_timeout=30, retries=2,
+                 backoff=0.25, queue_timeout=None, max_queue=None, name=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        queue_timeout = queue_timeout if queue_timeout is not None else read_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.slots = ConcurrencyLimit(name or self.base_url, max_in_flight, max_queue, queue_timeout)
+        self.lock = threading.Lock()
+        self.errors = 0
+        self.retried = 0
+        self.latency = LatencyStats()
+
+    def url(self, path):
+        return self.base_url + path
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def request(self, method, path, stream=False, **kwargs):
+        # With stream=True the in-flight slot is held until the caller
+        # closes the response
+        kwargs.setdefault('timeout', self.timeout)
+        token = self.slots.acquire()
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self.slots.release(token)
+
+        try:
+            response = self._send(method, path, stream=stream, **kwargs)
+        except BaseException:
+            release()
+            raise
+
+        if stream:
+            close = response.close
+
+            def close_and_release():
+                try:
+                    close()
+                finally:
+                    release()
+
+            response.close = close_and_release
+        else:
+            release()
+        return response
+
+    def _send(self, method, path, **kwargs):
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, self.url(path), **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._count_error()
+                if attempt >= self.retries:
+                    raise
+                delay = backoff_delay(self.backoff, attempt)
+            else:
+                # For streamed responses this is the time to the headers
+                self.latency.record(time.perf_counter() - start)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                self._count_error()
+                if attempt >= self.retries:
+                    return response
+                delay = backoff_delay(self.backoff, attempt, response.headers.get('Retry-After'))
+                response.close()
+
+            attempt += 1
+            with self.lock:
+                self.retried += 1
+            time.sleep(delay)
+
+    def _count_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def stats(self):
+        slots = self.slots.stats()
+        with self.lock:
+            stats = {
+                "in_flight": slots["in_flight"],
+                "waiting": slots["waiting"],
+                "rejected": slots["rejected"],
+                "errors": self.errors,
+                "retries": self.retried
+            }
+        stats["latency"] = self.latency.snapshot()
+        return stats
+
+
+class AsyncUpstreamClient:
+    def __init__(self, base_url, pool_size=100, max_in_flight=100,
+                 connect_timeout=3.05, read_timeout=30, retries=2,
+                 backoff=0.25, queue_timeout=None, max_queue=None, name=None):
+        if httpx is None:
+            raise RuntimeError("httpx is required for the async upstream client")
+        self.base_url = base_url.rstrip('/')
+        self.retries = retries
+        self.backoff = backoff
+        queue_timeout = queue_timeout if queue_timeout is not None else read_timeout
+
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+
+        self.slots = AsyncConcurrencyLimit(name or self.base_url, max_in_flight, max_queue,
+                                           queue_timeout)
+        self.lock = threading.Lock()
+        self.errors = 0
+        self.retried = 0
+        self.latency = LatencyStats()
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def request(self, method, path, stream=False, **kwargs):
+        # With stream=True the in-flight slot is held until the caller
+        # calls aclose() on the response
+        token = await self.slots.acquire()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.slots.release(token)
+
+        try:
+            response = await self._send(method, path, stream, **kwargs)
+        except BaseException:
+            release()
+            raise
+
+        if stream:
+            aclose = response.aclose
+
+            async def aclose_and_release():
+                try:
+                    await aclose()
+                finally:
+                    release()
+
+            response.aclose = aclose_and_release
+        else:
+            release()
+        return response
+
+    async def _send(self, method, path, stream, **kwargs):
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                request = self.client.build_request(method, path, **kwargs)
+                response = await self.client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.TimeoutException):
+                self._count_error()
+                if attempt >= self.retries:
+                    raise
+                delay = backoff_delay(self.backoff, attempt)
+            else:
+                self.latency.record(time.perf_counter() - start)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                self._count_error()
+                if attempt >= self.retries:
+                    return response
+                delay = backoff_delay(self.backoff, attempt, response.headers.get('Retry-After'))
+                await response.aclose()
+
+            attempt += 1
+            with self.lock:
+                self.retried += 1
+            await asyncio.sleep(delay)
+
+    def _count_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def stats(self):
+        slots = self.slots.stats()
+        with self.lock:
+            stats = {
+                "in_flight": slots["in_flight"],
+                "waiting": slots["waiting"],
+                "rejected": slots["rejected"],
+                "errors": self.errors,
+                "retries": self.retried
+            }
+        stats["latency"] = self.latency.snapshot()
+        return stats
+
+    async def aclose(self):
+        await self.client.aclose()